@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Quiz, Question, Option, QuizAttempt, UserProfile, QuizRating, Server, ServerQuiz
+from .models import Quiz, Question, Option, QuizAttempt, UserProfile, QuizRating, Server, ServerQuiz, GradingVerdict, GeneratedQuizCache, DocumentText, GenerationJob, Conversation, ChatMessage
 # Register your models here.
 admin.site.register(Quiz)
 admin.site.register(Question)
@@ -9,3 +9,9 @@ admin.site.register(UserProfile)
 admin.site.register(QuizRating)
 admin.site.register(Server)
 admin.site.register(ServerQuiz)
+admin.site.register(GradingVerdict)
+admin.site.register(GeneratedQuizCache)
+admin.site.register(DocumentText)
+admin.site.register(GenerationJob)
+admin.site.register(Conversation)
+admin.site.register(ChatMessage)
@@ -0,0 +1,80 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.core.management.base import BaseCommand
+from django.db import connection
+from governor import llm_context
+
+
+class QueueWorkerCommand(BaseCommand):
+    """
+    Base for the worker commands that process a database-backed queue.
+    Subclasses set `worker_settings` and implement claim / process / requeue_stale.
+    """
+    worker_settings = {}
+    worker_name = "Worker"
+
+    def claim(self, limit: int) -> list:
+        raise NotImplementedError
+
+    def process(self, item_id):
+        raise NotImplementedError
+
+    def requeue_stale(self, stale_after: int) -> int:
+        return 0
+
+    def describe(self, item_id, result) -> str:
+        return f"{item_id} done"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, default=self.worker_settings.get("CONCURRENCY", 4),
+            help="Number of items processed at the same time.",
+        )
+        parser.add_argument(
+            "--poll-interval", type=float, default=self.worker_settings.get("POLL_INTERVAL", 2),
+            help="Seconds to wait between queue checks when idle.",
+        )
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Exit once the queue is empty instead of waiting for new items.",
+        )
+
+    def run_item(self, item_id):
+        try:
+            # Queued work yields to the AI calls of live requests
+            with llm_context(priority="background"):
+                return self.process(item_id)
+        finally:
+            # Every pool thread has its own DB connection
+            connection.close()
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options["concurrency"])
+        stale_after = self.worker_settings.get("STALE_AFTER", 600)
+        in_flight = {}
+
+        self.stdout.write(f"{self.worker_name} started (concurrency {concurrency})")
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while True:
+                self.requeue_stale(stale_after)
+
+                free_slots = concurrency - len(in_flight)
+                if free_slots:
+                    for item_id in self.claim(free_slots):
+                        in_flight[pool.submit(self.run_item, item_id)] = item_id
+
+                if not in_flight:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                done, _ = wait(in_flight, timeout=options["poll_interval"], return_when=FIRST_COMPLETED)
+                for future in done:
+                    item_id = in_flight.pop(future)
+                    try:
+                        self.stdout.write(self.describe(item_id, future.result()))
+                    except Exception as e:
+                        self.stderr.write(f"{item_id} failed: {e}")
+
+        self.stdout.write(f"{self.worker_name}: queue is empty")
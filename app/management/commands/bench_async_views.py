@@ -0,0 +1,115 @@
+import time
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the sync (WSGI) and async (ASGI) chat endpoints under concurrent load, "
+        "with the stub AI backend and a throwaway database. The WSGI side gets a fixed "
+        "number of worker threads, like a threaded WSGI server. Under ASGI Django gives each "
+        "request its own executor for sync code (middleware, ORM); those threads sit idle "
+        "while the request waits for the AI."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Requests sent to each endpoint.")
+        parser.add_argument("--threads", type=int, default=32, help="WSGI worker threads.")
+        parser.add_argument("--latency", type=float, default=2.0, help="Stub AI latency in seconds.")
+
+    def setup(self, options):
+        """
+        Stub backend with the requested latency, and no governor or rate limit in the way.
+        """
+        import llm
+        import governor
+        import resilience
+
+        llm._backend = llm.StubBackend(latency=options["latency"])
+        governor.governor.max_concurrency = options["requests"] * 2
+        governor.governor.max_queue = options["requests"] * 2
+        governor.user_buckets.rate = governor.user_buckets.burst = float(options["requests"] * 10)
+        resilience._pool = ThreadPoolExecutor(max_workers=options["threads"], thread_name_prefix="llm-call")
+
+    def run_wsgi(self, total, threads) -> list:
+        import httpx
+        from django.core.wsgi import get_wsgi_application
+
+        client = httpx.Client(transport=httpx.WSGITransport(app=get_wsgi_application()), base_url="http://bench")
+
+        def send(index):
+            started = time.perf_counter()
+            response = client.post("/api/chat/", json={"query": f"question {index}"})
+            return response.status_code, time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            return list(pool.map(send, range(total)))
+
+    async def run_asgi(self, total) -> list:
+        import httpx
+        from django.core.asgi import get_asgi_application
+
+        transport = httpx.ASGITransport(app=get_asgi_application())
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def send(index):
+                started = time.perf_counter()
+                response = await client.post("/api/async/chat/", json={"query": f"question {index}"})
+                return response.status_code, time.perf_counter() - started
+
+            return await asyncio.gather(*(send(index) for index in range(total)))
+
+    def report(self, name, results, elapsed, peak_threads):
+        latencies = sorted(seconds for _, seconds in results)
+        ok = sum(1 for code, _ in results if code == 200)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f"{name:<6} {ok:>4}/{len(results):<4} {elapsed:>8.2f}s {len(results) / elapsed:>9.1f} "
+            f"{latencies[len(latencies) // 2] * 1000:>8.0f}ms {p95 * 1000:>8.0f}ms {peak_threads:>8}"
+        )
+
+    def measure(self, run):
+        """
+        Runs `run` while sampling the number of live threads.
+        Returns (results, elapsed seconds, peak thread count).
+        """
+        peak = [threading.active_count()]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(0.01):
+                peak[0] = max(peak[0], threading.active_count())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            results = run()
+        finally:
+            done.set()
+            sampler.join()
+        # The sampler itself isn't part of the load
+        return results, time.perf_counter() - started, peak[0] - 1
+
+    def handle(self, *args, **options):
+        total = options["requests"]
+        with tempfile.TemporaryDirectory() as directory:
+            connection.settings_dict["TEST"]["NAME"] = f"{directory}/bench.sqlite3"
+            connection.settings_dict["OPTIONS"]["timeout"] = 60
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self.setup(options)
+                self.stdout.write(
+                    f"{total} chat requests, stub latency {options['latency']}s, {options['threads']} WSGI threads"
+                )
+                self.stdout.write(
+                    f"{'server':<6} {'ok':>9} {'wall':>9} {'req/s':>9} {'p50':>10} {'p95':>10} {'threads':>8}"
+                )
+                self.report("wsgi", *self.measure(lambda: self.run_wsgi(total, options["threads"])))
+                self.report("asgi", *self.measure(lambda: asyncio.run(self.run_asgi(total))))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,91 @@
+import time
+import difflib
+import tracemalloc
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from processing import HtmlTextExtractor, MAX_SOURCE_CHARS
+
+
+def soup_text(html: bytes, max_chars: int) -> str:
+    """The previous extractor: a full BeautifulSoup tree with html.parser."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript", "header", "footer", "nav", "aside"]):
+        tag.extract()
+    return " ".join(soup.get_text(separator=" ", strip=True).split())[:max_chars]
+
+
+def streamed_text(html: bytes, max_chars: int, chunk_size: int = 64 * 1024) -> str:
+    """The streaming extractor, fed in download-sized chunks like read_page_text."""
+    extractor = HtmlTextExtractor(max_chars)
+    for start in range(0, len(html), chunk_size):
+        if extractor.feed(html[start:start + chunk_size]):
+            break
+    return extractor.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the streaming lxml HTML extractor with the previous BeautifulSoup one "
+        "over saved pages: time, peak memory and how closely the texts agree."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Saved .html files or directories of them.")
+        parser.add_argument("--max-chars", type=int, default=MAX_SOURCE_CHARS, help="Text budget per page.")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per page, the fastest counts.")
+
+    def pages(self, paths) -> list:
+        files = []
+        for path in map(Path, paths):
+            files.extend(sorted(path.rglob("*.htm*")) if path.is_dir() else [path])
+        if not files:
+            raise CommandError("No .html files found.")
+        return files
+
+    def measure(self, extract, html, max_chars, repeat) -> tuple:
+        """
+        Returns (text, fastest seconds, peak traced bytes).
+        """
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            text = extract(html, max_chars)
+            best = min(best, time.perf_counter() - started)
+        tracemalloc.start()
+        extract(html, max_chars)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return text, best, peak
+
+    def handle(self, *args, **options):
+        max_chars, repeat = options["max_chars"], options["repeat"]
+        totals = {"bytes": 0, "soup": 0.0, "lxml": 0.0}
+        self.stdout.write(
+            f"{'page':<32} {'KB':>7} {'soup':>9} {'lxml':>9} {'soup mem':>9} {'lxml mem':>9} {'match':>7}"
+        )
+        for path in self.pages(options["paths"]):
+            html = path.read_bytes()
+            old, old_time, old_peak = self.measure(soup_text, html, max_chars, repeat)
+            new, new_time, new_peak = self.measure(streamed_text, html, max_chars, repeat)
+            # Word-level agreement of the two texts (1.0 = identical)
+            match = 1.0 if old == new else difflib.SequenceMatcher(
+                None, old.split(), new.split(), autojunk=False
+            ).ratio()
+            totals["bytes"] += len(html)
+            totals["soup"] += old_time
+            totals["lxml"] += new_time
+            self.stdout.write(
+                f"{path.name[:32]:<32} {len(html) / 1024:>7.0f} {old_time * 1000:>7.1f}ms {new_time * 1000:>7.1f}ms "
+                f"{old_peak / 2**20:>7.1f}MB {new_peak / 2**20:>7.1f}MB {match:>7.3f}"
+            )
+
+        megabytes = totals["bytes"] / 2**20
+        self.stdout.write(
+            f"{'total':<32} {totals['bytes'] / 1024:>7.0f} {totals['soup'] * 1000:>7.1f}ms {totals['lxml'] * 1000:>7.1f}ms"
+        )
+        self.stdout.write(
+            f"throughput: soup {megabytes / totals['soup']:.1f} MB/s, lxml {megabytes / totals['lxml']:.1f} MB/s "
+            f"({totals['soup'] / totals['lxml']:.1f}x)"
+        )
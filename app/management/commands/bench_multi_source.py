@@ -0,0 +1,79 @@
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+import fetching
+import generation
+from condensation import condense_sources
+from processing import fetch_text_from_url
+
+
+class SlowPageHandler(BaseHTTPRequestHandler):
+    """
+    Serves /<milliseconds>/<name>: an HTML page sent after that delay.
+    """
+
+    def do_GET(self):
+        delay = int(self.path.strip("/").split("/")[0])
+        time.sleep(delay / 1000)
+        words = " ".join(f"{self.path} sentence {index} about photosynthesis and light." for index in range(400))
+        body = f"<html><body><nav>menu</nav><article><p>{words}</p></article></body></html>".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Times reading several URLs for one quiz: one after another with fetch_text_from_url, "
+        "and concurrently with the multi-source mode. The pages come from a local server "
+        "with a delay per page; each page has its own loopback host (127.0.0.N) so the "
+        "per-host limit doesn't apply, except with --same-host. The URL cache is off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--delays", default="300,800,500,1500,200,1000", help="Page delays in milliseconds.")
+        parser.add_argument("--same-host", action="store_true", help="Serve every page from one host.")
+
+    def handle(self, *args, **options):
+        delays = [int(delay) for delay in options["delays"].split(",")]
+        fetching.FETCH_SETTINGS["CACHE"] = False
+        server = ThreadingHTTPServer(("", 0), SlowPageHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+        host = lambda index: "127.0.0.1" if options["same_host"] else f"127.0.0.{index + 1}"
+        urls = [f"http://{host(index)}:{port}/{delay}/page{index}" for index, delay in enumerate(delays)]
+        try:
+            # Warm up both paths: imports, the requests session and the httpx setup
+            fetch_text_from_url(f"http://{host(0)}:{port}/0/warmup")
+            async_to_sync(generation.aread_sources)([f"http://{host(0)}:{port}/0/warmup"], [])
+
+            started = time.perf_counter()
+            texts = [fetch_text_from_url(url) for url in urls]
+            sequential = time.perf_counter() - started
+
+            started = time.perf_counter()
+            sources = async_to_sync(generation.aread_sources)(urls, [])
+            concurrent = time.perf_counter() - started
+        finally:
+            server.shutdown()
+
+        started = time.perf_counter()
+        context = condense_sources(sources)
+        merge = time.perf_counter() - started
+
+        self.stdout.write(f"{len(urls)} pages, delays {delays} ms (sum {sum(delays)} ms, slowest {max(delays)} ms)")
+        self.stdout.write(f"sequential  {sequential * 1000:>7.0f}ms  {sum(map(len, texts)) // 1000}k chars")
+        self.stdout.write(
+            f"concurrent  {concurrent * 1000:>7.0f}ms  {sum(len(text) for _, text in sources) // 1000}k chars"
+        )
+        self.stdout.write(
+            f"merging {len(sources)} sources into one context took {merge * 1000:.0f}ms, "
+            f"{len(context) // 1000}k chars"
+        )
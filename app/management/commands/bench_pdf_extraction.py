@@ -0,0 +1,73 @@
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+import processing
+
+
+def read_every_page(path, max_chars=processing.MAX_SOURCE_CHARS) -> str:
+    """The previous extractor: every page in order, up to MAX_SOURCE_CHARS."""
+    import PyPDF2
+
+    pages = []
+    size = 0
+    for page in PyPDF2.PdfReader(path).pages:
+        page_text = page.extract_text() or ""
+        pages.append(page_text)
+        size += len(page_text)
+        if size >= max_chars:
+            break
+    return " ".join(" ".join(pages).split())[:max_chars]
+
+
+class Command(BaseCommand):
+    help = (
+        "Times PDF text extraction on sample PDFs: the previous read-every-page extractor, "
+        "the budgeted extractor in this process and on the process pool, and a page range."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="PDF files or directories of them.")
+        parser.add_argument("--max-chars", type=int, default=processing.PDF_MAX_CHARS, help="Text budget.")
+        parser.add_argument("--page-range", default="1-10", help="Range timed in the 'range' column.")
+        parser.add_argument("--processes", type=int, default=4, help="Process pool size for the 'pool' column.")
+
+    def pdfs(self, paths) -> list:
+        files = []
+        for path in map(Path, paths):
+            files.extend(sorted(path.rglob("*.pdf")) if path.is_dir() else [path])
+        if not files:
+            raise CommandError("No PDF files found.")
+        return files
+
+    def timed(self, extract) -> tuple:
+        started = time.perf_counter()
+        text = extract()
+        return time.perf_counter() - started, len(text)
+
+    def handle(self, *args, **options):
+        import PyPDF2
+
+        max_chars = options["max_chars"]
+        processing.PDF_PROCESSES = options["processes"]
+        # Start the pool processes up front, their startup isn't part of a request
+        list(processing.get_pdf_pool().map(abs, range(options["processes"])))
+
+        def budgeted(path, processes, page_range=""):
+            processing.PDF_PROCESSES = processes
+            with open(path, "rb") as file:
+                return processing.extract_text_from_pdf(file, page_range, max_chars)
+
+        self.stdout.write(
+            f"{'document':<30} {'pages':>6} {'KB':>7} {'before':>14} {'budget':>14} {'pool':>14} {'range':>14}"
+        )
+        for path in self.pdfs(options["paths"]):
+            pages = len(PyPDF2.PdfReader(path).pages)
+            results = [
+                self.timed(lambda: read_every_page(path)),
+                self.timed(lambda: budgeted(path, 1)),
+                self.timed(lambda: budgeted(path, options["processes"])),
+                self.timed(lambda: budgeted(path, 1, options["page_range"])),
+            ]
+            columns = " ".join(f"{seconds * 1000:>7.0f}ms {chars // 1000:>4}k" for seconds, chars in results)
+            self.stdout.write(f"{path.name[:30]:<30} {pages:>6} {path.stat().st_size / 1024:>7.0f} {columns}")
+        self.stdout.write("Each column: time and characters of text extracted.")
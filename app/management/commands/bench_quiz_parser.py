@@ -0,0 +1,177 @@
+import re
+import json
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from processing import parse_quiz_response
+
+# Synthetic replies written to reproduce production layouts; the expected parses are
+# hand-written, so accuracy here is agreement with them rather than with real traffic
+CORPUS = Path(__file__).resolve().parent / "quiz_corpus"
+QUESTION_FIELDS = ["text", "type", "answer", "difficulty", "mcq_options"]
+
+
+def previous_classify_question(text):
+    """The previous classify_question."""
+    mcq_option_pattern = r"(?:\([a-z]\)|[a-z]\))\s*([^\n\r]+)"
+    mcq_options = re.findall(mcq_option_pattern, text, flags=re.IGNORECASE)
+
+    if re.search(r"True or False|True/False|True or false", text, re.IGNORECASE):
+        q_type = "TF"
+    elif mcq_options:
+        q_type = "MCQ"
+    elif re.search(r"_{3,}|____|blank", text, re.IGNORECASE):
+        q_type = "FILL"
+    else:
+        q_type = "SHORT"
+
+    if q_type == "MCQ":
+        parts = re.split(r"(?:\n|\r\n)", text)
+        non_option_lines = [p for p in parts if not re.match(r"^\s*(?:\([a-z]\)|[a-z]\))", p, re.IGNORECASE)]
+        question_text_clean = " ".join(non_option_lines).strip()
+    else:
+        question_text_clean = text
+
+    return q_type, question_text_clean, mcq_options
+
+def previous_parse_quiz_response(response_text):
+    """The previous parser: repeated splits and regex searches over the whole reply."""
+    response_text = (response_text or "").strip()
+
+    topic_match = re.search(r"Topic:\s*(.+?)\s*\(Difficulty\s*(\d+)\)", response_text, re.IGNORECASE)
+    topic = topic_match.group(1).strip() if topic_match else "Untitled Quiz"
+    quiz_difficulty = int(topic_match.group(2)) if topic_match else 1
+
+    questions_part = ""
+    answers_part = ""
+    difficulty_part = ""
+    if "Questions:" in response_text and "Answers:" in response_text:
+        try:
+            questions_part = response_text.split("Questions:")[1].split("Answers:")[0].strip()
+            answers_part = response_text.split("Answers:")[1]
+            if "Question Difficulty Levels:" in answers_part:
+                answers_part, difficulty_part = answers_part.split("Question Difficulty Levels:")
+                answers_part = answers_part.strip()
+                difficulty_part = difficulty_part.strip()
+            else:
+                answers_part = answers_part.strip()
+        except Exception:
+            questions_part = ""
+            answers_part = ""
+
+    question_blocks = re.split(r"\n\s*\d+\.\s*", questions_part)
+    if question_blocks and question_blocks[0].strip() == "":
+        question_blocks = question_blocks[1:]
+
+    answers = re.findall(r"\d+\.\s*(.+)", answers_part) if answers_part else []
+
+    if not answers and answers_part:
+        answers = [line.strip() for line in answers_part.splitlines() if line.strip()]
+
+    difficulties = {}
+    if difficulty_part:
+        for line in difficulty_part.splitlines():
+            m = re.search(r"Q\s*(\d+)\s*[^0-9]*\s*:?(\d+)", line) or re.search(r"(\d+)\.\s*Q\d+\s*→\s*Difficulty:\s*(\d+)", line)
+            if not m:
+                m = re.search(r"Q(\d+)\s*→\s*Difficulty:\s*(\d+)", line)
+            if m:
+                try:
+                    q_idx = int(m.group(1))
+                    q_diff = int(m.group(2))
+                    difficulties[q_idx] = q_diff
+                except Exception:
+                    pass
+
+    parsed_questions = []
+    for idx, q_text in enumerate(question_blocks, start=1):
+        text = q_text.strip()
+        if not text:
+            continue
+
+        q_type, question_text_clean, mcq_options = previous_classify_question(text)
+
+        answer_text = ""
+        if idx-1 < len(answers):
+            answer_text = answers[idx-1].strip()
+        parsed_questions.append({
+            "text": question_text_clean,
+            "raw_text": text,            
+            "type": q_type,
+            "answer": answer_text,
+            "difficulty": difficulties.get(idx, quiz_difficulty),
+            "mcq_options": mcq_options
+        })
+
+    return {
+        "topic": topic,
+        "difficulty": quiz_difficulty,
+        "category": re.search(r"Category:\s*(.+)", response_text, re.IGNORECASE).group(1).strip() if re.search(r"Category:\s*(.+)", response_text, re.IGNORECASE) else "General",
+        "questions": parsed_questions
+    }
+
+
+def score(parsed, expected) -> tuple:
+    """
+    (fields right, fields expected): topic, difficulty, category, the question count
+    and each expected question's QUESTION_FIELDS. raw_text isn't scored.
+    """
+    right = sum(parsed[key] == expected[key] for key in ("topic", "difficulty", "category"))
+    right += len(parsed["questions"]) == len(expected["questions"])
+    total = 4 + len(QUESTION_FIELDS) * len(expected["questions"])
+    for got, wanted in zip(parsed["questions"], expected["questions"]):
+        right += sum(got[field] == wanted[field] for field in QUESTION_FIELDS)
+    return right, total
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares parse_quiz_response with the previous parser on a synthetic corpus of "
+        "quiz replies (quiz_corpus/*.txt, with a hand-written expected parse in the "
+        "matching .json): accuracy of the parsed fields and parse throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corpus", default=str(CORPUS), help="Directory of .txt replies and .json expectations.")
+        parser.add_argument("--repeat", type=int, default=200, help="Passes over the corpus when timing.")
+        parser.add_argument("--verbose", action="store_true", help="List the replies each parser gets wrong.")
+
+    def load(self, directory) -> list:
+        cases = []
+        for path in sorted(Path(directory).glob("*.txt")):
+            expected = path.with_suffix(".json")
+            if not expected.exists():
+                raise CommandError(f"{path.name} has no {expected.name}")
+            text = path.read_text(encoding="utf-8")
+            cases.append((path.stem, text, json.loads(expected.read_text(encoding="utf-8"))))
+        if not cases:
+            raise CommandError("No replies found.")
+        return cases
+
+    def handle(self, *args, **options):
+        cases = self.load(options["corpus"])
+        megabytes = sum(len(text.encode("utf-8")) for _, text, _ in cases) / 2**20
+        parsers = [("previous", previous_parse_quiz_response), ("current", parse_quiz_response)]
+
+        self.stdout.write(f"{len(cases)} synthetic replies, {megabytes * 1024:.0f} KB, {options['repeat']} passes")
+        self.stdout.write(f"{'parser':<10} {'accuracy':>9} {'exact':>7} {'replies/s':>10} {'MB/s':>7}")
+        timings = {}
+        for name, parse in parsers:
+            right = total = exact = 0
+            for stem, text, expected in cases:
+                case_right, case_total = score(parse(text), expected)
+                right += case_right
+                total += case_total
+                exact += case_right == case_total
+                if options["verbose"] and case_right != case_total:
+                    self.stdout.write(f"  {name}: {stem} {case_right}/{case_total}")
+
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                for _, text, _ in cases:
+                    parse(text)
+            timings[name] = time.perf_counter() - started
+            self.stdout.write(
+                f"{name:<10} {right / total:>9.1%} {exact:>3}/{len(cases):<3} "
+                f"{len(cases) * options['repeat'] / timings[name]:>10.0f} {megabytes * options['repeat'] / timings[name]:>7.2f}"
+            )
+        self.stdout.write(f"speedup: {timings['previous'] / timings['current']:.2f}x")
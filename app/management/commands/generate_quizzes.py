@@ -0,0 +1,21 @@
+from django.conf import settings
+from generation import claim_pending_jobs, requeue_stale_jobs, run_generation_job
+from ._worker import QueueWorkerCommand
+
+
+class Command(QueueWorkerCommand):
+    help = "Runs queued quiz generation jobs, using the database as the queue."
+    worker_name = "Generation worker"
+    worker_settings = getattr(settings, "GENERATION_WORKER", {})
+
+    def claim(self, limit):
+        return claim_pending_jobs(limit)
+
+    def process(self, job_id):
+        return run_generation_job(job_id)
+
+    def requeue_stale(self, stale_after):
+        return requeue_stale_jobs(stale_after)
+
+    def describe(self, job_id, job):
+        return f"Job {job_id} done: quiz {job.quiz_id}"
@@ -0,0 +1,21 @@
+from django.conf import settings
+from grading import claim_pending_attempts, requeue_stale_attempts, finish_attempt_grading
+from ._worker import QueueWorkerCommand
+
+
+class Command(QueueWorkerCommand):
+    help = "Grades quiz attempts submitted in async mode, using the database as the queue."
+    worker_name = "Grading worker"
+    worker_settings = getattr(settings, "GRADING_WORKER", {})
+
+    def claim(self, limit):
+        return claim_pending_attempts(limit)
+
+    def process(self, attempt_id):
+        return finish_attempt_grading(attempt_id)
+
+    def requeue_stale(self, stale_after):
+        return requeue_stale_attempts(stale_after)
+
+    def describe(self, attempt_id, attempt):
+        return f"Attempt {attempt_id} graded: {attempt.score}"
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import subprocess
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+MARKER = "-- import_times --"
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports the cold import time of project modules. Each module is imported in a "
+        "fresh interpreter (after django.setup()) with `python -X importtime`."
+    )
+
+    DEFAULT_MODULES = [
+        "llm",
+        "services",
+        "processing",
+        "grading",
+        "generation",
+        "app.views",
+        "quizhippo.views",
+        "quizapp.urls",
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument("modules", nargs="*", help="Modules to measure (default: the project modules).")
+        parser.add_argument("--top", type=int, default=3, help="Heaviest nested imports listed per module.")
+
+    def measure(self, module: str) -> tuple:
+        """
+        Imports `module` in a new interpreter.
+        Returns (wall seconds, cumulative import µs, [(µs, nested module)]).
+        """
+        code = (
+            "import sys, django; django.setup(); "
+            f"sys.stderr.write({MARKER!r} + '\\n'); "
+            f"import {module}"
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        wall = time.perf_counter() - started
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+        lines = result.stderr.split(MARKER, 1)[-1].splitlines()
+        entries = []
+        for line in lines:
+            if not line.startswith("import time:"):
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|", 2)
+            if not cumulative.strip().isdigit():
+                continue
+            depth = len(name) - len(name.lstrip())
+            entries.append((depth, int(cumulative), name.strip()))
+
+        total = next((us for _, us, name in entries if name == module), 0)
+        if not entries:
+            return wall, total, []
+        # Direct children of the top-level imports triggered by the module
+        top_depth = min(depth for depth, _, _ in entries)
+        nested = sorted(
+            ((us, name) for depth, us, name in entries if depth == top_depth + 2 or (depth == top_depth and name != module)),
+            reverse=True,
+        )
+        return wall, total, nested
+
+    def handle(self, *args, **options):
+        modules = options["modules"] or self.DEFAULT_MODULES
+        self.stdout.write(f"{'module':<24} {'import':>10} {'process':>10}")
+        for module in modules:
+            try:
+                wall, total, nested = self.measure(module)
+            except RuntimeError as e:
+                self.stderr.write(f"{module:<24} failed: {e}")
+                continue
+            self.stdout.write(f"{module:<24} {total / 1000:>8.1f}ms {wall * 1000:>8.0f}ms")
+            for us, name in nested[:options["top"]]:
+                self.stdout.write(f"    {name:<36} {us / 1000:>8.1f}ms")
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_userprofile_light_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradingVerdict',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answer_hash', models.CharField(max_length=64)),
+                ('expected_hash', models.CharField(max_length=64)),
+                ('is_correct', models.BooleanField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='verdicts', to='app.question')),
+            ],
+            options={
+                'unique_together': {('question', 'answer_hash')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_gradingverdict'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizattempt',
+            name='results',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('grading', 'Grading'), ('graded', 'Graded'), ('failed', 'Failed')], default='graded', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_quizattempt_status_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneratedQuizCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('raw_output', models.TextField()),
+                ('parsed', models.JSONField(default=dict)),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_conversation_chatmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('content_hash', models.CharField(db_index=True, max_length=64)),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('size', models.BigIntegerField(default=0)),
+                ('page_range', models.CharField(blank=True, max_length=100)),
+                ('text', models.TextField()),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
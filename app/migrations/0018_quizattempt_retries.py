@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_documenttext'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizattempt',
+            name='grading_attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='run_after',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -3,6 +3,7 @@ from django.db import models
 import uuid
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -72,6 +73,14 @@ class Question(models.Model):
     answer = models.CharField(max_length=200)
     user_answer = models.CharField(max_length=1020, null=True, blank=True)
 
+    def save(self, *args, **kwargs):
+        # Cached grading verdicts are only valid for the answer they were graded against
+        if self.pk:
+            old_answer = Question.objects.filter(pk=self.pk).values_list("answer", flat=True).first()
+            if old_answer is not None and old_answer != self.answer:
+                self.verdicts.all().delete()
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.text
 
@@ -83,12 +92,96 @@ class Option(models.Model):
     def __str__(self):
         return self.text
 
+class GradingVerdict(models.Model):
+    """Cached AI verdict for one (question, normalized answer) pair."""
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name="verdicts")
+    answer_hash = models.CharField(max_length=64)
+    expected_hash = models.CharField(max_length=64)  # hash of Question.answer when graded
+    is_correct = models.BooleanField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('question', 'answer_hash')
+
+    def __str__(self):
+        return f"{self.question_id}:{self.answer_hash[:8]} ({self.is_correct})"
+
+class GeneratedQuizCache(models.Model):
+    """AI output for one set of generation parameters, reused for identical requests."""
+    key = models.CharField(max_length=64, unique=True)  # SHA-256 of the normalized parameters
+    raw_output = models.TextField()
+    parsed = models.JSONField(default=dict)  # parse_quiz_response output
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.parsed.get('topic', 'Quiz')} ({self.key[:8]})"
+
+class DocumentText(models.Model):
+    """Condensed text of an uploaded document, reused when the same file is uploaded again."""
+    key = models.CharField(max_length=64, unique=True)  # SHA-256 of the file hash, page range and token budget
+    content_hash = models.CharField(max_length=64, db_index=True)  # SHA-256 of the file content
+    name = models.CharField(max_length=255, blank=True)  # file name of the first upload
+    size = models.BigIntegerField(default=0)
+    page_range = models.CharField(max_length=100, blank=True)
+    text = models.TextField()
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name or 'Document'} ({self.content_hash[:8]})"
+
+class GenerationJob(models.Model):
+    STATUSES = [
+        ('pending', 'Pending'),    # waiting for the generation worker
+        ('running', 'Running'),    # claimed by a generation worker
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    STAGES = [
+        ('queued', 'Queued'),
+        ('fetching', 'Fetching content'),
+        ('generating', 'Generating questions'),
+        ('saving', 'Saving quiz'),
+        ('done', 'Done'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name="generation_jobs")
+    params = models.JSONField(default=dict)  # GenerateQuizAPI fields
+    upload = models.FileField(upload_to='generation_uploads/', null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default="pending")
+    stage = models.CharField(max_length=20, choices=STAGES, default="queued")
+    progress = models.IntegerField(default=0)  # 0-100
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    quiz = models.ForeignKey(Quiz, on_delete=models.SET_NULL, null=True, blank=True)
+    run_after = models.DateTimeField(auto_now_add=True)  # retries wait until this time
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status}, {self.stage})"
+
 class QuizAttempt(models.Model):
+    STATUSES = [
+        ('pending', 'Pending'),    # waiting for the grading worker
+        ('grading', 'Grading'),    # claimed by a grading worker
+        ('graded', 'Graded'),
+        ('failed', 'Failed'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
     score = models.IntegerField(default=0)
     answers = models.JSONField(default=dict)  # e.g. {question_id: "user_answer"}
+    results = models.JSONField(default=dict)  # e.g. {question_id: true/false} for graded questions
+    status = models.CharField(max_length=10, choices=STATUSES, default="graded")
+    grading_attempts = models.IntegerField(default=0)  # grading worker runs
+    run_after = models.DateTimeField(default=timezone.now)  # retries wait until this time
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
 
     def __str__(self):
         return f"{self.user.username} - {self.quiz.topic} ({self.score})"
@@ -117,3 +210,31 @@ class ServerQuiz(models.Model):
 
     def __str__(self):
         return f"{self.quiz.topic} → {self.server.name}"
+
+class Conversation(models.Model):
+    """Chat history with Professor Hippo, one per user (or per session for guests)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name="conversations")
+    session_key = models.CharField(max_length=64, blank=True)
+    summary = models.TextField(blank=True)  # rolling summary of the archived messages
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        owner = self.user.username if self.user else self.session_key
+        return f"Conversation of {owner}"
+
+
+class ChatMessage(models.Model):
+    ROLES = [
+        ('user', 'User'),
+        ('assistant', 'Assistant'),
+    ]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="messages")
+    role = models.CharField(max_length=10, choices=ROLES)
+    content = models.TextField()
+    archived = models.BooleanField(default=False)  # out of the prompt window (folded into the summary)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.role}: {self.content[:50]}"
@@ -1,3 +1,882 @@
-from django.test import TestCase
+import asyncio
+import functools
+import io
+import json
+import string
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from asgiref.sync import async_to_sync
+import httpx
+import requests
+import fetching
+import generation
+from condensation import condense_text
+import services
+from services import estimate_tokens
+import grading
+from grading import fuzzy_grade
+import processing
+from processing import QuizStreamParser, parse_quiz_response
+from app.management.commands.bench_quiz_parser import CORPUS
+from app.models import DocumentText, GeneratedQuizCache, GenerationJob, GradingVerdict, Quiz, Question, Option, QuizAttempt
+from governor import LLMBusyError
+from llm import StubBackend
+from pydantic import ValidationError
+from quiz_schema import QuizQuestion
 
-# Create your tests here.
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class GenerationJobQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("queue", password="pw")
+        patcher = mock.patch("llm._backend", StubBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def queue(self, **params):
+        return GenerationJob.objects.create(user=self.user, params={"topic": "Water", "num_questions": 3, **params})
+
+    def test_claim_takes_each_due_job_once(self):
+        first, second = self.queue(), self.queue()
+        later = self.queue()
+        GenerationJob.objects.filter(id=later.id).update(run_after=timezone.now() + timedelta(minutes=5))
+
+        self.assertEqual(generation.claim_pending_jobs(5), [first.id, second.id])
+        self.assertEqual(generation.claim_pending_jobs(5), [])
+        self.assertEqual(GenerationJob.objects.get(id=first.id).status, "running")
+
+    def test_requeue_only_stale_running_jobs(self):
+        stale, fresh = self.queue(), self.queue()
+        GenerationJob.objects.filter(id__in=[stale.id, fresh.id]).update(status="running")
+        GenerationJob.objects.filter(id=stale.id).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(generation.requeue_stale_jobs(900), 1)
+        self.assertEqual(GenerationJob.objects.get(id=stale.id).status, "pending")
+        self.assertEqual(GenerationJob.objects.get(id=fresh.id).status, "running")
+
+    def test_transient_error_requeues_with_backoff(self):
+        job = self.queue()
+        with mock.patch("generation.generate_parsed_quiz", side_effect=TimeoutError("upstream")):
+            with self.assertRaises(TimeoutError):
+                generation.run_generation_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("pending", 1))
+        self.assertGreater(job.run_after, timezone.now())
+
+    def test_upload_is_deleted_when_the_job_is_done(self):
+        upload = SimpleUploadedFile("notes.txt", b"Water boils at 100 degrees.\n" * 20)
+        job = generation.queue_generation_job(self.user, {"topic": "Water", "num_questions": 3}, [upload])
+        storage, name = job.upload.storage, job.upload.name
+        self.assertTrue(storage.exists(name))
+
+        job = generation.run_generation_job(job.id)
+        self.assertEqual(job.status, "done")
+        self.assertFalse(job.upload)
+        self.assertFalse(storage.exists(name))
+
+    def test_upload_is_deleted_when_the_job_fails(self):
+        upload = SimpleUploadedFile("notes.txt", b"Water boils at 100 degrees.\n" * 20)
+        job = generation.queue_generation_job(self.user, {"topic": "Water"}, [upload])
+        storage, name = job.upload.storage, job.upload.name
+
+        with mock.patch("generation.generate_parsed_quiz", side_effect=ValueError("bad reply")):
+            with self.assertRaises(ValueError):
+                generation.run_generation_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertFalse(storage.exists(name))
+
+
+class FuzzyGradeTests(SimpleTestCase):
+    def test_exact_and_typo_answers_are_accepted(self):
+        self.assertIs(fuzzy_grade("The Mitochondria", "mitochondria"), True)
+        self.assertIs(fuzzy_grade("photosynthesys", "photosynthesis"), True)
+        self.assertIs(fuzzy_grade("George Washingtn", "George Washington"), True)
+
+    def test_near_miss_words_go_to_the_ai(self):
+        pairs = [
+            ("exothermic", "endothermic"),
+            ("hypothyroidism", "hyperthyroidism"),
+            ("unconstitutional", "constitutional"),
+            ("Nitrate", "Nitrite"),
+            ("sodium chlorite", "sodium chloride"),
+        ]
+        for given, expected in pairs:
+            with self.subTest(given=given):
+                self.assertIsNone(fuzzy_grade(given, expected))
+
+    def test_reordered_words_go_to_the_ai(self):
+        self.assertIsNone(fuzzy_grade("man bites dog", "dog bites man"))
+
+    def test_different_numbers_are_never_accepted(self):
+        self.assertIsNot(fuzzy_grade("1945", "1946"), True)
+
+    def test_unrelated_answers_are_rejected(self):
+        self.assertIs(fuzzy_grade("Jupiter", "Photosynthesis in plants"), False)
+
+
+class QuizSchemaTests(SimpleTestCase):
+    def mcq(self, options, answer):
+        return QuizQuestion(text="Pick one", type="MCQ", options=options, answer=answer)
+
+    def test_labelled_options_are_stripped(self):
+        question = self.mcq(["a) Berlin", "b) Paris", "c) Rome"], "b")
+        self.assertEqual(question.options, ["Berlin", "Paris", "Rome"])
+        self.assertEqual(question.answer, "Paris")
+
+    def test_initials_are_not_labels(self):
+        options = ["F. Scott Fitzgerald", "C. S. Lewis", "Mark Twain"]
+        question = self.mcq(options, "C. S. Lewis")
+        self.assertEqual(question.options, options)
+        self.assertEqual(question.answer, "C. S. Lewis")
+
+    def test_answer_text_wins_over_a_wrong_letter(self):
+        question = self.mcq(["Berlin", "London", "Paris", "Rome"], "b) Paris")
+        self.assertEqual(question.answer, "Paris")
+
+    def test_letter_with_unknown_text_is_invalid(self):
+        with self.assertRaises(ValidationError):
+            self.mcq(["Berlin", "London", "Paris", "Rome"], "b) Madrid")
+
+
+class QuizParserCorpusTests(SimpleTestCase):
+    """Regression checks against the synthetic replies in quiz_corpus (hand-written expectations)."""
+
+    # Unnumbered answers are only recovered by the batch parser
+    BATCH_ONLY = {"15_unnumbered_answers"}
+
+    def cases(self):
+        for path in sorted(CORPUS.glob("*.txt")):
+            yield path.stem, path.read_text(encoding="utf-8"), json.loads(path.with_suffix(".json").read_text(encoding="utf-8"))
+
+    def stream(self, text, chunk_size):
+        parser = QuizStreamParser()
+        events = []
+        for start in range(0, len(text), chunk_size):
+            events.extend(parser.feed(text[start:start + chunk_size]))
+        events.extend(parser.close())
+        return events
+
+    def test_corpus_parses_as_expected(self):
+        for name, text, expected in self.cases():
+            with self.subTest(name):
+                self.assertEqual(parse_quiz_response(text), expected)
+
+    def test_stream_parser_agrees_with_the_corpus(self):
+        for name, text, expected in self.cases():
+            if name in self.BATCH_ONLY or not expected["questions"]:
+                continue
+            for chunk_size in (7, 64, len(text)):
+                with self.subTest(name, chunk_size=chunk_size):
+                    events = self.stream(text, chunk_size)
+                    header = next(data for event, data in events if event == "header")
+                    questions = [data for event, data in events if event == "question"]
+                    answers = [data["answer"] for event, data in events if event == "answer"]
+                    self.assertEqual((header["topic"], header["category"]), (expected["topic"], expected["category"]))
+                    self.assertEqual([q["text"] for q in questions], [q["text"] for q in expected["questions"]])
+                    self.assertEqual([q["mcq_options"] for q in questions], [q["mcq_options"] for q in expected["questions"]])
+                    self.assertEqual(answers[:len(questions)], [q["answer"] for q in expected["questions"]])
+
+    def test_text_on_marker_lines_is_kept(self):
+        parsed = parse_quiz_response("Topic: Water (Difficulty 1)\nQuestions: 1. What is H2O?\nAnswers: 1. Water")
+        self.assertEqual([(q["text"], q["answer"]) for q in parsed["questions"]], [("What is H2O?", "Water")])
+
+
+def make_docx(*paragraphs) -> bytes:
+    """
+    A minimal .docx: one <w:p> per item, each item a list of runs where "\t" is a tab.
+    """
+    body = "".join(
+        "<w:p><w:r>" + "".join("<w:tab/>" if run == "\t" else f"<w:t>{run}</w:t>" for run in runs) + "</w:r></w:p>"
+        for runs in paragraphs
+    )
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as docx:
+        docx.writestr("[Content_Types].xml", '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"/>')
+        docx.writestr(
+            "word/document.xml",
+            f'<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>{body}</w:body></w:document>',
+        )
+    return archive.getvalue()
+
+
+class DocumentExtractionTests(SimpleTestCase):
+    def upload(self, name, content):
+        return SimpleUploadedFile(name, content)
+
+    def test_types_are_sniffed_from_the_content(self):
+        cases = [
+            ("notes.bin", make_docx(["Cells"]), "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+            ("notes.pdf", "Plain text with ü".encode("utf-8"), "text/plain"),
+            ("notes.md", b"# Cells", "text/markdown"),
+            ("notes.txt", b"\x89PNG\r\n\x1a\n" + bytes(32), "image/png"),
+            ("notes.txt", b"\xff\xfe\x00broken", "application/octet-stream"),
+        ]
+        for name, content, expected in cases:
+            with self.subTest(name=name, expected=expected):
+                self.assertEqual(processing.sniff_content_type(self.upload(name, content)), expected)
+
+    def test_docx_paragraphs_and_tabs(self):
+        docx = self.upload("notes.docx", make_docx(["Cells", "\t", "divide"], ["by mitosis."]))
+        self.assertEqual(processing.extract_text_from_upload(docx), "Cells divide by mitosis.")
+
+    def test_markdown_markup_is_dropped(self):
+        text = b"# Cells\n\n- **Mitosis** makes [two cells](https://example.com)\n```python\n![diagram](cell.png)\n"
+        self.assertEqual(
+            processing.extract_text_from_upload(self.upload("notes.md", text)),
+            "Cells Mitosis makes two cells diagram",
+        )
+
+    def test_utf8_text_split_across_chunks(self):
+        upload = self.upload("notes.txt", ("é" * 40000).encode("utf-8"))
+        self.assertEqual(processing.extract_text_from_upload(upload, max_chars=100000), "é" * 40000)
+
+    def test_unsupported_types_are_rejected(self):
+        png = self.upload("notes.txt", b"\x89PNG\r\n\x1a\n" + bytes(32))
+        with self.assertRaisesMessage(processing.UnsupportedFileType, "Unsupported file type (image/png)"):
+            processing.extract_text_from_upload(png)
+
+    def test_reading_stops_at_max_chars(self):
+        read = []
+
+        def lines():
+            for number in range(10000):
+                read.append(number)
+                yield f"line {number}"
+
+        self.assertEqual(processing.collect_lines(lines(), 20), "line 0 line 1 line 2")
+        self.assertEqual(len(read), 3)
+        upload = self.upload("notes.txt", "".join(f"line {number}\n" for number in range(10000)).encode())
+        self.assertEqual(processing.extract_text_from_upload(upload, max_chars=13), "line 0 line 1")
+        docx = self.upload("notes.docx", make_docx(*[[f"paragraph {number}"] for number in range(1000)]))
+        self.assertEqual(processing.extract_text_from_upload(docx, max_chars=23), "paragraph 0 paragraph 1")
+
+def make_pdf(*page_texts) -> bytes:
+    """
+    A minimal PDF with one line of text per page.
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return pdf
+
+
+class PageRangeTests(SimpleTestCase):
+    def test_ranges(self):
+        cases = [
+            ("", [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]),
+            ("  ", [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]),
+            ("3", [2]),
+            ("1-3, 8", [0, 1, 2, 7]),
+            ("5-", [4, 5, 6, 7, 8, 9]),
+            ("-2", [0, 1]),
+            ("2, 2, 1-3", [1, 0, 2]),
+            ("8-20", [7, 8, 9]),
+            ("9, 15", [8]),
+            (" 4 - 5 ,", [3, 4]),
+        ]
+        for page_range, expected in cases:
+            with self.subTest(page_range=page_range):
+                self.assertEqual(processing.parse_page_range(page_range, 10), expected)
+
+    def test_invalid_ranges(self):
+        cases = [
+            ("0", "Invalid page range: '0'"),
+            ("3-1", "Invalid page range: '3-1'"),
+            ("-", "Invalid page range: '-'"),
+            ("one", "Invalid page range: 'one'"),
+            ("2-3-4", "Invalid page range: '2-3-4'"),
+            ("11-", "Invalid page range: '11-'"),
+            ("15", "selects no pages, the PDF has 10"),
+        ]
+        for page_range, message in cases:
+            with self.subTest(page_range=page_range):
+                with self.assertRaisesMessage(ValueError, message):
+                    processing.parse_page_range(page_range, 10)
+
+
+class PdfExtractionTests(SimpleTestCase):
+    def pdf(self, *page_texts):
+        return SimpleUploadedFile("notes.pdf", make_pdf(*page_texts))
+
+    def test_pages_are_read_in_range_order(self):
+        pdf = self.pdf("Page one", "Page two", "Page three")
+        cases = [
+            ("", "Page one Page two Page three"),
+            ("2-", "Page two Page three"),
+            ("3, 1, 3", "Page three Page one"),
+            ("2-9", "Page two Page three"),
+        ]
+        for page_range, expected in cases:
+            with self.subTest(page_range=page_range):
+                self.assertEqual(processing.extract_text_from_pdf(pdf, page_range), expected)
+
+    def test_invalid_range_raises(self):
+        with self.assertRaisesMessage(ValueError, "selects no pages, the PDF has 2"):
+            processing.extract_text_from_pdf(self.pdf("Page one", "Page two"), "5")
+
+    def test_text_input_is_reported(self):
+        text = SimpleUploadedFile("notes.pdf", b"Not a PDF at all")
+        self.assertTrue(processing.extract_text_from_pdf(text).startswith(processing.PDF_ERROR_PREFIX))
+
+    def test_reading_stops_at_max_chars(self):
+        import PyPDF2
+
+        pdf = self.pdf(*[f"Page {number}" for number in range(20)])
+        with mock.patch.object(PyPDF2.PageObject, "extract_text", autospec=True, return_value="x" * 10) as extract:
+            text = processing.extract_text_from_pdf(pdf, max_chars=15)
+        self.assertEqual(text, "x" * 10 + " " + "x" * 4)
+        self.assertEqual(extract.call_count, 2)
+
+
+class FanoutPlanTests(TestCase):
+    def test_chunks_keep_the_requested_type_and_difficulty(self):
+        chunks = generation.plan_chunks(25, 3, "MIX")
+        self.assertEqual([chunk["num_questions"] for chunk in chunks], [9, 8, 8])
+        self.assertEqual({chunk["question_type"] for chunk in chunks}, {"MIX"})
+        self.assertEqual({chunk["difficulty"] for chunk in chunks}, {3})
+        self.assertEqual([chunk["part"] for chunk in chunks], [(1, 3), (2, 3), (3, 3)])
+
+    def test_mixed_fanout_covers_every_question_type(self):
+        with mock.patch("llm._backend", StubBackend()), mock.patch("builtins.print"):
+            _, parsed = generation.generate_fanout_quiz(
+                "Cells", "English", 20, 3, "MIX", "Mitochondria chloroplasts ribosomes membranes nucleus cytoplasm"
+            )
+        self.assertEqual({question["type"] for question in parsed["questions"]}, {"MCQ", "TF", "SHORT", "FILL"})
+
+    def test_shortfall_is_reported(self):
+        duplicate = {"questions": [{"type": "SHORT", "text": "What is a cell?", "answer": "A unit of life"}]}
+        before = generation.generation_cache_stats()["fanout"]["missing_questions"]
+        with mock.patch("generation.generate_quiz_chunk", return_value=("raw", duplicate)) as chunk, \
+                mock.patch("builtins.print") as log:
+            _, parsed = generation.generate_fanout_quiz("Cells", "English", 12, 2, "SHORT", "")
+        self.assertEqual(len(parsed["questions"]), 1)
+        self.assertEqual(parsed["missing_questions"], 11)
+        log.assert_called_once()
+        # Two chunks, then at most MAX_REFILL_ROUNDS follow-ups
+        self.assertEqual(chunk.call_count, 2 + generation.FANOUT_SETTINGS.get("MAX_REFILL_ROUNDS", 2))
+        self.assertEqual(generation.generation_cache_stats()["fanout"]["missing_questions"], before + 11)
+
+
+class GradingQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("grader", password="pw")
+        self.quiz = Quiz.objects.create(topic="Plants", user=self.user)
+        self.question = Question.objects.create(
+            quiz=self.quiz, text="What do leaves make?", question_type="SHORT", answer="Glucose"
+        )
+
+    def pending_attempt(self):
+        return QuizAttempt.objects.create(
+            user=self.user, quiz=self.quiz, status="pending", answers={str(self.question.id): "sugar"}
+        )
+
+    def test_claim_takes_each_due_attempt_once(self):
+        first, later = self.pending_attempt(), self.pending_attempt()
+        QuizAttempt.objects.filter(id=later.id).update(run_after=timezone.now() + timedelta(minutes=5))
+
+        self.assertEqual(grading.claim_pending_attempts(5), [first.id])
+        self.assertEqual(grading.claim_pending_attempts(5), [])
+
+    def test_requeue_only_stale_attempts(self):
+        attempt = self.pending_attempt()
+        QuizAttempt.objects.filter(id=attempt.id).update(status="grading", updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(grading.requeue_stale_attempts(600), 1)
+        self.assertEqual(QuizAttempt.objects.get(id=attempt.id).status, "pending")
+
+    def test_busy_ai_requeues_with_backoff(self):
+        attempt = self.pending_attempt()
+        with mock.patch("grading.grade_submission", side_effect=LLMBusyError("busy")):
+            with self.assertRaises(LLMBusyError):
+                grading.finish_attempt_grading(attempt.id)
+        attempt.refresh_from_db()
+        self.assertEqual((attempt.status, attempt.grading_attempts), ("pending", 1))
+        self.assertGreater(attempt.run_after, timezone.now())
+
+    def test_transient_errors_fail_after_max_attempts(self):
+        attempt = self.pending_attempt()
+        QuizAttempt.objects.filter(id=attempt.id).update(
+            grading_attempts=grading.WORKER_SETTINGS.get("MAX_ATTEMPTS", 5) - 1
+        )
+        with mock.patch("grading.grade_submission", side_effect=TimeoutError("upstream")):
+            with self.assertRaises(TimeoutError):
+                grading.finish_attempt_grading(attempt.id)
+        self.assertEqual(QuizAttempt.objects.get(id=attempt.id).status, "failed")
+
+    def test_other_errors_fail_right_away(self):
+        attempt = self.pending_attempt()
+        with mock.patch("grading.grade_submission", side_effect=ValueError("bad verdict")):
+            with self.assertRaises(ValueError):
+                grading.finish_attempt_grading(attempt.id)
+        self.assertEqual(QuizAttempt.objects.get(id=attempt.id).status, "failed")
+
+    def test_graded_attempt_keeps_local_results(self):
+        attempt = self.pending_attempt()
+        with mock.patch("grading.grade_submission", return_value=(1, {self.question.id: True})):
+            attempt = grading.finish_attempt_grading(attempt.id)
+        self.assertEqual((attempt.status, attempt.score, attempt.results), ("graded", 1, {str(self.question.id): True}))
+
+
+class BatchGradingTests(TestCase):
+    def setUp(self):
+        grading.verdict_cache.memory.clear()
+
+    def test_verdicts_are_read_from_fenced_json(self):
+        verdicts = services.parse_batch_verdicts('```json\n{"12": true, "13": "false", "14": null}\n```')
+        self.assertEqual(verdicts, {"12": True, "13": False})
+
+    def test_verdicts_are_read_from_a_list_with_chatter(self):
+        reply = 'Here you go: [{"id": 3, "correct": true}, {"id": "4", "correct": false}] Good luck!'
+        self.assertEqual(services.parse_batch_verdicts(reply), {"3": True, "4": False})
+
+    def test_unreadable_reply_has_no_verdicts(self):
+        self.assertEqual(services.parse_batch_verdicts("I can't grade these."), {})
+        self.assertEqual(services.parse_batch_verdicts(""), {})
+
+    def test_items_the_model_skipped_are_checked_on_their_own(self):
+        items = [
+            {"id": 1, "type": "SHORT", "question": "Q1", "expected": "Glucose", "given": "sugar"},
+            {"id": 2, "type": "SHORT", "question": "Q2", "expected": "Oxygen", "given": "O2"},
+        ]
+        llm = mock.Mock()
+        llm.invoke.side_effect = [mock.Mock(content='{"1": false}'), mock.Mock(content="true")]
+        with mock.patch("services.get_llm", return_value=llm):
+            self.assertEqual(services.check_answers_batch(items), {1: False, 2: True})
+        self.assertEqual(llm.invoke.call_count, 2)
+
+    def test_submission_sends_undecided_answers_in_one_call(self):
+        user = User.objects.create_user("batch", password="pw")
+        quiz = Quiz.objects.create(topic="Plants", user=user)
+        questions = [
+            Question.objects.create(quiz=quiz, text=f"Question {index}", question_type="SHORT", answer=answer)
+            for index, answer in enumerate(["Glucose", "Chlorophyll", "Stomata"])
+        ]
+        # Two answers in the fuzzy grader's uncertain band, one exact
+        answers = {
+            str(questions[0].id): "glucose sugar",
+            str(questions[1].id): "chlorophyl pigment",
+            str(questions[2].id): "Stomata",
+        }
+        graded = {questions[0].id: True, questions[1].id: False}
+        with mock.patch("grading.check_answers_batch", return_value=graded) as batch:
+            marks, results = grading.grade_submission(questions, answers)
+        batch.assert_called_once()
+        self.assertEqual(len(batch.call_args.args[0]), 2)
+        self.assertEqual(marks, 2)
+        self.assertEqual(results, {questions[0].id: True, questions[1].id: False, questions[2].id: True})
+
+
+class ChoiceGradingTests(TestCase):
+    def setUp(self):
+        self.quiz = Quiz.objects.create(topic="Capitals")
+
+    def mcq(self, answer, options=("Berlin", "London", "Paris", "Rome")):
+        question = Question.objects.create(quiz=self.quiz, text="Capital of France?", question_type="MCQ", answer=answer)
+        for text in options:
+            Option.objects.create(question=question, text=text)
+        return question
+
+    def test_letter_text_or_both_resolve_to_the_same_option(self):
+        question = self.mcq("c) Paris")
+        for given in ["c", "(C)", "option c", "Paris", "paris.", "c) Paris", "C. Paris"]:
+            with self.subTest(given=given):
+                self.assertIs(grading.grade_choice(question, given), True)
+
+    def test_other_options_are_wrong(self):
+        question = self.mcq("Paris")
+        for given in ["a", "London", "b) London"]:
+            with self.subTest(given=given):
+                self.assertIs(grading.grade_choice(question, given), False)
+
+    def test_conflicting_letter_and_text_go_to_the_ai(self):
+        question = self.mcq("Paris")
+        self.assertIsNone(grading.grade_choice(question, "b) Paris"))
+        self.assertIsNone(grading.grade_choice(question, "Madrid"))
+
+    def test_true_false_in_several_languages(self):
+        question = Question.objects.create(quiz=self.quiz, text="True or False: ...", question_type="TF", answer="False")
+        self.assertIs(grading.grade_choice(question, "false"), True)
+        self.assertIs(grading.grade_choice(question, "Falso"), True)
+        self.assertIs(grading.grade_choice(question, "True, it is"), False)
+        self.assertIsNone(grading.grade_choice(question, "maybe"))
+
+
+class VerdictCacheTests(TestCase):
+    def setUp(self):
+        grading.verdict_cache.memory.clear()
+        quiz = Quiz.objects.create(topic="Biology")
+        self.question = Question.objects.create(quiz=quiz, text="What do plants make?", question_type="SAQ", answer="glucose")
+
+    def pending(self, given="a sugar", expected="glucose"):
+        return [{"id": self.question.id, "question": self.question.text, "expected": expected, "given": given}]
+
+    def grade(self, verdict=True, **kwargs):
+        with mock.patch("grading.check_answers_batch", return_value={self.question.id: verdict}) as batch:
+            result = grading.grade_with_ai(self.pending(**kwargs))
+        return result[self.question.id], batch.call_count
+
+    def test_repeated_answers_are_graded_once(self):
+        self.assertEqual(self.grade(True), (True, 1))
+        self.assertEqual(self.grade(False), (True, 0))
+        grading.verdict_cache.memory.clear()
+        self.assertEqual(self.grade(False), (True, 0))  # from the database
+
+    def test_changed_answer_ignores_the_cached_verdict(self):
+        self.grade(True)
+        self.assertEqual(self.grade(False, expected="fructose"), (False, 1))
+
+    def test_question_save_deletes_verdicts_only_when_the_answer_changes(self):
+        self.grade(True)
+        self.question.text = "What sugar do plants make?"
+        self.question.save()
+        self.assertEqual(GradingVerdict.objects.filter(question=self.question).count(), 1)
+        self.question.answer = "fructose"
+        self.question.save()
+        self.assertFalse(GradingVerdict.objects.filter(question=self.question).exists())
+
+    def test_database_rows_expire_after_the_ttl(self):
+        self.grade(True)
+        grading.verdict_cache.memory.clear()
+        expired = timezone.now() - timedelta(seconds=grading.verdict_cache.ttl + 60)
+        GradingVerdict.objects.update(created_at=expired)
+        self.assertEqual(self.grade(False), (False, 1))
+
+    def test_answer_being_graded_elsewhere_is_waited_for(self):
+        item = self.pending()[0]
+        grading.add_cache_keys([item])
+        key = grading.cache_key(item)
+        claimed, _ = grading.verdict_cache.claim([key])
+
+        def finish_elsewhere():
+            # The test transaction holds the database, so only the memory cache is filled here
+            grading.verdict_cache.memory[key] = (item["expected_hash"], True)
+            grading.verdict_cache.release(claimed)
+
+        timer = threading.Timer(0.05, finish_elsewhere)
+        timer.start()
+        self.addCleanup(timer.join)
+        self.assertEqual(self.grade(False), (True, 0))
+
+
+class GeneratedQuizCacheTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("llm._backend", StubBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        calls = mock.patch("generation.generate_quiz_chunk", wraps=generation.generate_quiz_chunk)
+        self.ai_calls = calls.start()
+        self.addCleanup(calls.stop)
+
+    def generate(self, topic="Photosynthesis", **kwargs):
+        return generation.generate_parsed_quiz(topic=topic, num_questions=3, **kwargs)
+
+    def test_identical_request_reuses_the_output(self):
+        first = self.generate()
+        self.assertEqual(self.generate(topic="  photosynthesis "), first)
+        self.assertEqual(self.ai_calls.call_count, 1)
+        self.assertEqual(GeneratedQuizCache.objects.get().hits, 1)
+
+    def test_cache_hit_is_saved_as_a_new_quiz(self):
+        self.client.force_login(User.objects.create_user("cached", password="pw"))
+        data = {"topic": "Photosynthesis", "quiz_count": 3}
+        first = self.client.post("/api/generate-quiz/", data, content_type="application/json").json()["quiz"]
+        second = self.client.post("/api/generate-quiz/", data, content_type="application/json").json()["quiz"]
+        self.assertEqual(self.ai_calls.call_count, 1)
+        self.assertNotEqual(first["id"], second["id"])
+        self.assertEqual(
+            [q["text"] for q in first["questions"]],
+            [q["text"] for q in second["questions"]],
+        )
+        self.assertEqual(Quiz.objects.count(), 2)
+
+    def test_use_cache_false_asks_the_ai_and_refreshes_the_entry(self):
+        self.generate()
+        GeneratedQuizCache.objects.update(hits=5)
+        self.generate(use_cache=False)
+        self.assertEqual(self.ai_calls.call_count, 2)
+        self.assertEqual(GeneratedQuizCache.objects.get().hits, 0)
+
+    def test_expired_entries_are_dropped(self):
+        self.generate()
+        with mock.patch.dict("generation.CACHE_SETTINGS", {"TTL": 60}):
+            GeneratedQuizCache.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+            self.generate()
+        self.assertEqual(self.ai_calls.call_count, 2)
+        self.assertEqual(GeneratedQuizCache.objects.count(), 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        with mock.patch.dict("generation.CACHE_SETTINGS", {"MAX_ENTRIES": 2}):
+            self.generate("Cells")
+            self.generate("Atoms")
+            self.generate("Cells")  # Atoms is now the least recently used
+            self.generate("Planets")
+        key = lambda topic: generation.generation_cache_key(topic, "English", 3, 1, "MIX")
+        self.assertEqual(set(GeneratedQuizCache.objects.values_list("key", flat=True)), {key("Cells"), key("Planets")})
+        self.assertEqual(self.ai_calls.call_count, 3)
+
+
+def page_response(status=200, body=b"", **headers):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update({"Content-Type": "text/html; charset=utf-8", **headers})
+    response.raw = io.BytesIO(body)
+    response.url = "https://example.com/cells"
+    return response
+
+
+class PageTextCapTests(SimpleTestCase):
+    PARAGRAPH = b"<p>Cells divide by mitosis and plants make glucose.</p>\n"
+
+    def chunks(self, body, size=1024):
+        return [body[start:start + size] for start in range(0, len(body), size)]
+
+    def test_source_cap_follows_the_condensation_budget(self):
+        budget = processing.CONDENSE_SETTINGS.get("TOKEN_BUDGET", 3000)
+        self.assertEqual(processing.MAX_SOURCE_CHARS, budget * 4 * processing.CONDENSE_SETTINGS.get("SOURCE_FACTOR", 10))
+        self.assertLess(processing.MAX_SOURCE_CHARS, 200_000)
+
+    def test_extractor_stops_at_the_character_cap(self):
+        extractor = processing.HtmlTextExtractor(max_chars=500)
+        chunks = self.chunks(b"<html><body>" + self.PARAGRAPH * 2000)
+        fed = next(number for number, chunk in enumerate(chunks, start=1) if extractor.feed(chunk))
+        self.assertLess(fed, 5)
+        text = extractor.close()
+        self.assertEqual(len(text), 500)
+        self.assertTrue(text.startswith("Cells divide by mitosis"))
+
+    def test_reader_stops_at_the_byte_cap(self):
+        # Scripts are downloaded but add no text, so only the byte cap stops this page
+        body = b"<html><body><script>" + b"var x = 1;\n" * 20000 + b"</script></body></html>"
+        reader = processing.PageTextReader("text/html", max_bytes=8 * 1024, max_chars=500)
+        fed = next(number for number, chunk in enumerate(self.chunks(body), start=1) if reader.feed(chunk))
+        self.assertEqual(fed, 8)
+        self.assertEqual(reader.close(), "")
+
+    def test_read_page_text_leaves_the_rest_of_the_page(self):
+        response = mock.Mock(headers={"Content-Type": "text/html"})
+        chunks = self.chunks(self.PARAGRAPH * 5000, size=4096)
+        read = []
+        response.iter_content.return_value = (read.append(chunk) or chunk for chunk in chunks)
+        text = processing.read_page_text(response, max_chars=1000)
+        self.assertEqual(len(text), 1000)
+        self.assertEqual(len(read), 1)
+
+
+@override_settings(CACHES={"url_text": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "url-cache-tests"}})
+class UrlCacheTests(SimpleTestCase):
+    URL = "https://example.com/cells"
+    PAGE = b"<html><body><nav>Menu</nav><p>Cells divide by mitosis.</p></body></html>"
+
+    def setUp(self):
+        fetching.url_cache().clear()
+        patcher = mock.patch("requests.Session.get")
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_normalized_urls_share_an_entry(self):
+        cases = [
+            ("HTTPS://Example.com:443/cells#intro", "https://example.com/cells"),
+            ("https://example.com/cells?b=2&utm_source=x&a=1&fbclid=y", "https://example.com/cells?a=1&b=2"),
+            ("http://example.com:8080", "http://example.com:8080/"),
+            (" https://example.com ", "https://example.com/"),
+        ]
+        for url, expected in cases:
+            with self.subTest(url=url):
+                self.assertEqual(fetching.normalize_url(url), expected)
+        self.assertEqual(
+            fetching.url_cache_key("https://EXAMPLE.com/cells?utm_medium=mail#top"), fetching.url_cache_key(self.URL)
+        )
+
+    def test_fresh_entry_is_used_without_a_request(self):
+        self.get.return_value = page_response(body=self.PAGE, ETag='"v1"')
+        self.assertEqual(processing.fetch_text_from_url(self.URL), "Cells divide by mitosis.")
+        self.assertEqual(processing.fetch_text_from_url(self.URL + "#again"), "Cells divide by mitosis.")
+        self.assertEqual(self.get.call_count, 1)
+
+    def test_stale_entry_is_revalidated_with_its_validators(self):
+        self.get.return_value = page_response(body=self.PAGE, ETag='"v1"', **{"Last-Modified": "Mon, 05 Oct 2026 10:00:00 GMT"})
+        processing.fetch_text_from_url(self.URL)
+        self.get.return_value = page_response(status=304)
+        with mock.patch("fetching.FRESH_FOR", 0):
+            self.assertEqual(processing.fetch_text_from_url(self.URL), "Cells divide by mitosis.")
+        headers = self.get.call_args.kwargs["headers"]
+        self.assertEqual(headers, {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 05 Oct 2026 10:00:00 GMT"})
+        # The 304 marked the entry as checked, so it is fresh again
+        self.assertEqual(processing.fetch_text_from_url(self.URL), "Cells divide by mitosis.")
+        self.assertEqual(self.get.call_count, 2)
+
+    def test_changed_page_replaces_the_entry(self):
+        self.get.return_value = page_response(body=self.PAGE, ETag='"v1"')
+        processing.fetch_text_from_url(self.URL)
+        self.get.return_value = page_response(body=b"<p>Cells divide by meiosis too.</p>", ETag='"v2"')
+        with mock.patch("fetching.FRESH_FOR", 0):
+            self.assertEqual(processing.fetch_text_from_url(self.URL), "Cells divide by meiosis too.")
+        self.assertEqual(fetching.get_cached_page(self.URL)["etag"], '"v2"')
+
+    def test_no_store_pages_are_not_cached(self):
+        self.get.return_value = page_response(body=self.PAGE, **{"Cache-Control": "private, no-store"})
+        processing.fetch_text_from_url(self.URL)
+        self.assertIsNone(fetching.get_cached_page(self.URL))
+
+    def test_stale_copy_is_used_when_the_site_fails(self):
+        self.get.return_value = page_response(body=self.PAGE)
+        processing.fetch_text_from_url(self.URL)
+        self.get.side_effect = requests.ConnectionError("down")
+        with mock.patch("fetching.FRESH_FOR", 0):
+            self.assertEqual(processing.fetch_text_from_url(self.URL), "Cells divide by mitosis.")
+
+
+class DocumentStoreTests(TestCase):
+    TEXT = "Cells divide by mitosis. " * 20
+
+    def setUp(self):
+        extract = mock.Mock(wraps=processing.extract_text_from_txt)
+        patcher = mock.patch.dict("processing.EXTRACTORS", {"text/plain": extract})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.extract = extract
+
+    def upload(self, name="notes.txt", text=TEXT):
+        return SimpleUploadedFile(name, text.encode("utf-8"))
+
+    def test_same_file_is_extracted_once(self):
+        first = generation.document_text(self.upload())
+        second = generation.document_text(self.upload(name="copy of notes.txt"))
+        self.assertEqual(first, second)
+        self.assertEqual(self.extract.call_count, 1)
+        self.assertEqual(DocumentText.objects.get().hits, 1)
+
+    def test_other_content_or_page_range_is_extracted_again(self):
+        generation.document_text(self.upload())
+        generation.document_text(self.upload(text=self.TEXT + "Plants make glucose."))
+        generation.document_text(self.upload(), page_range="1-2")
+        self.assertEqual(self.extract.call_count, 3)
+        self.assertEqual(DocumentText.objects.count(), 3)
+
+
+@override_settings(CACHES={"url_text": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "multi-source-tests"}})
+class MultiSourceTests(SimpleTestCase):
+    PAGES = {
+        "/slow": (0.1, 200, "<p>Slow page about cells.</p>"),
+        "/fast": (0, 200, "<p>Fast page about atoms.</p>"),
+        "/broken": (0, 500, "<p>Server error</p>"),
+        "/stuck": (5, 200, "<p>Never read.</p>"),
+    }
+
+    def setUp(self):
+        fetching.url_cache().clear()
+
+        async def handler(request):
+            delay, status, body = self.PAGES[request.url.path]
+            await asyncio.sleep(delay)
+            return httpx.Response(status, text=body, headers={"Content-Type": "text/html"})
+
+        client = functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handler))
+        for patcher in [
+            mock.patch("httpx.AsyncClient", client),
+            mock.patch.dict("generation.MULTI_SOURCE_SETTINGS", {"DEADLINE": 1}),
+            # Documents are read in a worker thread, keep it away from the test database
+            mock.patch.dict("generation.DOCUMENT_SETTINGS", {"ENABLED": False}),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def read(self, *paths, upload_files=()):
+        urls = [f"https://example.com{path}" for path in paths]
+        return async_to_sync(generation.aread_sources)(urls, list(upload_files))
+
+    def test_sources_keep_the_input_order(self):
+        notes = SimpleUploadedFile("notes.txt", b"Notes about plants.")
+        sources = self.read("/slow", "/fast", upload_files=[notes])
+        self.assertEqual(sources, [
+            ("https://example.com/slow", "Slow page about cells."),
+            ("https://example.com/fast", "Fast page about atoms."),
+            ("notes.txt", "Notes about plants."),
+        ])
+
+    def test_failed_sources_are_left_out(self):
+        self.assertEqual(self.read("/broken", "/fast"), [("https://example.com/fast", "Fast page about atoms.")])
+
+    def test_sources_past_the_deadline_are_left_out(self):
+        with mock.patch.dict("generation.MULTI_SOURCE_SETTINGS", {"DEADLINE": 0.3}):
+            started = time.monotonic()
+            sources = self.read("/stuck", "/slow")
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(sources, [("https://example.com/slow", "Slow page about cells.")])
+
+    def test_topic_is_used_when_no_source_is_left(self):
+        urls = ["https://example.com/broken", "https://example.com/stuck"]
+        with mock.patch.dict("generation.MULTI_SOURCE_SETTINGS", {"DEADLINE": 0.3}):
+            self.assertEqual(generation.gather_content_sources("Cells", urls, []), "Cells")
+
+
+class CondensationTests(SimpleTestCase):
+    """
+    Paragraphs are made of invented words, so each one has its own vocabulary.
+    """
+
+    def word(self, number):
+        letters = ""
+        number += 26 * 26
+        while number:
+            number, rest = divmod(number, 26)
+            letters = string.ascii_lowercase[rest] + letters
+        return letters
+
+    def paragraph(self, number, vocabulary=40):
+        # About 700-850 characters: one paragraph per chunk
+        return " ".join(self.word(number * 1000 + position % vocabulary) for position in range(170)) + "."
+
+    def test_short_text_is_returned_unchanged(self):
+        text = "Cells   divide by mitosis.\n\nPlants make glucose."
+        self.assertEqual(condense_text(text), text)
+        self.assertEqual(condense_text(""), "")
+
+    def test_output_stays_within_the_budget(self):
+        text = "\n\n".join(self.paragraph(number) for number in range(40))
+        for budget in (300, 800, 1500):
+            with self.subTest(budget=budget):
+                condensed = condense_text(text, budget)
+                self.assertLessEqual(estimate_tokens(condensed), budget)
+                self.assertGreater(estimate_tokens(condensed), budget / 2)
+
+    def test_informative_chunks_are_picked_from_the_whole_document(self):
+        paragraphs = [self.paragraph(number, vocabulary=5) for number in range(30)]
+        paragraphs[27] = self.paragraph(27, vocabulary=170)
+        condensed = condense_text("\n\n".join(paragraphs), 600)
+        self.assertIn(paragraphs[27], condensed)
+        # Chunks are joined back in document order
+        kept = [number for number, paragraph in enumerate(paragraphs) if paragraph in condensed]
+        self.assertEqual(condensed.split("\n\n"), [paragraphs[number] for number in kept])
+
+    def test_repeated_content_is_kept_once(self):
+        repeated = self.paragraph(99, vocabulary=170)
+        paragraphs = [self.paragraph(number) for number in range(20)]
+        text = "\n\n".join([paragraphs[0], repeated, paragraphs[1], repeated, paragraphs[2], repeated, *paragraphs[3:]])
+        self.assertEqual(condense_text(text, 1500).count(repeated), 1)
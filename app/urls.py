@@ -19,6 +19,7 @@ urlpatterns = [
     path("quiz/<int:quiz_id>/is-public/", views.is_public, name="is_public"),
     path('change_password/', views.change_password, name='change_password'),
     path("chat-assistant/", views.chat_assistant, name="chat_assistant"),
+    path("chat-assistant/stream/", views.chat_assistant_stream, name="chat_assistant_stream"),
     path("change-profile/", views.change_username_or_email, name="change_username_or_email"),
     path("profile/", views.profile, name="profile"),
     path("delete_account/", views.delete_account, name="delete_account"),
@@ -1,20 +1,22 @@
 # quizapp/views.py
 import re
+import json
 from django.shortcuts import render, redirect, HttpResponse, get_object_or_404
 from django.contrib.auth.models import User
 from django.core.paginator import Paginator
 from django.contrib.auth import authenticate, login, logout
-from services import generate__quiz, check_short_answer, assistant, check_multiple_choice
-from processing import fetch_text_from_url, extract_text_from_pdf, incorrect_answer, parse_quiz_response
-from django.http import JsonResponse
+from chat import get_conversation, ask_assistant, stream_assistant_reply, prime_stream, chat_events
+from grading import grade_submission
+from processing import incorrect_answer
+from generation import resolve_content_source, split_urls, generate_parsed_quiz, save_parsed_quiz
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.db.models import Max
 from django.db.models import Avg
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .models import (
-    Quiz, Question, 
-    Option, QuizAttempt, 
+    Quiz, QuizAttempt, 
     UserProfile, QuizRating, 
     Server, ServerQuiz
 )
@@ -111,10 +113,47 @@ def chat_assistant(request):
     if request.method == 'POST':
         query = request.POST.get('query', '').strip()
         if query:
-            response = assistant(query)
+            if not request.session.session_key:
+                request.session.create()
+            conversation = get_conversation(request.user, request.session.session_key)
+            try:
+                response = ask_assistant(conversation, query)
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
             return JsonResponse({"response": response})
     return JsonResponse({"error": "Invalid request"}, status=400)
 
+@csrf_exempt
+def chat_assistant_stream(request):
+    """
+    chat_assistant as Server-Sent Events: "token" events while the assistant writes
+    its reply, then "done" with the whole reply.
+    """
+    query = request.POST.get('query', '').strip() if request.method == 'POST' else ''
+    if not query:
+        return JsonResponse({"error": "Invalid request"}, status=400)
+
+    if not request.session.session_key:
+        request.session.create()
+    conversation = get_conversation(request.user, request.session.session_key)
+    try:
+        chunks = prime_stream(stream_assistant_reply(conversation, query))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    def event_stream():
+        try:
+            for event, data in chat_events(chunks):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            print(f"Error in chat_assistant_stream: {e}")
+            yield f"event: error\ndata: {json.dumps({'message': 'The reply was interrupted.'})}\n\n"
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
 def handle_logout(request):
     logout(request)
     return redirect('index')
@@ -264,52 +303,37 @@ def generate_quiz(request):
         prompt = request.POST.get('input_prompt', '').strip()
         url = request.POST.get('input_url', '').strip()
         text = request.POST.get('input_text', '').strip()
-        upload_file = request.FILES.get('input_pdf')
+        urls = split_urls(request.POST.getlist('input_urls'))
+        upload_files = request.FILES.getlist('input_pdf')
+        page_range = str(request.POST.get('page_range', '')).strip()
 
         # Detect source
-        if prompt:
-            content_source = prompt
-        elif url:
-            content_source = fetch_text_from_url(url)
-        elif text:
-            content_source = text
-        elif upload_file and upload_file.name.endswith(".pdf"):
-            content_source = extract_text_from_pdf(upload_file)
-        else:
-            content_source = topic
+        try:
+            content_source = resolve_content_source(
+                topic, prompt, url, text, page_range=page_range, urls=urls, upload_files=upload_files
+            )
+        except ValueError as e:
+            return HttpResponse(str(e), status=400)
 
-        raw_quiz = generate__quiz(
+        parsed_quiz = generate_parsed_quiz(
             topic=topic,
             language=language,
             num_questions=num_questions,
             difficulty=difficulty,
             question_type=question_preference,
-            content=content_source
+            content=content_source,
+            use_cache=request.POST.get('use_cache', 'on') != 'off',
         )
 
-        parsed_quiz = parse_quiz_response(raw_quiz)
-
-        quiz = Quiz.objects.create(
-            topic=parsed_quiz.get("topic", topic),
-            difficulty=parsed_quiz.get("difficulty", difficulty),
-            category=parsed_quiz.get("category", "General"),
-            question_preference=question_preference,  # ✅ keep user’s choice
+        quiz = save_parsed_quiz(
+            parsed_quiz,
             user=request.user if request.user.is_authenticated else None,
+            question_preference=question_preference,  # ✅ keep user’s choice
+            topic=topic,
+            category=category,
+            difficulty=difficulty,
         )
 
-        for q in parsed_quiz["questions"]:
-            question = Question.objects.create(
-                quiz=quiz,
-                text=q["text"],
-                question_type=q["type"].upper(),
-                difficulty=q["difficulty"],
-                answer=q["answer"]
-            )
-
-            if q["type"].upper() == "MCQ" and q.get("mcq_options"):
-                for opt in q["mcq_options"]:
-                    Option.objects.create(question=question, text=opt.strip())
-
         quizzes = Quiz.objects.all().order_by('-id')[:20]
         context = {
 
@@ -340,27 +364,18 @@ def quiz_take(request, quiz_id):
     questions = quiz.questions.all()
 
     if request.method == "POST":
-        marks = 0
-        user_answers = {}
-
-        for question in questions:
-            user_answer = request.POST.get(str(question.id))  
-            user_answers[str(question.id)] = user_answer
-
-            if question.question_type == "SHORT":
-                if user_answer and check_short_answer(user_answer, question.answer):
-                    marks += 1
-            if question.question_type == "MCQ":
-                if user_answer and check_multiple_choice(user_answer, question.answer):
-                    marks += 1
-            if user_answer and user_answer.strip().lower() == question.answer.strip().lower():
-                marks += 1
+        user_answers = {
+            str(question.id): request.POST.get(str(question.id))
+            for question in questions
+        }
+        marks, results = grade_submission(questions, user_answers)
 
         attempt = QuizAttempt.objects.create(
             user=request.user,
             quiz=quiz,
             score=marks,
-            answers=user_answers
+            answers=user_answers,
+            results={str(question_id): correct for question_id, correct in results.items()},
         )
 
         return redirect("quiz_result", attempt_id=attempt.id)
@@ -403,21 +418,16 @@ def retake_quiz(request, quiz_id):
 
     if request.method == "POST":
         questions = quiz.questions.all()
-        marks = 0
-        user_answers = {}
-
-        for question in questions:
-            user_answer = request.POST.get(str(question.id))
-            user_answers[str(question.id)] = user_answer
-
-            if question.question_type == "SHORT":
-                if user_answer and check_short_answer(user_answer, question.answer):
-                    marks += 1
-            elif user_answer and user_answer.strip().lower() == question.answer.strip().lower():
-                marks += 1
+        user_answers = {
+            str(question.id): request.POST.get(str(question.id))
+            for question in questions
+        }
+        marks, results = grade_submission(questions, user_answers)
 
         attempt.score = marks
         attempt.answers = user_answers
+        attempt.results = {str(question_id): correct for question_id, correct in results.items()}
+        attempt.status = "graded"
         attempt.save()
 
         return redirect("quiz_result", attempt_id=attempt.id)
@@ -0,0 +1,278 @@
+import secrets
+import itertools
+from django.conf import settings
+from django.db import transaction
+from app.models import Conversation, ChatMessage
+from asgiref.sync import sync_to_async
+from services import (
+    assistant,
+    aassistant,
+    stream_assistant,
+    astream_assistant,
+    summarize_conversation,
+    asummarize_conversation,
+    estimate_tokens,
+)
+
+HISTORY_SETTINGS = getattr(settings, "ASSISTANT_HISTORY", {})
+TOKEN_BUDGET = HISTORY_SETTINGS.get("TOKEN_BUDGET", 2000)
+SUMMARIZE = HISTORY_SETTINGS.get("SUMMARIZE", True)
+SUMMARIZE_BATCH = HISTORY_SETTINGS.get("SUMMARIZE_BATCH", 800)
+MAX_QUERY_CHARS = HISTORY_SETTINGS.get("MAX_QUERY_CHARS", 4000)
+# Session ids the API hands out to guests, so they can't be confused with browser session keys
+API_SESSION_PREFIX = "api:"
+
+
+def get_conversation(user=None, session_key=""):
+    """
+    Returns the conversation of a logged-in user, or of a guest identified by session key.
+    Returns None when there is nothing to key the conversation on.
+    """
+    if user is not None and user.is_authenticated:
+        conversation, _ = Conversation.objects.get_or_create(user=user, session_key="")
+        return conversation
+    if session_key:
+        conversation, _ = Conversation.objects.get_or_create(user=None, session_key=session_key[:64])
+        return conversation
+    return None
+
+
+async def aget_conversation(user=None, session_key=""):
+    """
+    get_conversation for the async views.
+    """
+    if user is not None and user.is_authenticated:
+        conversation, _ = await Conversation.objects.aget_or_create(user=user, session_key="")
+        return conversation
+    if session_key:
+        conversation, _ = await Conversation.objects.aget_or_create(user=None, session_key=session_key[:64])
+        return conversation
+    return None
+
+
+def issue_session_id() -> str:
+    return API_SESSION_PREFIX + secrets.token_urlsafe(32)
+
+
+def get_api_conversation(user=None, session_id=""):
+    """
+    The conversation of an API chat request. Guests get a random session id from the
+    server on their first turn and send it back to continue; an id the server didn't
+    issue starts a new conversation, so a guest can't pick or guess someone else's.
+    Returns (conversation, session id to send back, "" for logged-in users).
+    """
+    if user is not None and user.is_authenticated:
+        return get_conversation(user), ""
+    conversation = None
+    if session_id.startswith(API_SESSION_PREFIX):
+        conversation = Conversation.objects.filter(user=None, session_key=session_id[:64]).first()
+    if conversation is None:
+        conversation = Conversation.objects.create(user=None, session_key=issue_session_id())
+    return conversation, conversation.session_key
+
+
+async def aget_api_conversation(user=None, session_id=""):
+    """
+    get_api_conversation for the async views.
+    """
+    if user is not None and user.is_authenticated:
+        return await aget_conversation(user), ""
+    conversation = None
+    if session_id.startswith(API_SESSION_PREFIX):
+        conversation = await Conversation.objects.filter(user=None, session_key=session_id[:64]).afirst()
+    if conversation is None:
+        conversation = await Conversation.objects.acreate(user=None, session_key=issue_session_id())
+    return conversation, conversation.session_key
+
+
+def split_window(messages, budget=TOKEN_BUDGET):
+    """
+    Splits unarchived messages (oldest first) into the newest ones that fit the
+    token budget and the older overflow.
+    - returns: (window, overflow), both oldest first
+    """
+    used = 0
+    start = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        used += estimate_tokens(messages[index].content)
+        if used > budget:
+            break
+        start = index
+    return messages[start:], messages[:start]
+
+
+def as_turns(messages) -> list:
+    return [{"role": message.role, "content": message.content} for message in messages]
+
+
+def archive_overflow(conversation, overflow):
+    """
+    Moves messages out of the prompt window. With summarization on, they are kept
+    until SUMMARIZE_BATCH tokens accumulate and then folded into the summary in one call.
+    """
+    if not overflow:
+        return
+    if SUMMARIZE:
+        if sum(estimate_tokens(message.content) for message in overflow) < SUMMARIZE_BATCH:
+            return
+        try:
+            conversation.summary = summarize_conversation(conversation.summary, as_turns(overflow))
+        except Exception as e:
+            # Keep the overflow for the next try, the answer was already saved
+            print(f"Summarizing conversation {conversation.id} failed: {e}")
+            return
+    save_archived(conversation, overflow)
+
+
+def save_archived(conversation, overflow):
+    with transaction.atomic():
+        ChatMessage.objects.filter(id__in=[message.id for message in overflow]).update(archived=True)
+        conversation.save(update_fields=["summary", "updated_at"])
+
+
+def check_query(query: str) -> None:
+    if len(query) > MAX_QUERY_CHARS:
+        raise ValueError(f"Query is too long (max {MAX_QUERY_CHARS} characters).")
+
+
+def turn_messages(conversation, query: str, response: str) -> list:
+    return [
+        ChatMessage(conversation=conversation, role="user", content=query),
+        ChatMessage(conversation=conversation, role="assistant", content=response),
+    ]
+
+
+def ask_assistant(conversation, query: str) -> str:
+    """
+    Answers a chat question with the conversation's recent turns and summary, then
+    stores both turns. Without a conversation the question is answered statelessly.
+    """
+    check_query(query)
+    if conversation is None:
+        return assistant(query)
+
+    messages = list(conversation.messages.filter(archived=False).order_by("id"))
+    window, overflow = split_window(messages, TOKEN_BUDGET - estimate_tokens(query))
+    response = assistant(query, history=as_turns(window), summary=conversation.summary)
+
+    ChatMessage.objects.bulk_create(turn_messages(conversation, query, response))
+    archive_overflow(conversation, overflow)
+    return response
+
+
+def stream_assistant_reply(conversation, query: str):
+    """
+    Same as ask_assistant, but returns a generator of reply chunks as the AI writes them.
+    The turn is stored once the reply is complete; a reply cut short (error, client gone)
+    is not. A query that is too long raises ValueError here, before anything is streamed.
+    """
+    check_query(query)
+    if conversation is None:
+        return stream_assistant(query)
+
+    messages = list(conversation.messages.filter(archived=False).order_by("id"))
+    window, overflow = split_window(messages, TOKEN_BUDGET - estimate_tokens(query))
+
+    def reply():
+        parts = []
+        for chunk in stream_assistant(query, history=as_turns(window), summary=conversation.summary):
+            parts.append(chunk)
+            yield chunk
+        ChatMessage.objects.bulk_create(turn_messages(conversation, query, "".join(parts)))
+        archive_overflow(conversation, overflow)
+
+    return reply()
+
+
+def prime_stream(chunks):
+    """
+    Waits for the first chunk of a reply, so a refused or failed AI call raises while
+    the view can still answer with an error status instead of a broken stream.
+    """
+    first = next(chunks, None)
+    return itertools.chain([] if first is None else [first], chunks)
+
+
+def chat_events(chunks):
+    """
+    Yields (event, data) tuples for Server-Sent Events: a "token" event per reply
+    chunk and a final "done" event with the whole reply.
+    """
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield "token", {"text": chunk}
+    yield "done", {"response": "".join(parts)}
+
+
+async def aarchive_overflow(conversation, overflow):
+    if not overflow:
+        return
+    if SUMMARIZE:
+        if sum(estimate_tokens(message.content) for message in overflow) < SUMMARIZE_BATCH:
+            return
+        try:
+            conversation.summary = await asummarize_conversation(conversation.summary, as_turns(overflow))
+        except Exception as e:
+            print(f"Summarizing conversation {conversation.id} failed: {e}")
+            return
+    await sync_to_async(save_archived)(conversation, overflow)
+
+
+async def aask_assistant(conversation, query: str) -> str:
+    """
+    ask_assistant for the async views, using the async ORM and AI calls.
+    """
+    check_query(query)
+    if conversation is None:
+        return await aassistant(query)
+
+    messages = [message async for message in conversation.messages.filter(archived=False).order_by("id")]
+    window, overflow = split_window(messages, TOKEN_BUDGET - estimate_tokens(query))
+    response = await aassistant(query, history=as_turns(window), summary=conversation.summary)
+
+    await ChatMessage.objects.abulk_create(turn_messages(conversation, query, response))
+    await aarchive_overflow(conversation, overflow)
+    return response
+
+
+async def astream_assistant_reply(conversation, query: str):
+    """
+    stream_assistant_reply for the async views.
+    """
+    check_query(query)
+    if conversation is None:
+        return astream_assistant(query)
+
+    messages = [message async for message in conversation.messages.filter(archived=False).order_by("id")]
+    window, overflow = split_window(messages, TOKEN_BUDGET - estimate_tokens(query))
+
+    async def reply():
+        parts = []
+        async for chunk in astream_assistant(query, history=as_turns(window), summary=conversation.summary):
+            parts.append(chunk)
+            yield chunk
+        await ChatMessage.objects.abulk_create(turn_messages(conversation, query, "".join(parts)))
+        await aarchive_overflow(conversation, overflow)
+
+    return reply()
+
+
+async def aprime_stream(chunks):
+    first = await anext(chunks, None)
+
+    async def chained():
+        if first is not None:
+            yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return chained()
+
+
+async def achat_events(chunks):
+    parts = []
+    async for chunk in chunks:
+        parts.append(chunk)
+        yield "token", {"text": chunk}
+    yield "done", {"response": "".join(parts)}
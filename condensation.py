@@ -0,0 +1,126 @@
+import heapq
+import math
+import re
+from collections import Counter
+from django.conf import settings
+from services import estimate_tokens
+
+CONDENSE_SETTINGS = getattr(settings, "CONTENT_CONDENSATION", {})
+TOKEN_BUDGET = CONDENSE_SETTINGS.get("TOKEN_BUDGET", 3000)
+CHUNK_SIZE = CONDENSE_SETTINGS.get("CHUNK_SIZE", 1200)
+CHUNK_OVERLAP = CONDENSE_SETTINGS.get("CHUNK_OVERLAP", 100)
+REDUNDANCY_PENALTY = CONDENSE_SETTINGS.get("REDUNDANCY_PENALTY", 0.5)
+
+WORD_PATTERN = re.compile(r"[^\W\d_]{3,}", re.UNICODE)
+STOPWORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has him his how its may new now "
+    "see two who did get let put say she too use that with have this will your from they been were "
+    "what when which their there than then them these those would could should about into more other "
+    "some such only also very just over after before because while where each most both same being".split()
+)
+
+
+def split_chunks(text: str) -> list:
+    """
+    Splits text into overlapping chunks on paragraph, line and sentence boundaries.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", ". ", " ", ""],
+    )
+    return [chunk for chunk in splitter.split_text(text) if chunk.strip()]
+
+
+def chunk_terms(chunk: str) -> Counter:
+    return Counter(
+        word for word in (w.casefold() for w in WORD_PATTERN.findall(chunk)) if word not in STOPWORDS
+    )
+
+
+def score_chunks(term_counts: list) -> list:
+    """
+    TF-IDF informativeness of each chunk: the summed weight of its terms, normalized
+    by the square root of its length so long chunks don't win on size alone.
+    Boilerplate (menus, repeated headers) scores low because its terms appear everywhere.
+    - returns: (score, term weights) per chunk
+    """
+    total = len(term_counts)
+    document_frequency = Counter()
+    for counts in term_counts:
+        document_frequency.update(counts.keys())
+
+    scored = []
+    for counts in term_counts:
+        length = sum(counts.values())
+        if not length:
+            scored.append((0.0, {}))
+            continue
+        weights = {
+            term: (count / length) * math.log((1 + total) / (1 + document_frequency[term]))
+            for term, count in counts.items()
+        }
+        score = sum(weights.values()) * math.sqrt(len(counts)) / math.sqrt(length)
+        scored.append((score, weights))
+    return scored
+
+
+def condense_text(text: str, budget: int = TOKEN_BUDGET) -> str:
+    """
+    Shrinks long source text to roughly `budget` tokens by keeping its most informative
+    chunks, taken from the whole document rather than just its beginning.
+    Chunks are picked greedily by TF-IDF score, with a penalty for terms already covered,
+    and joined back in document order. Short text is returned unchanged.
+    """
+    if not CONDENSE_SETTINGS.get("ENABLED", True) or not text or estimate_tokens(text) <= budget:
+        return text
+
+    chunks = split_chunks(text)
+    scored = score_chunks([chunk_terms(chunk) for chunk in chunks])
+
+    def gain(index):
+        score, weights = scored[index]
+        total_weight = sum(weights.values()) or 1.0
+        overlap = sum(weight for term, weight in weights.items() if term in covered) / total_weight
+        return score * (1 - REDUNDANCY_PENALTY * overlap)
+
+    # Lazy greedy: a chunk's gain only drops as more terms get covered, so a popped
+    # chunk whose refreshed gain still beats the next best one is the true best
+    covered = {}
+    costs = [estimate_tokens(chunk) for chunk in chunks]
+    smallest = min(costs)
+    heap = [(-score, index) for index, (score, _) in enumerate(scored)]
+    heapq.heapify(heap)
+    selected = []
+    used = 0
+    while heap and budget - used >= smallest:
+        _, index = heapq.heappop(heap)
+        current = gain(index)
+        if heap and current < -heap[0][0]:
+            heapq.heappush(heap, (-current, index))
+            continue
+        if used + costs[index] > budget:
+            continue
+        selected.append(index)
+        used += costs[index]
+        covered.update(scored[index][1])
+
+    return "\n\n".join(chunks[index] for index in sorted(selected))
+
+
+def condense_sources(sources: list, budget: int = TOKEN_BUDGET) -> str:
+    """
+    Merges several (label, text) sources into one context of roughly `budget` tokens.
+    Each source gets an equal share; what short sources don't need goes to the longer ones.
+    """
+    sizes = [estimate_tokens(text) for _, text in sources]
+    shares = {}
+    remaining = budget
+    for position, index in enumerate(sorted(range(len(sources)), key=sizes.__getitem__)):
+        shares[index] = remaining // (len(sources) - position)
+        remaining -= min(shares[index], sizes[index])
+    return "\n\n".join(
+        f"Source: {label}\n{condense_text(text, shares[index])}" for index, (label, text) in enumerate(sources)
+    )
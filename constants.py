@@ -173,3 +173,34 @@ QUIZ_CATEGORIES = [
     "Space",
     "AI & Machine Learning",
 ]
+
+
+# =========================
+# True / False Synonyms
+# =========================
+# Lowercase words students (or the AI) use for True/False, across languages
+TF_SYNONYMS = {
+    # English
+    "true": True, "t": True, "yes": True, "y": True, "correct": True, "right": True,
+    "false": False, "f": False, "no": False, "n": False, "incorrect": False, "wrong": False,
+    # Spanish / Portuguese / Italian / Catalan
+    "verdadero": True, "verdadeiro": True, "vero": True, "cierto": True, "sí": True, "si": True, "sim": True,
+    "falso": False, "não": False, "nao": False,
+    # French
+    "vrai": True, "oui": True, "faux": False, "non": False,
+    # German / Dutch
+    "wahr": True, "richtig": True, "ja": True, "waar": True, "juist": True,
+    "falsch": False, "nein": False, "onwaar": False, "nee": False,
+    # Turkish / Indonesian / Malay
+    "doğru": True, "dogru": True, "evet": True, "benar": True, "betul": True, "ya": True,
+    "yanlış": False, "yanlis": False, "hayır": False, "salah": False, "tidak": False,
+    # Russian / Ukrainian
+    "верно": True, "правда": True, "да": True, "правильно": True, "вірно": True, "так": True,
+    "неверно": False, "ложь": False, "нет": False, "неправильно": False, "невірно": False, "ні": False,
+    # Arabic / Persian / Urdu / Hindi
+    "صحيح": True, "صح": True, "نعم": True, "درست": True, "بله": True, "سچ": True, "ہاں": True, "सही": True, "सत्य": True, "हाँ": True,
+    "خطأ": False, "خطا": False, "لا": False, "نادرست": False, "غلط": False, "جھوٹ": False, "نہیں": False, "गलत": False, "असत्य": False, "नहीं": False,
+    # Chinese / Japanese / Korean
+    "正确": True, "正確": True, "对": True, "對": True, "是": True, "真": True, "正しい": True, "はい": True, "참": True, "맞음": True, "예": True,
+    "错误": False, "錯誤": False, "错": False, "錯": False, "否": False, "假": False, "誤り": False, "いいえ": False, "거짓": False, "틀림": False, "아니오": False,
+}
@@ -0,0 +1,127 @@
+import time
+import hashlib
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from django.conf import settings
+from django.core.cache import caches
+
+FETCH_SETTINGS = getattr(settings, "URL_FETCH", {})
+TIMEOUT = FETCH_SETTINGS.get("TIMEOUT", 10)
+FRESH_FOR = FETCH_SETTINGS.get("FRESH_FOR", 3600)
+MAX_PAGE_BYTES = FETCH_SETTINGS.get("MAX_BYTES", 5 * 1024 * 1024)
+USER_AGENT = FETCH_SETTINGS.get("USER_AGENT", "QuizBee/1.0")
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+_session = None
+_session_lock = threading.Lock()
+cache_stats = {"hits": 0, "revalidated": 0, "misses": 0, "stale": 0, "stores": 0}
+cache_stats_lock = threading.Lock()
+
+
+def get_session():
+    """
+    The process-wide requests session: keeps connections to each host alive
+    and reuses them across requests and threads.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=FETCH_SETTINGS.get("POOL_CONNECTIONS", 10),
+                    pool_maxsize=FETCH_SETTINGS.get("POOL_MAXSIZE", 20),
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["User-Agent"] = USER_AGENT
+                _session = session
+    return _session
+
+
+def normalize_url(url: str) -> str:
+    """
+    The URL the cache is keyed on: lowercase scheme and host, no default port,
+    no fragment, no tracking parameters and the query parameters sorted.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or "http"
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMS)
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+def count_cache(stat) -> None:
+    with cache_stats_lock:
+        cache_stats[stat] += 1
+
+
+def url_cache():
+    return caches[FETCH_SETTINGS.get("CACHE_ALIAS", "url_text")]
+
+
+def url_cache_key(url: str) -> str:
+    return "url-text:" + hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+
+
+def get_cached_page(url: str):
+    """
+    The cache entry of a URL: {"text", "etag", "last_modified", "checked_at"}, or None.
+    """
+    if not FETCH_SETTINGS.get("CACHE", True):
+        return None
+    return url_cache().get(url_cache_key(url))
+
+
+def is_fresh(entry) -> bool:
+    return time.time() - entry["checked_at"] < FRESH_FOR
+
+
+def revalidation_headers(entry) -> dict:
+    """
+    Conditional GET headers, so an unchanged page is answered with an empty 304.
+    """
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def store_cached_page(url: str, text: str, response=None, entry=None) -> None:
+    """
+    Stores the extracted text of a URL with the validators of its response.
+    Without a response the entry is only marked as checked (after a 304).
+    """
+    if not FETCH_SETTINGS.get("CACHE", True):
+        return
+    if response is not None:
+        if "no-store" in response.headers.get("Cache-Control", "").lower():
+            return
+        entry = {
+            "text": text,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        count_cache("stores")
+    entry["checked_at"] = time.time()
+    url_cache().set(url_cache_key(url), entry)
+
+
+def url_cache_stats() -> dict:
+    with cache_stats_lock:
+        stats = dict(cache_stats)
+    stats["enabled"] = FETCH_SETTINGS.get("CACHE", True)
+    stats["fresh_for"] = FRESH_FOR
+    return stats
@@ -0,0 +1,910 @@
+import re
+import json
+import asyncio
+import random
+import hashlib
+import threading
+import contextvars
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from asgiref.sync import sync_to_async, async_to_sync
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from app.models import Quiz, Question, Option, GeneratedQuizCache, DocumentText, GenerationJob
+from grading import normalize_text, token_similarity, edit_similarity
+from fetching import TIMEOUT as FETCH_TIMEOUT, USER_AGENT
+from processing import (
+    fetch_text_from_url,
+    afetch_text_from_url,
+    get_extractor,
+    DOCUMENT_ERROR_PREFIX,
+    URL_ERROR_PREFIX,
+    parse_quiz_response,
+    parse_quiz_json,
+    parse_quiz_items,
+    extract_json,
+    QuizStreamParser,
+)
+from condensation import condense_text, condense_sources, TOKEN_BUDGET
+from resilience import is_transient_error
+from services import (
+    generate__quiz,
+    agenerate__quiz,
+    stream_quiz,
+    repair_quiz_questions,
+    arepair_quiz_questions,
+)
+
+CACHE_SETTINGS = getattr(settings, "GENERATION_CACHE", {})
+WORKER_SETTINGS = getattr(settings, "GENERATION_WORKER", {})
+OUTPUT_SETTINGS = getattr(settings, "QUIZ_OUTPUT", {})
+FANOUT_SETTINGS = getattr(settings, "QUIZ_FANOUT", {})
+DOCUMENT_SETTINGS = getattr(settings, "DOCUMENT_STORE", {})
+MULTI_SOURCE_SETTINGS = getattr(settings, "MULTI_SOURCE", {})
+cache_stats = {"hits": 0, "misses": 0, "stores": 0}
+cache_stats_lock = threading.Lock()
+output_stats = {"structured": 0, "valid_questions": 0, "repaired": 0, "dropped": 0, "text_fallbacks": 0}
+document_stats = {"hits": 0, "misses": 0, "stores": 0}
+fanout_stats = {"quizzes": 0, "short_quizzes": 0, "missing_questions": 0}
+
+
+def resolve_content_source(
+    topic, prompt="", url="", text="", upload_file=None, page_range="", urls=(), upload_files=()
+) -> str:
+    """
+    Picks the content a quiz is generated from: prompt, URL, text, uploaded document or the topic.
+    With more than one URL or file, all of them (and the text) are fetched concurrently
+    and merged, see gather_content_sources.
+    Long documents are condensed to the CONTENT_CONDENSATION token budget.
+    - page_range: PDF pages to use, like "1-5, 8"
+    - urls, upload_files: more sources, next to url and upload_file
+    Raises UnsupportedFileType for an upload that isn't a PDF, DOCX, text or Markdown file.
+    """
+    urls = split_urls([url, *urls])
+    upload_files = [file for file in [upload_file, *upload_files] if file]
+    if prompt:
+        return prompt
+    if len(urls) + len(upload_files) > 1:
+        return gather_content_sources(topic, urls, upload_files, text, page_range)
+    if urls:
+        return condense_text(fetch_text_from_url(urls[0]))
+    if text:
+        return condense_text(text)
+    if upload_files:
+        return document_text(upload_files[0], page_range)
+    return topic
+
+
+def split_urls(values) -> list:
+    """
+    URLs of a form or JSON value: a list, or a string with one URL per line or comma.
+    """
+    if isinstance(values, str):
+        values = [values]
+    urls = [url for value in values or [] for url in re.split(r"[\s,]+", str(value or "")) if url]
+    return list(dict.fromkeys(urls))
+
+
+def gather_content_sources(topic, urls, upload_files, text="", page_range="") -> str:
+    """
+    Multi-source mode: URLs and uploaded documents are read concurrently and merged
+    into one context within the token budget. Sources that fail or aren't done by
+    MULTI_SOURCE["DEADLINE"] are left out; the topic is used when none is left.
+    """
+    if len(urls) + len(upload_files) > MULTI_SOURCE_SETTINGS.get("MAX_SOURCES", 8):
+        raise ValueError(f"At most {MULTI_SOURCE_SETTINGS.get('MAX_SOURCES', 8)} URLs and files can be combined.")
+    # Unsupported files are rejected before anything is fetched
+    for upload_file in upload_files:
+        get_extractor(upload_file)
+
+    sources = async_to_sync(aread_sources)(urls, upload_files, page_range)
+    if text:
+        sources.insert(0, ("Text", text))
+    return condense_sources(sources) if sources else topic
+
+
+async def aread_sources(urls, upload_files, page_range="") -> list:
+    """
+    (label, text) of each URL and file that was read within the deadline, in input order.
+    Pages are fetched over one httpx client, at most PER_HOST at a time from a host;
+    documents are extracted in threads. The wait is that of the slowest source.
+    """
+    import httpx
+
+    labels = list(urls) + [upload_file.name for upload_file in upload_files]
+    host_slots = defaultdict(lambda: asyncio.Semaphore(MULTI_SOURCE_SETTINGS.get("PER_HOST", 2)))
+    limits = httpx.Limits(
+        max_connections=MULTI_SOURCE_SETTINGS.get("MAX_CONNECTIONS", 10),
+        max_keepalive_connections=MULTI_SOURCE_SETTINGS.get("MAX_CONNECTIONS", 10),
+    )
+    async with httpx.AsyncClient(
+        limits=limits, timeout=FETCH_TIMEOUT, follow_redirects=True, headers={"User-Agent": USER_AGENT}
+    ) as client:
+        tasks = [asyncio.ensure_future(afetch_text_from_url(client, url, host_slots)) for url in urls]
+        tasks += [
+            asyncio.ensure_future(sync_to_async(document_text, thread_sensitive=False)(upload_file, page_range))
+            for upload_file in upload_files
+        ]
+        done, pending = await asyncio.wait(tasks, timeout=MULTI_SOURCE_SETTINGS.get("DEADLINE", 20))
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    sources = []
+    for label, task in zip(labels, tasks):
+        if task not in done:
+            print(f"Source left out, not read within {MULTI_SOURCE_SETTINGS.get('DEADLINE', 20)}s: {label}")
+        elif task.exception() is not None:
+            print(f"Source left out: {label}: {task.exception()}")
+        elif task.result().startswith((URL_ERROR_PREFIX, DOCUMENT_ERROR_PREFIX)):
+            print(f"Source left out: {task.result()}")
+        elif task.result():
+            sources.append((label, task.result()))
+    return sources
+
+
+def file_sha256(upload_file) -> str:
+    """
+    SHA-256 of an uploaded file, read in chunks so large uploads aren't loaded at once.
+    """
+    digest = hashlib.sha256()
+    for chunk in upload_file.chunks():
+        digest.update(chunk)
+    upload_file.seek(0)
+    return digest.hexdigest()
+
+
+def document_text(upload_file, page_range="") -> str:
+    """
+    Condensed text of an uploaded document. The text is stored under the SHA-256 of
+    the file, so uploading the same file again skips parsing; the identical text then
+    also hits the generation cache.
+    """
+    # Sniffing the type reads the first bytes only: unsupported files go no further
+    extract = get_extractor(upload_file)
+    if not DOCUMENT_SETTINGS.get("ENABLED", True):
+        return condense_text(extract(upload_file, page_range))
+
+    content_hash = file_sha256(upload_file)
+    page_range = " ".join(str(page_range or "").split())
+    key = hashlib.sha256(json.dumps([content_hash, page_range, TOKEN_BUDGET]).encode("utf-8")).hexdigest()
+
+    stored = DocumentText.objects.filter(key=key).values_list("id", "text").first()
+    if stored is not None:
+        DocumentText.objects.filter(id=stored[0]).update(hits=F("hits") + 1, last_used_at=timezone.now())
+        count_stat(document_stats, "hits")
+        return stored[1]
+
+    count_stat(document_stats, "misses")
+    text = condense_text(extract(upload_file, page_range))
+    if text and not text.startswith(DOCUMENT_ERROR_PREFIX):
+        DocumentText.objects.update_or_create(
+            key=key,
+            defaults={
+                "content_hash": content_hash,
+                "name": upload_file.name[:255],
+                "size": upload_file.size or 0,
+                "page_range": page_range[:100],
+                "text": text,
+            },
+        )
+        count_stat(document_stats, "stores")
+        max_entries = DOCUMENT_SETTINGS.get("MAX_ENTRIES", 500)
+        stale_ids = list(DocumentText.objects.order_by("-last_used_at").values_list("id", flat=True)[max_entries:])
+        if stale_ids:
+            DocumentText.objects.filter(id__in=stale_ids).delete()
+    return text
+
+
+def document_store_stats() -> dict:
+    with cache_stats_lock:
+        stats = dict(document_stats)
+    stats["entries"] = DocumentText.objects.count()
+    stats["max_entries"] = DOCUMENT_SETTINGS.get("MAX_ENTRIES", 500)
+    stats["enabled"] = DOCUMENT_SETTINGS.get("ENABLED", True)
+    return stats
+
+
+def generation_cache_key(content_source, language, num_questions, difficulty, question_type) -> str:
+    """
+    SHA-256 of the normalized generation parameters.
+    Whitespace and case differences in the content don't change the key.
+    """
+    normalized = [
+        " ".join(str(content_source or "").split()).casefold(),
+        str(language or "").strip().casefold(),
+        int(num_questions),
+        int(difficulty),
+        str(question_type or "").strip().upper(),
+    ]
+    return hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def count_stat(stats, stat, amount=1) -> None:
+    with cache_stats_lock:
+        stats[stat] += amount
+
+
+def count_cache(stat) -> None:
+    count_stat(cache_stats, stat)
+
+
+def get_cached_quiz(key):
+    """
+    Returns the parsed quiz stored under key, or None on a miss or an expired entry.
+    """
+    if not CACHE_SETTINGS.get("ENABLED", True):
+        return None
+
+    entry = GeneratedQuizCache.objects.filter(key=key).first()
+    if entry is None:
+        count_cache("misses")
+        return None
+
+    ttl = CACHE_SETTINGS.get("TTL", 60 * 60 * 24 * 7)
+    if entry.created_at < timezone.now() - timedelta(seconds=ttl):
+        entry.delete()
+        count_cache("misses")
+        return None
+
+    GeneratedQuizCache.objects.filter(id=entry.id).update(hits=F("hits") + 1, last_used_at=timezone.now())
+    count_cache("hits")
+    return entry.parsed
+
+
+def store_cached_quiz(key, raw_output, parsed_quiz) -> None:
+    """
+    Stores AI output under key and evicts the least recently used entries above MAX_ENTRIES.
+    Outputs without any parsed question are not cached.
+    """
+    if not CACHE_SETTINGS.get("ENABLED", True) or not parsed_quiz.get("questions"):
+        return
+
+    GeneratedQuizCache.objects.update_or_create(
+        key=key,
+        defaults={"raw_output": raw_output, "parsed": parsed_quiz, "hits": 0},
+    )
+    count_cache("stores")
+
+    max_entries = CACHE_SETTINGS.get("MAX_ENTRIES", 1000)
+    stale_ids = GeneratedQuizCache.objects.order_by("-last_used_at").values_list("id", flat=True)[max_entries:]
+    stale_ids = list(stale_ids)
+    if stale_ids:
+        GeneratedQuizCache.objects.filter(id__in=stale_ids).delete()
+
+
+def generation_cache_stats() -> dict:
+    with cache_stats_lock:
+        stats = dict(cache_stats)
+    stats["entries"] = GeneratedQuizCache.objects.count()
+    stats["max_entries"] = CACHE_SETTINGS.get("MAX_ENTRIES", 1000)
+    stats["enabled"] = CACHE_SETTINGS.get("ENABLED", True)
+    with cache_stats_lock:
+        stats["structured_output"] = dict(output_stats)
+        stats["fanout"] = dict(fanout_stats)
+    return stats
+
+
+def generate_parsed_quiz(
+    topic="General",
+    language="English",
+    num_questions=5,
+    difficulty=1,
+    question_type="MIX",
+    content=None,
+    use_cache=True,
+) -> dict:
+    """
+    Generates a quiz and parses it, reusing the cached output of an identical request.
+    - use_cache: False always asks the AI (the fresh output still refreshes the cache)
+    """
+    key = generation_cache_key(content or topic, language, num_questions, difficulty, question_type)
+    if use_cache:
+        parsed_quiz = get_cached_quiz(key)
+        if parsed_quiz is not None:
+            return parsed_quiz
+
+    quiz_args = dict(
+        topic=topic,
+        language=language,
+        num_questions=num_questions,
+        difficulty=difficulty,
+        question_type=question_type,
+        content=content,
+    )
+    if FANOUT_SETTINGS.get("ENABLED", True) and int(num_questions) > FANOUT_SETTINGS.get("CHUNK_SIZE", 10):
+        raw_quiz, parsed_quiz = generate_fanout_quiz(**quiz_args)
+    else:
+        raw_quiz, parsed_quiz = generate_quiz_chunk(**quiz_args)
+    store_cached_quiz(key, raw_quiz, parsed_quiz)
+    return parsed_quiz
+
+
+async def agenerate_parsed_quiz(
+    topic="General",
+    language="English",
+    num_questions=5,
+    difficulty=1,
+    question_type="MIX",
+    content=None,
+    use_cache=True,
+) -> dict:
+    """
+    generate_parsed_quiz for the async views: AI calls are awaited, cache reads and
+    writes go through sync_to_async.
+    """
+    key = generation_cache_key(content or topic, language, num_questions, difficulty, question_type)
+    if use_cache:
+        parsed_quiz = await sync_to_async(get_cached_quiz)(key)
+        if parsed_quiz is not None:
+            return parsed_quiz
+
+    quiz_args = dict(
+        topic=topic,
+        language=language,
+        num_questions=num_questions,
+        difficulty=difficulty,
+        question_type=question_type,
+        content=content,
+    )
+    if FANOUT_SETTINGS.get("ENABLED", True) and int(num_questions) > FANOUT_SETTINGS.get("CHUNK_SIZE", 10):
+        raw_quiz, parsed_quiz = await agenerate_fanout_quiz(**quiz_args)
+    else:
+        raw_quiz, parsed_quiz = await agenerate_quiz_chunk(**quiz_args)
+    await sync_to_async(store_cached_quiz)(key, raw_quiz, parsed_quiz)
+    return parsed_quiz
+
+
+def generate_quiz_chunk(avoid=None, **quiz_args) -> tuple:
+    """
+    One AI generation: structured JSON first, the text format as a fallback.
+    - returns: (raw output, parsed quiz)
+    """
+    if OUTPUT_SETTINGS.get("STRUCTURED", True):
+        raw_quiz = generate__quiz(**quiz_args, structured=True, avoid=avoid)
+        parsed_quiz = parse_structured_quiz(raw_quiz, quiz_args.get("language", "English"))
+        if parsed_quiz is not None:
+            return raw_quiz, parsed_quiz
+    # Text mode, or the model didn't return a usable JSON quiz
+    raw_quiz = generate__quiz(**quiz_args, avoid=avoid)
+    return raw_quiz, parse_quiz_response(raw_quiz)
+
+
+async def agenerate_quiz_chunk(avoid=None, **quiz_args) -> tuple:
+    if OUTPUT_SETTINGS.get("STRUCTURED", True):
+        raw_quiz = await agenerate__quiz(**quiz_args, structured=True, avoid=avoid)
+        parsed_quiz = await aparse_structured_quiz(raw_quiz, quiz_args.get("language", "English"))
+        if parsed_quiz is not None:
+            return raw_quiz, parsed_quiz
+    raw_quiz = await agenerate__quiz(**quiz_args, avoid=avoid)
+    return raw_quiz, parse_quiz_response(raw_quiz)
+
+
+def plan_chunks(num_questions, difficulty, question_type) -> list:
+    """
+    Splits a large quiz into sub-generations of at most CHUNK_SIZE questions.
+    Every chunk keeps the requested type and difficulty: a mixed quiz asks each chunk
+    for a mix, and the AI varies the level of single questions around the requested one.
+    Each chunk is told its part number, so the chunks don't all write the same questions.
+    - returns: list of {"num_questions", "difficulty", "question_type", "part"}
+    """
+    size = FANOUT_SETTINGS.get("CHUNK_SIZE", 10)
+    count = -(-int(num_questions) // size)
+    base, extra = divmod(int(num_questions), count)
+    return [
+        {
+            "num_questions": base + (1 if index < extra else 0),
+            "difficulty": int(difficulty),
+            "question_type": question_type,
+            "part": (index + 1, count),
+        }
+        for index in range(count)
+    ]
+
+
+def is_near_duplicate(question, seen) -> bool:
+    """
+    True when a question asks what one in `seen` already asks: the same text, or a
+    similar text (shared words or edit distance) with the same answer. True/False
+    answers say little, so those only match on nearly identical text.
+    - question / seen: (type, text, answer) with text and answer normalized by grading.normalize_text
+    """
+    threshold = FANOUT_SETTINGS.get("DUPLICATE_THRESHOLD", 0.8)
+    q_type, text, answer = question
+    for other_type, other_text, other_answer in seen:
+        if text == other_text:
+            return True
+        if q_type == "TF" and other_type == "TF":
+            if edit_similarity(text, other_text) >= (1 + threshold) / 2:
+                return True
+            continue
+        if answer != other_answer:
+            continue
+        overall, _, _ = token_similarity(text, other_text)
+        if overall >= threshold or edit_similarity(text, other_text) >= threshold:
+            return True
+    return False
+
+
+def merge_unique(questions, merged, seen) -> None:
+    for question in questions:
+        key = (
+            str(question.get("type", "")).upper(),
+            normalize_text(question.get("text")),
+            normalize_text(question.get("answer")),
+        )
+        if key[1] and not is_near_duplicate(key, seen):
+            merged.append(question)
+            seen.append(key)
+
+
+def generate_fanout_quiz(topic, language, num_questions, difficulty, question_type, content) -> tuple:
+    """
+    Generates a large quiz as concurrent sub-generations (see plan_chunks), so the wall
+    time follows the slowest chunk instead of the quiz length. Near-duplicate questions
+    are dropped and replacements are requested, up to MAX_REFILL_ROUNDS times.
+    - returns: (raw outputs of all chunks, merged parsed quiz)
+    """
+    chunks = plan_chunks(num_questions, difficulty, question_type)
+    common = {"topic": topic, "language": language, "content": content}
+
+    # Chunk threads inherit the caller's context: rate limit identity, deadline, priority
+    with ThreadPoolExecutor(max_workers=FANOUT_SETTINGS.get("MAX_PARALLEL", 5)) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, generate_quiz_chunk, **common, **chunk)
+            for chunk in chunks
+        ]
+        results = [future.result() for future in futures]
+
+    raw_outputs = [raw for raw, _ in results]
+    merged, seen = [], []
+    for _, parsed in results:
+        merge_unique(parsed.get("questions", []), merged, seen)
+
+    for _ in range(FANOUT_SETTINGS.get("MAX_REFILL_ROUNDS", 2)):
+        missing = int(num_questions) - len(merged)
+        if missing <= 0:
+            break
+        raw, parsed = generate_quiz_chunk(
+            **common,
+            num_questions=missing,
+            difficulty=difficulty,
+            question_type=question_type,
+            avoid=[question["text"] for question in merged],
+        )
+        raw_outputs.append(raw)
+        merge_unique(parsed.get("questions", []), merged, seen)
+
+    return "\n\n".join(raw_outputs), merged_quiz(results[0][1], merged, topic, num_questions, difficulty)
+
+
+def merged_quiz(first, merged, topic, num_questions, difficulty) -> dict:
+    """
+    The parsed quiz of a fan-out. A quiz still short after the refill rounds is saved
+    with the questions it has; the shortfall is logged, counted in the metrics and
+    reported as "missing_questions".
+    """
+    missing = max(0, int(num_questions) - len(merged))
+    count_stat(fanout_stats, "quizzes")
+    if missing:
+        print(f"Fan-out quiz on {topic!r}: {len(merged)} of {num_questions} questions after deduplication")
+        count_stat(fanout_stats, "short_quizzes")
+        count_stat(fanout_stats, "missing_questions", missing)
+    return {
+        "topic": first.get("topic", topic),
+        "difficulty": int(difficulty),
+        "category": first.get("category", "General"),
+        "questions": merged[:int(num_questions)],
+        "missing_questions": missing,
+    }
+
+
+async def agenerate_fanout_quiz(topic, language, num_questions, difficulty, question_type, content) -> tuple:
+    """
+    generate_fanout_quiz for the async views: the chunks are concurrent coroutines.
+    """
+    chunks = plan_chunks(num_questions, difficulty, question_type)
+    common = {"topic": topic, "language": language, "content": content}
+    limit = asyncio.Semaphore(FANOUT_SETTINGS.get("MAX_PARALLEL", 5))
+
+    async def run_chunk(chunk):
+        async with limit:
+            return await agenerate_quiz_chunk(**common, **chunk)
+
+    results = await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+
+    raw_outputs = [raw for raw, _ in results]
+    merged, seen = [], []
+    for _, parsed in results:
+        merge_unique(parsed.get("questions", []), merged, seen)
+
+    for _ in range(FANOUT_SETTINGS.get("MAX_REFILL_ROUNDS", 2)):
+        missing = int(num_questions) - len(merged)
+        if missing <= 0:
+            break
+        raw, parsed = await agenerate_quiz_chunk(
+            **common,
+            num_questions=missing,
+            difficulty=difficulty,
+            question_type=question_type,
+            avoid=[question["text"] for question in merged],
+        )
+        raw_outputs.append(raw)
+        merge_unique(parsed.get("questions", []), merged, seen)
+
+    return "\n\n".join(raw_outputs), merged_quiz(results[0][1], merged, topic, num_questions, difficulty)
+
+
+def parse_structured_quiz(raw_quiz, language="English"):
+    """
+    Validates a JSON quiz; questions that fail validation are sent back to the AI
+    once, together with their errors, and dropped if the fix is still invalid.
+    Returns None when the reply isn't a JSON quiz, so the caller can fall back to text mode.
+    """
+    parsed_quiz, invalid = read_structured_quiz(raw_quiz)
+    repair_output = None
+    if parsed_quiz is not None and invalid and OUTPUT_SETTINGS.get("REPAIR", True):
+        try:
+            repair_output = repair_quiz_questions(invalid, language)
+        except Exception:
+            repair_output = None
+    return apply_repairs(parsed_quiz, invalid, repair_output)
+
+
+async def aparse_structured_quiz(raw_quiz, language="English"):
+    parsed_quiz, invalid = read_structured_quiz(raw_quiz)
+    repair_output = None
+    if parsed_quiz is not None and invalid and OUTPUT_SETTINGS.get("REPAIR", True):
+        try:
+            repair_output = await arepair_quiz_questions(invalid, language)
+        except Exception:
+            repair_output = None
+    return apply_repairs(parsed_quiz, invalid, repair_output)
+
+
+def read_structured_quiz(raw_quiz) -> tuple:
+    parsed_quiz, invalid = parse_quiz_json(raw_quiz)
+    if parsed_quiz is None:
+        count_stat(output_stats, "text_fallbacks")
+    else:
+        count_stat(output_stats, "structured")
+        count_stat(output_stats, "valid_questions", len(parsed_quiz["questions"]))
+    return parsed_quiz, invalid
+
+
+def apply_repairs(parsed_quiz, invalid, repair_output):
+    """
+    Adds the valid questions of the AI's repair reply; the rest of `invalid` is dropped.
+    """
+    if parsed_quiz is None:
+        return None
+    if invalid:
+        items = extract_json(repair_output) if repair_output else None
+        if isinstance(items, dict):
+            items = items.get("questions", [items])
+        repaired, _ = parse_quiz_items(items or [], parsed_quiz["difficulty"])
+        repaired = repaired[:len(invalid)]
+        parsed_quiz["questions"].extend(repaired)
+        count_stat(output_stats, "repaired", len(repaired))
+        count_stat(output_stats, "dropped", len(invalid) - len(repaired))
+
+    if not parsed_quiz["questions"]:
+        count_stat(output_stats, "text_fallbacks")
+        return None
+    return parsed_quiz
+
+
+def save_parsed_quiz(parsed_quiz, user=None, question_preference="MIX", topic="General", category="General", difficulty=1) -> Quiz:
+    """
+    Creates the Quiz, its Questions and MCQ Options from parse_quiz_response output.
+    """
+    quiz = Quiz.objects.create(
+        topic=parsed_quiz.get("topic", topic),
+        difficulty=int(parsed_quiz.get("difficulty", difficulty)),
+        category=parsed_quiz.get("category", category),
+        question_preference=question_preference,
+        user=user,
+    )
+
+    for q in parsed_quiz.get("questions", []):
+        question = Question.objects.create(
+            quiz=quiz,
+            text=q["text"],
+            question_type=q["type"].upper(),
+            difficulty=int(q.get("difficulty", difficulty)),
+            answer=q["answer"]
+        )
+
+        if q["type"].upper() == "MCQ" and q.get("mcq_options"):
+            Option.objects.bulk_create([
+                Option(question=question, text=opt.strip())
+                for opt in q["mcq_options"]
+            ])
+
+    return quiz
+
+
+def stream_quiz_generation(
+    user=None,
+    topic="General",
+    language="English",
+    category="General",
+    num_questions=5,
+    difficulty=1,
+    question_preference="MIX",
+    content=None,
+    use_cache=True,
+):
+    """
+    Generates a quiz while the AI is still writing it.
+    Questions are saved (and yielded) as soon as their block is complete,
+    answers and difficulty levels are filled in when they arrive.
+    A cached output of an identical request is replayed without calling the AI.
+    Yields (event, data) tuples: "quiz", "question", "answer" and finally "done".
+    If the stream stops before "done" the partly saved quiz is deleted.
+    """
+    key = generation_cache_key(content or topic, language, num_questions, difficulty, question_preference)
+    if use_cache:
+        parsed_quiz = get_cached_quiz(key)
+        if parsed_quiz is not None:
+            quiz = save_parsed_quiz(
+                parsed_quiz,
+                user=user,
+                question_preference=question_preference,
+                topic=topic,
+                category=category,
+                difficulty=difficulty,
+            )
+            yield from replay_quiz(quiz)
+            return
+
+    parser = QuizStreamParser()
+    raw_text = []
+    quiz = None
+    questions = {}
+
+    def handle(event, data):
+        nonlocal quiz
+        if event == "header":
+            quiz = Quiz.objects.create(
+                topic=data["topic"],
+                difficulty=data["difficulty"],
+                category=data["category"],
+                question_preference=question_preference,
+                user=user,
+            )
+            return [("quiz", {
+                "id": quiz.id,
+                "topic": quiz.topic,
+                "difficulty": quiz.difficulty,
+                "category": quiz.category,
+                "question_preference": quiz.question_preference,
+            })]
+
+        if event == "question" and quiz:
+            question = Question.objects.create(
+                quiz=quiz,
+                text=data["text"],
+                question_type=data["type"],
+                difficulty=data["difficulty"],
+                answer="",
+            )
+            options = []
+            if data["type"] == "MCQ":
+                options = [opt.strip() for opt in data["mcq_options"]]
+                Option.objects.bulk_create([Option(question=question, text=opt) for opt in options])
+            questions[data["index"]] = question
+            return [("question", {
+                "id": question.id,
+                "index": data["index"],
+                "text": question.text,
+                "type": question.question_type,
+                "difficulty": question.difficulty,
+                "options": options,
+            })]
+
+        if event == "answer" and data["index"] in questions:
+            question = questions[data["index"]]
+            Question.objects.filter(id=question.id).update(answer=data["answer"])
+            return [("answer", {"id": question.id, "index": data["index"], "answer": data["answer"]})]
+
+        if event == "difficulty" and data["index"] in questions:
+            Question.objects.filter(id=questions[data["index"]].id).update(difficulty=data["difficulty"])
+        return []
+
+    try:
+        for chunk in stream_quiz(
+            topic=topic,
+            language=language,
+            category=category,
+            num_questions=num_questions,
+            difficulty=difficulty,
+            question_type=question_preference,
+            content=content,
+        ):
+            raw_text.append(chunk)
+            for event, data in parser.feed(chunk):
+                yield from handle(event, data)
+
+        for event, data in parser.close():
+            yield from handle(event, data)
+
+        raw_quiz = "".join(raw_text)
+        parsed_quiz = parse_quiz_response(raw_quiz)
+        store_cached_quiz(key, raw_quiz, parsed_quiz)
+
+        if not questions:
+            # The output didn't follow the expected layout, fall back to the regex parser
+            if quiz:
+                quiz.delete()
+            quiz = save_parsed_quiz(
+                parsed_quiz,
+                user=user,
+                question_preference=question_preference,
+                topic=topic,
+                category=category,
+                difficulty=difficulty,
+            )
+            yield from replay_quiz(quiz)
+            return
+
+        yield ("done", {"quiz_id": quiz.id, "question_count": len(questions)})
+    except (GeneratorExit, Exception):
+        # Questions are saved before their answers arrive, so a quiz whose stream
+        # never reached "done" (client gone, AI error) would be graded against "".
+        if quiz and quiz.pk:
+            quiz.delete()
+        raise
+
+
+def replay_quiz(quiz):
+    """
+    Yields the stream_quiz_generation events of an already saved quiz.
+    """
+    yield ("quiz", {
+        "id": quiz.id,
+        "topic": quiz.topic,
+        "difficulty": quiz.difficulty,
+        "category": quiz.category,
+        "question_preference": quiz.question_preference,
+    })
+    questions = list(quiz.questions.prefetch_related("options"))
+    for index, question in enumerate(questions, start=1):
+        yield ("question", {
+            "id": question.id,
+            "index": index,
+            "text": question.text,
+            "type": question.question_type,
+            "difficulty": question.difficulty,
+            "options": [opt.text for opt in question.options.all()],
+        })
+        yield ("answer", {"id": question.id, "index": index, "answer": question.answer})
+    yield ("done", {"quiz_id": quiz.id, "question_count": len(questions)})
+
+
+def queue_generation_job(user, params, upload_files=()) -> GenerationJob:
+    """
+    Stores a generation request for the generate_quizzes worker.
+    - params: the GenerateQuizAPI fields (topic, language, num_questions, difficulty,
+      question_preference, category, prompt, url, urls, text, page_range, use_cache)
+    - upload_files: at most one file, a job stores a single upload
+    Raises UnsupportedFileType for an upload no extractor can read, before it is stored.
+    """
+    if len(upload_files) > 1:
+        raise ValueError("A queued quiz takes one uploaded file; send several files without async.")
+    for upload_file in upload_files:
+        get_extractor(upload_file)
+    return GenerationJob.objects.create(user=user, params=params, upload=upload_files[0] if upload_files else None)
+
+
+def claim_pending_jobs(limit: int) -> list:
+    """
+    Claims up to `limit` jobs that are due, oldest first.
+    The conditional update makes sure two workers never claim the same job.
+    """
+    claimed = []
+    candidates = (
+        GenerationJob.objects.filter(status="pending", run_after__lte=timezone.now())
+        .order_by("created_at")
+        .values_list("id", flat=True)
+    )
+    for job_id in candidates[:limit * 2]:
+        if GenerationJob.objects.filter(id=job_id, status="pending").update(status="running", updated_at=timezone.now()):
+            claimed.append(job_id)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def requeue_stale_jobs(stale_after: int) -> int:
+    """
+    Puts jobs claimed by a worker that died more than `stale_after` seconds ago back in the queue.
+    """
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    return GenerationJob.objects.filter(status="running", updated_at__lt=cutoff).update(status="pending")
+
+
+def set_job_stage(job, stage, progress) -> None:
+    job.stage = stage
+    job.progress = progress
+    job.save(update_fields=["stage", "progress", "updated_at"])
+
+
+def discard_job_upload(job) -> None:
+    """
+    Deletes the stored upload of a job that reached a final state, it won't be read again.
+    """
+    if job.upload:
+        job.upload.delete(save=False)
+
+
+def run_generation_job(job_id) -> GenerationJob:
+    """
+    Fetches the content, generates and saves the quiz of a claimed job.
+    Transient errors put the job back in the queue with an exponential backoff,
+    until MAX_ATTEMPTS is reached.
+    """
+    job = GenerationJob.objects.get(id=job_id)
+    params = job.params
+    job.attempts += 1
+    job.save(update_fields=["attempts", "updated_at"])
+
+    try:
+        set_job_stage(job, "fetching", 10)
+        upload_file = job.upload.open("rb") if job.upload else None
+        try:
+            content_source = resolve_content_source(
+                params.get("topic", "General"),
+                params.get("prompt", ""),
+                params.get("url", ""),
+                params.get("text", ""),
+                upload_file,
+                params.get("page_range", ""),
+                urls=params.get("urls", []),
+            )
+        finally:
+            if upload_file:
+                upload_file.close()
+
+        set_job_stage(job, "generating", 40)
+        parsed_quiz = generate_parsed_quiz(
+            topic=params.get("topic", "General"),
+            language=params.get("language", "English"),
+            num_questions=params.get("num_questions", 5),
+            difficulty=params.get("difficulty", 1),
+            question_type=params.get("question_preference", "MIX"),
+            content=content_source,
+            use_cache=params.get("use_cache", True),
+        )
+
+        set_job_stage(job, "saving", 80)
+        quiz = save_parsed_quiz(
+            parsed_quiz,
+            user=job.user,
+            question_preference=params.get("question_preference", "MIX"),
+            topic=params.get("topic", "General"),
+            category=params.get("category", "General"),
+            difficulty=params.get("difficulty", 1),
+        )
+    except Exception as e:
+        job.error = str(e)
+        if is_transient_error(e) and job.attempts < WORKER_SETTINGS.get("MAX_ATTEMPTS", 3):
+            backoff = WORKER_SETTINGS.get("RETRY_BACKOFF", 5) * 2 ** (job.attempts - 1)
+            job.status = "pending"
+            job.run_after = timezone.now() + timedelta(seconds=backoff * random.uniform(0.8, 1.2))
+        else:
+            job.status = "failed"
+            discard_job_upload(job)
+        job.save(update_fields=["error", "status", "run_after", "upload", "updated_at"])
+        raise
+
+    job.quiz = quiz
+    job.status = "done"
+    job.stage = "done"
+    job.progress = 100
+    job.error = ""
+    discard_job_upload(job)
+    job.save(update_fields=["quiz", "status", "stage", "progress", "error", "upload", "updated_at"])
+    return job
@@ -0,0 +1,448 @@
+import time
+import asyncio
+import heapq
+import itertools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from cachetools import TTLCache
+from django.conf import settings
+from django.http import JsonResponse
+
+GOVERNOR_SETTINGS = getattr(settings, "LLM_GOVERNOR", {})
+PRIORITIES = GOVERNOR_SETTINGS.get("PRIORITIES", {"grading": 0, "chat": 1, "generation": 2, "background": 3})
+
+current_request = contextvars.ContextVar("llm_current_request", default=None)
+current_caller = contextvars.ContextVar("llm_current_caller", default=None)
+current_priority = contextvars.ContextVar("llm_current_priority", default=None)
+current_deadline = contextvars.ContextVar("llm_current_deadline", default=None)
+
+
+class LLMBusyError(Exception):
+    """
+    An AI call was refused to protect the upstream API.
+    `status_code` and `retry_after` (seconds) are meant for the HTTP response.
+    """
+    status_code = 503
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(round(retry_after)))
+
+
+class LLMTimeoutError(TimeoutError):
+    """An AI call got no answer within its timeout or the request's remaining budget."""
+    status_code = 504
+
+
+class LLMQueueFullError(LLMBusyError):
+    status_code = 503
+
+
+class LLMRateLimitedError(LLMBusyError):
+    status_code = 429
+
+
+def remaining_budget():
+    """
+    Seconds left before the current deadline (resilience.deadline), or None outside of one.
+    """
+    until = current_deadline.get()
+    return None if until is None else until - time.monotonic()
+
+
+class TokenBucket:
+    """
+    Per-caller token buckets: each AI call takes one token, tokens refill at `rate`
+    per second up to `burst`. Idle callers are forgotten once their bucket is full again.
+    """
+
+    def __init__(self, rate, burst, max_callers=10000):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = TTLCache(maxsize=max_callers, ttl=max(1.0, burst / rate))
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def take(self, caller) -> float:
+        """
+        Takes a token for caller. Returns 0 on success, else the seconds until one is available.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(caller, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self.buckets[caller] = (tokens - 1, now)
+                return 0.0
+            self.buckets[caller] = (tokens, now)
+            self.rejected += 1
+            return (1 - tokens) / self.rate
+
+
+class Ticket:
+    """A call waiting for a slot. `wake` is called once the slot has been handed to it."""
+
+    __slots__ = ("rank", "sequence", "granted", "wake")
+
+    def __init__(self, rank, sequence, wake):
+        self.rank = rank
+        self.sequence = sequence
+        self.granted = False
+        self.wake = wake
+
+    def __lt__(self, other):
+        return (self.rank, self.sequence) < (other.rank, other.sequence)
+
+
+class Governor:
+    """
+    Caps the AI calls running at once in this process. Calls over the limit wait in a
+    bounded priority queue (lower rank first, FIFO within a rank); when the queue is
+    full or the wait exceeds `queue_timeout`, the call is shed with LLMQueueFullError.
+    The wait never outlasts the request's deadline, which raises LLMTimeoutError.
+    A released slot is handed straight to the first waiter, which can be a thread
+    (acquire) or a coroutine (aacquire), so async views wait without holding a thread.
+    """
+
+    def __init__(self, max_concurrency=8, max_queue=100, queue_timeout=30.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+        self.waiting = []
+        self.active = 0
+        self.counters = {"admitted": 0, "queued": 0, "shed": 0, "timed_out": 0}
+        self.peak_queue = 0
+        self.wait_times = deque(maxlen=1000)
+
+    def enqueue(self, rank, start, wake):
+        """
+        Takes a free slot (returns None) or queues a ticket (returns it).
+        Must be called with the lock held.
+        """
+        if self.active < self.max_concurrency and not self.waiting:
+            self.admit(start)
+            return None
+        if len(self.waiting) >= self.max_queue:
+            self.counters["shed"] += 1
+            raise LLMQueueFullError("The AI service is busy, please try again shortly.", self.queue_timeout / 4)
+
+        ticket = Ticket(rank, next(self.sequence), wake)
+        heapq.heappush(self.waiting, ticket)
+        self.counters["queued"] += 1
+        self.peak_queue = max(self.peak_queue, len(self.waiting))
+        return ticket
+
+    def abandon(self, ticket) -> bool:
+        """
+        Takes a timed out or cancelled ticket out of the queue.
+        Returns True when the slot was handed over in the meantime (the caller owns it).
+        Must be called with the lock held.
+        """
+        if ticket.granted:
+            return True
+        self.waiting.remove(ticket)
+        heapq.heapify(self.waiting)
+        return False
+
+    def wait_timeout(self) -> tuple:
+        """
+        How long a queued call may wait for a slot: queue_timeout, or less when the
+        request's deadline comes first. Returns (seconds, capped by the deadline).
+        """
+        remaining = remaining_budget()
+        if remaining is not None and remaining < self.queue_timeout:
+            return max(0.0, remaining), True
+        return self.queue_timeout, False
+
+    def wait_error(self, budgeted) -> Exception:
+        if budgeted:
+            return LLMTimeoutError("The request ran out of time waiting for the AI service.")
+        return LLMQueueFullError("The AI service is busy, please try again shortly.", self.queue_timeout / 4)
+
+    def acquire(self, rank) -> None:
+        start = time.monotonic()
+        event = threading.Event()
+        with self.lock:
+            ticket = self.enqueue(rank, start, event.set)
+        if ticket is None:
+            return
+
+        timeout, budgeted = self.wait_timeout()
+        if not event.wait(timeout):
+            with self.lock:
+                if not self.abandon(ticket):
+                    self.counters["timed_out"] += 1
+                    raise self.wait_error(budgeted)
+        self.wait_times.append(time.monotonic() - start)
+
+    async def aacquire(self, rank) -> None:
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self.lock:
+            ticket = self.enqueue(rank, start, wake)
+        if ticket is None:
+            return
+
+        timeout, budgeted = self.wait_timeout()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                if not self.abandon(ticket):
+                    self.counters["timed_out"] += 1
+                    raise self.wait_error(budgeted)
+        except asyncio.CancelledError:
+            with self.lock:
+                granted = self.abandon(ticket)
+            if granted:
+                self.release()
+            raise
+        self.wait_times.append(time.monotonic() - start)
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a slot only if one is free right now, without queueing.
+        """
+        with self.lock:
+            if self.active < self.max_concurrency and not self.waiting:
+                self.admit(time.monotonic())
+                return True
+            return False
+
+    def admit(self, start) -> None:
+        self.active += 1
+        self.counters["admitted"] += 1
+        self.wait_times.append(time.monotonic() - start)
+
+    def release(self) -> None:
+        with self.lock:
+            if self.waiting and self.active <= self.max_concurrency:
+                # Hand the slot over: `active` stays the same
+                ticket = heapq.heappop(self.waiting)
+                ticket.granted = True
+                self.counters["admitted"] += 1
+                ticket.wake()
+            else:
+                self.active -= 1
+
+    @contextmanager
+    def slot(self, rank):
+        self.acquire(rank)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, rank):
+        await self.aacquire(rank)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self.lock:
+            ranks = {rank: name for name, rank in PRIORITIES.items()}
+            depth = {name: 0 for name in PRIORITIES}
+            for ticket in self.waiting:
+                name = ranks.get(ticket.rank, str(ticket.rank))
+                depth[name] = depth.get(name, 0) + 1
+            waits = sorted(self.wait_times)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "queue_depth": sum(depth.values()),
+            "queue_depth_by_priority": depth,
+            "peak_queue_depth": self.peak_queue,
+            **self.counters,
+            "wait_ms": {
+                "avg": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+                "p95": round(1000 * waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1) if waits else 0.0,
+                "max": round(1000 * waits[-1], 1) if waits else 0.0,
+            },
+        }
+
+
+governor = Governor(
+    max_concurrency=GOVERNOR_SETTINGS.get("MAX_CONCURRENCY", 8),
+    max_queue=GOVERNOR_SETTINGS.get("MAX_QUEUE", 100),
+    queue_timeout=GOVERNOR_SETTINGS.get("QUEUE_TIMEOUT", 30),
+)
+user_buckets = TokenBucket(
+    rate=GOVERNOR_SETTINGS.get("USER_RATE", 0.5),
+    burst=GOVERNOR_SETTINGS.get("USER_BURST", 10),
+)
+
+
+def caller_key(request):
+    """
+    Rate-limit identity of an HTTP request: the user id, or the client IP for guests.
+    """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def resolve_caller():
+    caller = current_caller.get()
+    if caller is None and current_request.get() is not None:
+        # Resolved at call time: DRF authenticates (JWT) after the middleware ran
+        caller = caller_key(current_request.get())
+    return caller
+
+
+@contextmanager
+def llm_context(caller=None, priority=None):
+    """
+    Sets who AI calls in this block are made for and/or overrides their priority class.
+    """
+    tokens = []
+    if caller is not None:
+        tokens.append((current_caller, current_caller.set(caller)))
+    if priority is not None:
+        tokens.append((current_priority, current_priority.set(priority)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def admission(priority, charge):
+    """
+    Charges the caller's token bucket and returns the queue rank of the call.
+    """
+    caller = resolve_caller() if charge else None
+    if caller is not None:
+        wait = user_buckets.take(caller)
+        if wait:
+            raise LLMRateLimitedError("Too many AI requests, please slow down.", wait)
+
+    priority = current_priority.get() or priority
+    return PRIORITIES.get(priority, max(PRIORITIES.values(), default=0))
+
+
+@contextmanager
+def governed_call(priority, charge=True):
+    """
+    Admits one AI call: charges the caller's token bucket, then waits for a slot.
+    Calls made outside a request (workers, shell) have no caller and no rate limit.
+    - charge: False for retries of a call that was already charged
+    """
+    if not GOVERNOR_SETTINGS.get("ENABLED", True):
+        yield
+        return
+
+    with governor.slot(admission(priority, charge)):
+        yield
+
+
+@asynccontextmanager
+async def agoverned_call(priority, charge=True):
+    """
+    governed_call for coroutines: waiting for a slot doesn't block a thread.
+    """
+    if not GOVERNOR_SETTINGS.get("ENABLED", True):
+        yield
+        return
+
+    async with governor.aslot(admission(priority, charge)):
+        yield
+
+
+def no_slot() -> None:
+    pass
+
+
+def acquire_slot(priority, charge=True):
+    """
+    Admits one AI call like governed_call, but returns the slot's release function
+    instead of releasing it at the end of a block. resilience runs the upstream call
+    on a pool thread and releases the slot when that thread finishes, so a call the
+    caller stopped waiting for still counts against MAX_CONCURRENCY.
+    """
+    if not GOVERNOR_SETTINGS.get("ENABLED", True):
+        return no_slot
+    governor.acquire(admission(priority, charge))
+    return governor.release
+
+
+async def aacquire_slot(priority, charge=True):
+    """
+    acquire_slot for coroutines: waiting for a slot doesn't block a thread.
+    """
+    if not GOVERNOR_SETTINGS.get("ENABLED", True):
+        return no_slot
+    await governor.aacquire(admission(priority, charge))
+    return governor.release
+
+
+def try_acquire_slot():
+    """
+    A slot for an extra request (a hedge) only if one is free right now.
+    Returns its release function, or None when the governor is at its cap.
+    """
+    if not GOVERNOR_SETTINGS.get("ENABLED", True):
+        return no_slot
+    return governor.release if governor.try_acquire() else None
+
+
+def governor_stats() -> dict:
+    return {
+        **governor.stats(),
+        "rate_limited": user_buckets.rejected,
+    }
+
+
+def llm_busy_response(error) -> JsonResponse:
+    response = JsonResponse({"status": "error", "message": str(error)}, status=error.status_code)
+    response["Retry-After"] = str(error.retry_after)
+    return response
+
+
+class LLMCallerMiddleware:
+    """
+    Remembers the current request so AI calls can be rate limited per user,
+    and answers refused AI calls with 429/503 and a Retry-After header.
+    Works in sync (WSGI) and async (ASGI) stacks.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+    async def __acall__(self, request):
+        token = current_request.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, LLMBusyError):
+            return llm_busy_response(exception)
+        return None
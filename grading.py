@@ -0,0 +1,625 @@
+import re
+import random
+import asyncio
+import hashlib
+import threading
+import unicodedata
+from datetime import timedelta
+from cachetools import TTLCache
+from django.conf import settings
+from django.utils import timezone
+from app.models import GradingVerdict, QuizAttempt
+from asgiref.sync import sync_to_async
+from services import check_answers_batch, acheck_answers_batch
+from resilience import is_transient_error
+from constants import TF_SYNONYMS
+
+# Question types whose answers are resolved locally against the stored answer / options
+CHOICE_TYPES = ("MCQ", "TF")
+# Question types whose answers are fuzzy matched locally, the AI decides the unclear ones
+TEXT_TYPES = ("SHORT", "FILL")
+WORKER_SETTINGS = getattr(settings, "GRADING_WORKER", {})
+
+# "b", "(b)", "b)", "b." or "option b"
+OPTION_LETTER_RE = re.compile(r"^(?:option\s+)?\(?([a-z])\)?[.:]?$", re.IGNORECASE)
+# "b) Paris", "(b) Paris", "b. Paris", "b: Paris", "b - Paris"
+OPTION_LETTER_TEXT_RE = re.compile(r"^(?:option\s+)?\(?([a-z])(?:\)|[.:]|\s+-)\s*(.+)$", re.IGNORECASE)
+
+
+def clean_choice(value) -> str:
+    """
+    Lowercases a choice and strips surrounding quotes, punctuation and extra spaces.
+    """
+    value = " ".join(str(value or "").split()).lower()
+    return value.strip(" .,;!?\"'`")
+
+
+def resolve_truth(value):
+    """
+    Maps a True/False answer in any supported language to True or False.
+    Only the first word is used, so "False, it is Paris" resolves too.
+    Returns None when the answer can't be resolved.
+    """
+    words = re.findall(r"\w+", str(value or "").lower())
+    if not words:
+        return None
+    if " ".join(words) in TF_SYNONYMS:
+        return TF_SYNONYMS[" ".join(words)]
+    return TF_SYNONYMS.get(words[0])
+
+
+def resolve_option(options, value):
+    """
+    Maps an answer (option letter, option text or both) to one of the question's options.
+    - options: the question's Option objects, in the order they were generated
+    Returns None when no option matches or the letter and text point to different options.
+    """
+    value = clean_choice(value)
+    if not value or not options:
+        return None
+
+    by_text = [opt for opt in options if clean_choice(opt.text) == value]
+    if len(by_text) == 1:
+        return by_text[0]
+    if by_text:
+        return None
+
+    match = OPTION_LETTER_RE.match(value)
+    if match:
+        index = ord(match.group(1).lower()) - ord("a")
+        return options[index] if index < len(options) else None
+
+    match = OPTION_LETTER_TEXT_RE.match(value)
+    if match:
+        index = ord(match.group(1).lower()) - ord("a")
+        by_letter = options[index] if index < len(options) else None
+        text = clean_choice(match.group(2))
+        if by_letter and clean_choice(by_letter.text) == text:
+            return by_letter
+        if by_letter is None:
+            by_text = [opt for opt in options if clean_choice(opt.text) == text]
+            if len(by_text) == 1:
+                return by_text[0]
+    return None
+
+
+def grade_choice(question, user_answer):
+    """
+    Grades an MCQ or True/False answer without the AI.
+    Returns True/False, or None when the answer is ambiguous and the AI should decide.
+    """
+    if question.question_type == "TF":
+        given = resolve_truth(user_answer)
+        expected = resolve_truth(question.answer)
+        if given is None or expected is None:
+            return None
+        return given == expected
+
+    if clean_choice(user_answer) == clean_choice(question.answer):
+        return True
+
+    options = sorted(question.options.all(), key=lambda opt: opt.id)
+    given = resolve_option(options, user_answer)
+    expected = resolve_option(options, question.answer)
+    if given is None or expected is None:
+        return None
+    return given.id == expected.id
+
+
+_fuzzy_settings = getattr(settings, "FUZZY_GRADING", {})
+FUZZY_ACCEPT = _fuzzy_settings.get("ACCEPT", 0.9)
+FUZZY_REJECT = _fuzzy_settings.get("REJECT", 0.25)
+FUZZY_TOKEN_MATCH = _fuzzy_settings.get("TOKEN_MATCH", 0.8)
+ARTICLES = set(_fuzzy_settings.get("ARTICLES", ["a", "an", "the"]))
+
+# Longer answers are compared on their first characters only
+EDIT_DISTANCE_MAX_CHARS = 200
+
+
+def normalize_text(value) -> str:
+    """
+    Normalizes a free text answer for comparison:
+    lowercase, no punctuation, no articles and single spaces.
+    """
+    value = unicodedata.normalize("NFKC", str(value or "")).lower()
+    value = "".join(
+        " " if unicodedata.category(char).startswith("P") else char
+        for char in value
+    )
+    return " ".join(word for word in value.split() if word not in ARTICLES)
+
+
+def levenshtein(a: str, b: str) -> int:
+    """
+    Edit distance between two strings (insertions, deletions and substitutions).
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        previous = current
+    return previous[-1]
+
+
+def edit_similarity(a: str, b: str) -> float:
+    """
+    1.0 for identical strings, 0.0 for completely different ones.
+    """
+    a = a[:EDIT_DISTANCE_MAX_CHARS]
+    b = b[:EDIT_DISTANCE_MAX_CHARS]
+    longest = max(len(a), len(b))
+    if not longest:
+        return 1.0
+    return 1 - levenshtein(a, b) / longest
+
+
+def token_similarity(a: str, b: str) -> tuple:
+    """
+    Compares the words of two normalized answers. Words match when they are equal or
+    within a small typo of each other; a typo match counts its edit similarity, not 1.
+    Returns (matched / larger word count, matched / smaller word count, close).
+    close is False when a matched word is only a near miss ("nitrate" / "nitrite",
+    below FUZZY_ACCEPT) or the matched words are in another order ("dog bites man").
+    """
+    words_a = a.split()
+    words_b = b.split()
+    if not words_a or not words_b:
+        return 0.0, 0.0, False
+
+    unmatched_b = dict(enumerate(words_b))
+    positions = {}  # index in a -> index in b
+    for index, word in enumerate(words_a):
+        other_index = next((i for i, other in unmatched_b.items() if other == word), None)
+        if other_index is not None:
+            positions[index] = other_index
+            del unmatched_b[other_index]
+
+    matched = float(len(positions))
+    close = True
+    for index, word in enumerate(words_a):
+        if index in positions or not unmatched_b:
+            continue
+        similarity, other_index = max((edit_similarity(word, other), i) for i, other in unmatched_b.items())
+        if similarity >= FUZZY_TOKEN_MATCH:
+            positions[index] = other_index
+            del unmatched_b[other_index]
+            matched += similarity
+            close = close and similarity >= FUZZY_ACCEPT
+
+    order = [positions[index] for index in sorted(positions)]
+    close = close and order == sorted(order)
+    return (
+        matched / max(len(words_a), len(words_b)),
+        matched / min(len(words_a), len(words_b)),
+        close,
+    )
+
+
+def fuzzy_grade(user_answer, correct_answer):
+    """
+    Grades a SHORT or FILL answer locally.
+    Returns True above the accept threshold, False below the reject threshold,
+    and None for the uncertain band in between, which the AI should decide.
+    Near misses of a word and reordered words are never accepted locally.
+    """
+    given = normalize_text(user_answer)
+    expected = normalize_text(correct_answer)
+    if not given or not expected:
+        return None
+    if given == expected:
+        return True
+
+    token_score, overlap, close = token_similarity(given, expected)
+    score = max(token_score, edit_similarity(given, expected))
+
+    # "1945" and "1946" are close as strings but never the same answer
+    same_numbers = re.findall(r"\d+", given) == re.findall(r"\d+", expected)
+    if score >= FUZZY_ACCEPT and close and same_numbers:
+        return True
+    if max(score, overlap) < FUZZY_REJECT:
+        return False
+    return None
+
+
+def answer_hash(value) -> str:
+    """
+    SHA-256 of a normalized answer, used as the verdict cache key.
+    """
+    return hashlib.sha256(clean_choice(value).encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    """
+    Cache of AI grading verdicts keyed by (question id, answer hash).
+    - memory: bounded LRU with a TTL, one per process
+    - database: optional GradingVerdict table shared by every process
+    Each verdict remembers the hash of the correct answer it was graded against,
+    so it is ignored once the question's answer changes (Question.save also
+    deletes the stored rows).
+    Answers that are being graded by another request are waited for instead of
+    being sent to the AI twice.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60 * 60 * 24, persist=True):
+        self.ttl = ttl
+        self.persist = persist
+        self.memory = TTLCache(maxsize=max_entries, ttl=ttl)
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get_many(self, items) -> dict:
+        """
+        Looks up cached verdicts for items with "question_id", "answer_hash" and "expected_hash".
+        Returns {(question_id, answer_hash): True/False} for the hits.
+        """
+        found = {}
+        missing = []
+        with self.lock:
+            for item in items:
+                key = (item["question_id"], item["answer_hash"])
+                cached = self.memory.get(key)
+                if cached is not None and cached[0] == item["expected_hash"]:
+                    found[key] = cached[1]
+                else:
+                    missing.append(item)
+            self.hits += len(found)
+
+        if missing and self.persist:
+            cutoff = timezone.now() - timedelta(seconds=self.ttl)
+            rows = GradingVerdict.objects.filter(
+                question_id__in={item["question_id"] for item in missing},
+                answer_hash__in={item["answer_hash"] for item in missing},
+                created_at__gte=cutoff,
+            ).values_list("question_id", "answer_hash", "expected_hash", "is_correct")
+            stored = {(q_id, a_hash): (e_hash, correct) for q_id, a_hash, e_hash, correct in rows}
+
+            with self.lock:
+                for item in missing:
+                    key = (item["question_id"], item["answer_hash"])
+                    row = stored.get(key)
+                    if row is not None and row[0] == item["expected_hash"]:
+                        found[key] = row[1]
+                        self.memory[key] = row
+                        self.db_hits += 1
+
+        with self.lock:
+            self.misses += len(items) - len(found)
+        return found
+
+    def set_many(self, items, verdicts) -> None:
+        """
+        Stores verdicts for items, verdicts being {(question_id, answer_hash): True/False}.
+        """
+        with self.lock:
+            for item in items:
+                key = (item["question_id"], item["answer_hash"])
+                if key in verdicts:
+                    self.memory[key] = (item["expected_hash"], verdicts[key])
+
+        if self.persist:
+            GradingVerdict.objects.bulk_create(
+                [
+                    GradingVerdict(
+                        question_id=item["question_id"],
+                        answer_hash=item["answer_hash"],
+                        expected_hash=item["expected_hash"],
+                        is_correct=verdicts[(item["question_id"], item["answer_hash"])],
+                    )
+                    for item in items
+                    if (item["question_id"], item["answer_hash"]) in verdicts
+                ],
+                update_conflicts=True,
+                unique_fields=["question", "answer_hash"],
+                update_fields=["expected_hash", "is_correct", "created_at"],
+            )
+
+    def claim(self, keys) -> tuple:
+        """
+        Marks keys as being graded by the caller.
+        Returns (claimed keys, {key: event} for keys another request is already grading).
+        """
+        claimed = []
+        waiting = {}
+        with self.lock:
+            for key in keys:
+                if key in self.in_flight:
+                    waiting[key] = self.in_flight[key]
+                elif key not in claimed:
+                    self.in_flight[key] = threading.Event()
+                    claimed.append(key)
+        return claimed, waiting
+
+    def release(self, keys) -> None:
+        with self.lock:
+            for key in keys:
+                event = self.in_flight.pop(key, None)
+                if event:
+                    event.set()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.db_hits + self.misses
+            return {
+                "entries": len(self.memory),
+                "max_entries": self.memory.maxsize,
+                "ttl": self.ttl,
+                "persist": self.persist,
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.db_hits) / lookups, 3) if lookups else 0,
+            }
+
+
+_cache_settings = getattr(settings, "GRADING_CACHE", {})
+verdict_cache = VerdictCache(
+    max_entries=_cache_settings.get("MAX_ENTRIES", 10000),
+    ttl=_cache_settings.get("TTL", 60 * 60 * 24),
+    persist=_cache_settings.get("PERSIST", True),
+)
+
+
+def cache_key(item) -> tuple:
+    return (item["question_id"], item["answer_hash"])
+
+
+def grade_and_store(items) -> dict:
+    """
+    Grades items with one batched AI call and stores the verdicts in the cache.
+    """
+    graded = check_answers_batch(items)
+    verdicts = {cache_key(item): graded[item["id"]] for item in items}
+    verdict_cache.set_many(items, verdicts)
+    return verdicts
+
+
+def add_cache_keys(pending) -> None:
+    for item in pending:
+        item["question_id"] = item["id"]
+        item["answer_hash"] = answer_hash(item["given"])
+        item["expected_hash"] = answer_hash(item["expected"])
+
+
+def grade_with_ai(pending) -> dict:
+    """
+    Grades items for the AI through the verdict cache.
+    Only answers that no one has graded yet are sent, in one batched call.
+    Returns {question_id: True/False}.
+    """
+    add_cache_keys(pending)
+
+    verdicts = verdict_cache.get_many(pending)
+    missing = [item for item in pending if cache_key(item) not in verdicts]
+
+    claimed, waiting = verdict_cache.claim([cache_key(item) for item in missing])
+    try:
+        to_grade = [item for item in missing if cache_key(item) in claimed]
+        if to_grade:
+            verdicts.update(grade_and_store(to_grade))
+    finally:
+        verdict_cache.release(claimed)
+
+    if waiting:
+        # Another request is grading the same answers, reuse its verdicts
+        for event in waiting.values():
+            event.wait(timeout=60)
+        waited = [item for item in missing if cache_key(item) in waiting]
+        verdicts.update(verdict_cache.get_many(waited))
+        late = [item for item in waited if cache_key(item) not in verdicts]
+        if late:
+            verdicts.update(grade_and_store(late))
+
+    return {item["id"]: verdicts.get(cache_key(item), False) for item in pending}
+
+
+async def agrade_and_store(items) -> dict:
+    graded = await acheck_answers_batch(items)
+    verdicts = {cache_key(item): graded[item["id"]] for item in items}
+    await sync_to_async(verdict_cache.set_many)(items, verdicts)
+    return verdicts
+
+
+async def agrade_with_ai(pending) -> dict:
+    """
+    grade_with_ai for the async views: the AI call is awaited and cache reads and
+    writes run through sync_to_async, like Django's async ORM methods.
+    """
+    add_cache_keys(pending)
+
+    verdicts = await sync_to_async(verdict_cache.get_many)(pending)
+    missing = [item for item in pending if cache_key(item) not in verdicts]
+
+    claimed, waiting = verdict_cache.claim([cache_key(item) for item in missing])
+    try:
+        to_grade = [item for item in missing if cache_key(item) in claimed]
+        if to_grade:
+            verdicts.update(await agrade_and_store(to_grade))
+    finally:
+        verdict_cache.release(claimed)
+
+    if waiting:
+        # Another request is grading the same answers: poll its events instead of blocking the loop
+        for _ in range(600):
+            if all(event.is_set() for event in waiting.values()):
+                break
+            await asyncio.sleep(0.1)
+        waited = [item for item in missing if cache_key(item) in waiting]
+        verdicts.update(await sync_to_async(verdict_cache.get_many)(waited))
+        late = [item for item in waited if cache_key(item) not in verdicts]
+        if late:
+            verdicts.update(await agrade_and_store(late))
+
+    return {item["id"]: verdicts.get(cache_key(item), False) for item in pending}
+
+
+def grade_locally(questions, user_answers) -> tuple:
+    """
+    Grades every answer of one quiz submission that doesn't need the AI.
+    - questions: iterable of Question objects
+    - user_answers: dict of {question_id (str): user_answer}
+    MCQ and True/False answers are resolved locally against the stored options,
+    SHORT and FILL answers are fuzzy matched against the stored answer.
+    Returns ({question_id: True/False}, [items the AI has to grade]).
+    """
+    results = {}
+    pending = []
+
+    if hasattr(questions, "prefetch_related"):
+        questions = questions.prefetch_related("options")
+
+    for question in questions:
+        user_answer = user_answers.get(str(question.id))
+        if not user_answer:
+            results[question.id] = False
+            continue
+
+        user_answer = str(user_answer)
+        if question.question_type in CHOICE_TYPES:
+            verdict = grade_choice(question, user_answer)
+            if verdict is not None:
+                results[question.id] = verdict
+                continue
+
+        if question.question_type in TEXT_TYPES:
+            verdict = fuzzy_grade(user_answer, question.answer)
+            if verdict is not None:
+                results[question.id] = verdict
+                continue
+
+        pending.append({
+            "id": question.id,
+            "type": question.question_type,
+            "question": question.text,
+            "expected": question.answer,
+            "given": user_answer,
+        })
+
+    return results, pending
+
+
+def grade_submission(questions, user_answers) -> tuple:
+    """
+    Grades every answer of one quiz submission.
+    Answers grade_locally can't decide go through the verdict cache, and the
+    ones not cached yet are sent together in one batched AI call.
+    Returns (marks, {question_id: True/False}).
+    """
+    results, pending = grade_locally(questions, user_answers)
+    if pending:
+        results.update(grade_with_ai(pending))
+
+    marks = sum(1 for correct in results.values() if correct)
+    return marks, results
+
+
+async def agrade_submission(questions, user_answers) -> tuple:
+    """
+    grade_submission for the async views.
+    - questions: Question objects with their options prefetched
+    """
+    results, pending = await sync_to_async(grade_locally)(questions, user_answers)
+    if pending:
+        results.update(await agrade_with_ai(pending))
+
+    marks = sum(1 for correct in results.values() if correct)
+    return marks, results
+
+
+def queue_attempt_grading(attempt, questions, user_answers) -> bool:
+    """
+    Async grading mode: grades what can be graded locally right away and leaves
+    the rest to the grade_attempts worker.
+    Saves the attempt and returns True if it still waits for the worker.
+    """
+    results, pending = grade_locally(questions, user_answers)
+    attempt.answers = user_answers
+    attempt.results = {str(question_id): correct for question_id, correct in results.items()}
+    attempt.score = sum(1 for correct in results.values() if correct)
+    attempt.status = "pending" if pending else "graded"
+    attempt.grading_attempts = 0
+    attempt.run_after = timezone.now()
+    attempt.save()
+    return bool(pending)
+
+
+def retry_failed_attempt(attempt) -> bool:
+    """
+    Puts a failed attempt back in the queue with a fresh MAX_ATTEMPTS.
+    Returns False if the attempt wasn't failed (anymore).
+    """
+    now = timezone.now()
+    retried = QuizAttempt.objects.filter(id=attempt.id, status="failed").update(
+        status="pending", grading_attempts=0, run_after=now, updated_at=now
+    )
+    if retried:
+        attempt.status = "pending"
+        attempt.grading_attempts = 0
+        attempt.run_after = now
+    return bool(retried)
+
+
+def claim_pending_attempts(limit: int) -> list:
+    """
+    Claims up to `limit` pending attempts that are due, oldest first.
+    The conditional update makes sure two workers never claim the same attempt.
+    """
+    claimed = []
+    candidates = (
+        QuizAttempt.objects.filter(status="pending", run_after__lte=timezone.now())
+        .order_by("created_at")
+        .values_list("id", flat=True)
+    )
+    for attempt_id in candidates[:limit * 2]:
+        if QuizAttempt.objects.filter(id=attempt_id, status="pending").update(status="grading", updated_at=timezone.now()):
+            claimed.append(attempt_id)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def requeue_stale_attempts(stale_after: int) -> int:
+    """
+    Puts attempts claimed by a worker that died more than `stale_after` seconds ago back in the queue.
+    """
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    return QuizAttempt.objects.filter(status="grading", updated_at__lt=cutoff).update(status="pending")
+
+
+def finish_attempt_grading(attempt_id) -> QuizAttempt:
+    """
+    Grades the remaining answers of a claimed attempt and marks it graded.
+    Transient errors (the AI overloaded or busy) put the attempt back in the queue
+    with an exponential backoff, until MAX_ATTEMPTS is reached.
+    """
+    attempt = QuizAttempt.objects.select_related("quiz").get(id=attempt_id)
+    attempt.grading_attempts += 1
+    attempt.save(update_fields=["grading_attempts", "updated_at"])
+    ungraded = attempt.quiz.questions.exclude(id__in=[int(question_id) for question_id in attempt.results])
+
+    try:
+        _, results = grade_submission(ungraded, attempt.answers)
+    except Exception as e:
+        if is_transient_error(e) and attempt.grading_attempts < WORKER_SETTINGS.get("MAX_ATTEMPTS", 5):
+            backoff = WORKER_SETTINGS.get("RETRY_BACKOFF", 5) * 2 ** (attempt.grading_attempts - 1)
+            attempt.status = "pending"
+            attempt.run_after = timezone.now() + timedelta(seconds=backoff * random.uniform(0.8, 1.2))
+        else:
+            attempt.status = "failed"
+        attempt.save(update_fields=["status", "run_after", "updated_at"])
+        raise
+
+    attempt.results.update({str(question_id): correct for question_id, correct in results.items()})
+    attempt.score = sum(1 for correct in attempt.results.values() if correct)
+    attempt.status = "graded"
+    attempt.save(update_fields=["results", "score", "status", "updated_at"])
+    return attempt
@@ -0,0 +1,371 @@
+import os
+import re
+import json
+import time
+import asyncio
+import random
+import hashlib
+import threading
+from importlib import import_module
+from django.conf import settings
+from resilience import invoke_with_policy, stream_with_policy, ainvoke_with_policy, astream_with_policy
+
+
+class LLMResponse:
+    """Minimal stand-in for LangChain's AIMessage: the reply text in `.content`."""
+
+    def __init__(self, content: str):
+        self.content = content
+
+
+def message_role(message) -> str:
+    if isinstance(message, dict):
+        return message.get("role", "user")
+    return getattr(message, "type", "human")
+
+
+def message_text(message) -> str:
+    if isinstance(message, dict):
+        return message.get("content", "")
+    return getattr(message, "content", "")
+
+
+class BaseLLMBackend:
+    """
+    Interface every AI call in services.py goes through.
+    - messages: {"role", "content"} dicts (LangChain messages work too)
+    Responses only need a `.content` attribute.
+    """
+
+    def invoke(self, messages):
+        raise NotImplementedError
+
+    def stream(self, messages):
+        """Yields response chunks; backends without streaming return one chunk."""
+        yield self.invoke(messages)
+
+    async def ainvoke(self, messages):
+        """Async invoke; backends without an async client run invoke on a thread."""
+        return await asyncio.to_thread(self.invoke, messages)
+
+    async def astream(self, messages):
+        """Async stream; backends without an async client get one chunk from ainvoke."""
+        yield await self.ainvoke(messages)
+
+
+class GeminiBackend(BaseLLMBackend):
+    """Google Gemini through LangChain."""
+
+    def __init__(self, model="gemini-2.0-flash", temperature=0.7):
+        policy = getattr(settings, "LLM_CALL_POLICY", {})
+        # Imported here: LangChain and the Google client take seconds to import
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        self.client = ChatGoogleGenerativeAI(
+            model=model,
+            verbose=True,
+            temperature=temperature,
+            google_api_key=os.getenv("AI_API_KEY"),
+            streaming=True,
+            # Retries and deadlines are handled by resilience.py
+            timeout=policy.get("CALL_TIMEOUT", 45),
+            max_retries=1,
+        )
+
+    def invoke(self, messages):
+        return self.client.invoke(messages)
+
+    def stream(self, messages):
+        return self.client.stream(messages)
+
+    async def ainvoke(self, messages):
+        return await self.client.ainvoke(messages)
+
+    async def astream(self, messages):
+        async for chunk in self.client.astream(messages):
+            yield chunk
+
+
+class StubOverloadedError(ConnectionError):
+    """Artificial upstream failure raised by StubBackend (treated as transient)."""
+
+
+class StubBackend(BaseLLMBackend):
+    """
+    Deterministic offline backend for load tests and benchmarks.
+    Answers quiz prompts with quiz text in the layout parse_quiz_response expects,
+    grading prompts with verdicts and anything else with a short chat reply.
+    The same prompt always gets the same reply.
+    - latency: seconds added to every call (jitter adds up to that fraction on top)
+    - error_rate: share of calls that fail with StubOverloadedError
+    """
+
+    QUESTION_TYPES = ["SHORT", "TF", "MCQ", "FILL"]
+    STOPWORDS = {"about", "after", "also", "because", "been", "from", "have", "into", "make", "more", "much",
+                 "only", "other", "over", "some", "than", "that", "their", "them", "then", "there", "these",
+                 "they", "this", "very", "were", "what", "when", "which", "while", "with", "would", "your"}
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, chunk_size=40):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.random = random.Random()
+        self.lock = threading.Lock()
+
+    def invoke(self, messages):
+        self.wait_and_maybe_fail()
+        return LLMResponse(self.reply(messages))
+
+    def stream(self, messages):
+        text = self.reply(messages)
+        # A fifth of the latency before the first chunk, the rest spread over the chunks
+        delay = self.call_delay()
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        time.sleep(delay * 0.2)
+        self.maybe_fail()
+        for chunk in chunks:
+            time.sleep(delay * 0.8 / len(chunks))
+            yield LLMResponse(chunk)
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.call_delay())
+        self.maybe_fail()
+        return LLMResponse(self.reply(messages))
+
+    async def astream(self, messages):
+        text = self.reply(messages)
+        delay = self.call_delay()
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        await asyncio.sleep(delay * 0.2)
+        self.maybe_fail()
+        for chunk in chunks:
+            await asyncio.sleep(delay * 0.8 / len(chunks))
+            yield LLMResponse(chunk)
+
+    def call_delay(self) -> float:
+        with self.lock:
+            return self.latency * (1 + self.jitter * self.random.random())
+
+    def maybe_fail(self) -> None:
+        with self.lock:
+            failed = self.random.random() < self.error_rate
+        if failed:
+            raise StubOverloadedError("Stub backend: simulated upstream overload")
+
+    def wait_and_maybe_fail(self) -> None:
+        time.sleep(self.call_delay())
+        self.maybe_fail()
+
+    def reply(self, messages) -> str:
+        system = " ".join(message_text(m) for m in messages if message_role(m) == "system")
+        last = message_text(messages[-1]) if messages else ""
+        seeded = random.Random(hashlib.sha256(last.encode("utf-8")).hexdigest())
+
+        if "failed validation" in last:
+            return self.repair_reply(last, seeded)
+        if "Make a quiz based on" in last:
+            if "Reply with JSON only" in system:
+                return self.quiz_json_reply(last, seeded)
+            return self.quiz_reply(last, seeded)
+        if "grades quiz answers" in system:
+            return self.batch_grading_reply(last)
+        if "Is the user's answer correct?" in last:
+            return self.single_grading_reply(last)
+        if "running summary" in system:
+            lines = [line for line in last.splitlines() if line.startswith("user: ")]
+            return "The student asked about: " + "; ".join(line[6:60] for line in lines[-5:])
+        return f"Professor Hippo (stub) here! You asked: {last[:200]}"
+
+    def quiz_items(self, prompt: str, seeded: random.Random):
+        """
+        Builds the questions of a quiz prompt.
+        Returns (topic, difficulty, list of {"text", "type", "options", "answer", "difficulty"}).
+        """
+        def field(name, default):
+            match = re.search(rf"{name}:\s*(.+)", prompt)
+            return match.group(1).strip() if match else default
+
+        num_questions = int(field("Number of questions", "5") or 5)
+        difficulty = int(field("Difficulty level", "1") or 1)
+        question_type = field("Question type", "MIX").upper()
+        content = prompt.split("\n\n")[1] if prompt.count("\n\n") >= 2 else "General"
+
+        words = [w for w in re.findall(r"[A-Za-z]{4,}", content) if w.lower() not in self.STOPWORDS]
+        words = words or ["knowledge", "science", "history"]
+        keywords = sorted(set(words), key=lambda w: (-len(w), w))[:20]
+        topic = " ".join(content.split()[:5]) or "General"
+
+        types = {
+            "MCQ": ["MCQ"], "MULTIPLE_CHOICE": ["MCQ"],
+            "TF": ["TF"], "TRUE_FALSE": ["TF"],
+            "SHORT": ["SHORT"], "SHORT_ANSWER": ["SHORT"],
+            "FILL": ["FILL"], "FILL_IN_THE_BLANK": ["FILL"],
+        }.get(question_type, self.QUESTION_TYPES)
+
+        items = []
+        for index in range(1, num_questions + 1):
+            keyword = seeded.choice(keywords)
+            q_type = types[(index - 1) % len(types)]
+            item = {
+                "type": q_type,
+                "options": [],
+                "answer": keyword,
+                "difficulty": max(1, min(5, difficulty + seeded.choice([-1, 0, 0, 1]))),
+            }
+            if q_type == "TF":
+                item["text"] = f"True or False: {keyword.capitalize()} is a key idea of {topic}."
+                item["answer"] = seeded.choice(["True", "False"])
+            elif q_type == "MCQ":
+                options = seeded.sample(keywords, min(4, len(keywords)))
+                if keyword not in options:
+                    options[0] = keyword
+                seeded.shuffle(options)
+                item["text"] = f"Which term best matches the description of {keyword.lower()}?"
+                item["options"] = options
+            elif q_type == "FILL":
+                item["text"] = f"______ is closely related to {topic}."
+            else:
+                item["text"] = f"What is the meaning of {keyword} in the context of {topic}?"
+            items.append(item)
+        return topic, difficulty, items
+
+    def quiz_reply(self, prompt: str, seeded: random.Random) -> str:
+        topic, difficulty, items = self.quiz_items(prompt, seeded)
+        questions, answers, levels = [], [], []
+        for index, item in enumerate(items, start=1):
+            lines = [f"{index}. {item['text']}"]
+            lines += [f"{letter}) {option}" for letter, option in zip("abcd", item["options"])]
+            questions.append("\n".join(lines))
+            if item["options"]:
+                answers.append(f"{index}. {'abcd'[item['options'].index(item['answer'])]}) {item['answer']}")
+            else:
+                answers.append(f"{index}. {item['answer']}")
+            levels.append(f"{index}. Q{index} → Difficulty: {item['difficulty']}")
+
+        return (
+            f"Topic: {topic} (Difficulty {difficulty})\n"
+            f"Category: General\n\n"
+            f"Questions:\n" + "\n".join(questions) + "\n\n"
+            f"Answers:\n" + "\n".join(answers) + "\n\n"
+            f"Question Difficulty Levels:\n" + "\n".join(levels) + "\n"
+        )
+
+    def quiz_json_reply(self, prompt: str, seeded: random.Random) -> str:
+        topic, difficulty, items = self.quiz_items(prompt, seeded)
+        for item in items:
+            # Like real models, now and then answer an MCQ with an option that doesn't exist
+            if item["options"] and seeded.random() < 0.1:
+                item["answer"] = "e) none of the above"
+        quiz = {"topic": topic, "category": "General", "difficulty": difficulty, "questions": items}
+        return "```json\n" + json.dumps(quiz, indent=2) + "\n```"
+
+    def repair_reply(self, prompt: str, seeded: random.Random) -> str:
+        try:
+            invalid = json.loads(prompt[prompt.index("["):])
+        except ValueError:
+            return "[]"
+        fixed = []
+        for entry in invalid:
+            item = dict(entry.get("item") or {})
+            options = item.get("options") or []
+            if options:
+                item["answer"] = seeded.choice(options)
+            fixed.append(item)
+        return json.dumps(fixed)
+
+    def batch_grading_reply(self, prompt: str) -> str:
+        try:
+            items = json.loads(prompt)
+        except ValueError:
+            return "{}"
+        return json.dumps({
+            str(item.get("id")): self.same_answer(item.get("user_answer"), item.get("correct_answer"))
+            for item in items
+        })
+
+    def single_grading_reply(self, prompt: str) -> str:
+        given = re.search(r"User's answer:\s*(.*)", prompt)
+        expected = re.search(r"Correct answer:\s*(.*)", prompt)
+        correct = self.same_answer(given and given.group(1), expected and expected.group(1))
+        return "True" if correct else "False"
+
+    @staticmethod
+    def same_answer(given, expected) -> bool:
+        def clean(value):
+            return " ".join(re.findall(r"\w+", str(value or "").lower()))
+        return bool(clean(given)) and clean(given) in clean(expected)
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "stub": StubBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def build_backend() -> BaseLLMBackend:
+    """
+    Builds the backend named by settings.LLM_BACKEND ("gemini", "stub" or a dotted class path).
+    """
+    name = getattr(settings, "LLM_BACKEND", "gemini")
+    if name in BACKENDS:
+        backend_class = BACKENDS[name]
+    else:
+        module_path, class_name = name.rsplit(".", 1)
+        backend_class = getattr(import_module(module_path), class_name)
+
+    if backend_class is StubBackend:
+        stub_settings = getattr(settings, "LLM_STUB", {})
+        return StubBackend(
+            latency=stub_settings.get("LATENCY", 0.0),
+            jitter=stub_settings.get("JITTER", 0.0),
+            error_rate=stub_settings.get("ERROR_RATE", 0.0),
+            chunk_size=stub_settings.get("CHUNK_SIZE", 40),
+        )
+    return backend_class()
+
+
+class GovernedBackend(BaseLLMBackend):
+    """
+    Routes calls to the backend through the concurrency governor (see governor.py)
+    and the timeout / retry / hedging policy (see resilience.py).
+    Streams hold their slot until the last chunk has been read.
+    """
+
+    def __init__(self, backend, priority):
+        self.backend = backend
+        self.priority = priority
+
+    def invoke(self, messages):
+        return invoke_with_policy(self.backend.invoke, messages, self.priority)
+
+    def stream(self, messages):
+        return stream_with_policy(self.backend.stream, messages, self.priority)
+
+    async def ainvoke(self, messages):
+        return await ainvoke_with_policy(self.backend.ainvoke, messages, self.priority)
+
+    def astream(self, messages):
+        return astream_with_policy(self.backend.astream, messages, self.priority)
+
+
+def get_backend() -> BaseLLMBackend:
+    """
+    The process-wide backend, built on first use.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = build_backend()
+    return _backend
+
+
+def get_llm(priority="chat") -> BaseLLMBackend:
+    """
+    The backend, governed under a priority class of settings.LLM_GOVERNOR["PRIORITIES"].
+    """
+    return GovernedBackend(get_backend(), priority)
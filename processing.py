@@ -1,47 +1,525 @@
-import requests
-from bs4 import BeautifulSoup
-import PyPDF2
 import io
+import os
 import re
+import codecs
+import zipfile
+import json
+import time
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlsplit
+from django.conf import settings
+from fetching import (
+    TIMEOUT as FETCH_TIMEOUT,
+    MAX_PAGE_BYTES,
+    get_session,
+    get_cached_page,
+    is_fresh,
+    revalidation_headers,
+    store_cached_page,
+    count_cache,
+    normalize_url,
+)
+
+# Text read from a page at most: SOURCE_FACTOR times what condensation keeps (~4
+# characters per token), so it still picks the best chunks but long pages stop early
+CONDENSE_SETTINGS = getattr(settings, "CONTENT_CONDENSATION", {})
+MAX_SOURCE_CHARS = CONDENSE_SETTINGS.get("TOKEN_BUDGET", 3000) * 4 * CONDENSE_SETTINGS.get("SOURCE_FACTOR", 10)
+
+URL_ERROR_PREFIX = "Could not extract content from"
+DOCUMENT_ERROR_PREFIX = "Could not extract text from"
+PDF_ERROR_PREFIX = f"{DOCUMENT_ERROR_PREFIX} PDF"
+PDF_SETTINGS = getattr(settings, "PDF_EXTRACTION", {})
+PDF_MAX_CHARS = PDF_SETTINGS.get("MAX_CHARS", 300_000)
+PDF_TIME_LIMIT = PDF_SETTINGS.get("TIME_LIMIT", 20)
+PDF_PROCESSES = PDF_SETTINGS.get("PROCESSES") or min(4, os.cpu_count() or 1)
 
 def fetch_text_from_url(url: str) -> str:
     """
     Fetches and cleans text content from a webpage URL.
+    The text is cached on disk per normalized URL: within URL_FETCH["FRESH_FOR"]
+    seconds it is reused without a request, after that the page is revalidated
+    with its ETag/Last-Modified and only downloaded and parsed again if it changed.
     """
-    try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        soup = BeautifulSoup(resp.text, "html.parser")
+    entry = get_cached_page(url)
+    if entry is not None and is_fresh(entry):
+        count_cache("hits")
+        return entry["text"]
 
-        # remove unwanted tags
-        for tag in soup(["script", "style", "noscript", "header", "footer", "nav", "aside"]):
-            tag.extract()
+    try:
+        resp = get_session().get(url, timeout=FETCH_TIMEOUT, headers=revalidation_headers(entry), stream=True)
+        with resp:
+            if resp.status_code == 304 and entry is not None:
+                resp.content  # reads the empty body, so the connection goes back to the pool
+                count_cache("revalidated")
+                store_cached_page(url, entry["text"], entry=entry)
+                return entry["text"]
+            resp.raise_for_status()
+            count_cache("misses")
+            clean_text = read_page_text(resp)
+        store_cached_page(url, clean_text, resp)
+        return clean_text
+    except Exception as e:
+        if entry is not None:
+            # The site is down or erroring: a stale copy beats no quiz
+            count_cache("stale")
+            return entry["text"]
+        return f"{URL_ERROR_PREFIX} {url}: {e}"
 
-        # get visible text
-        text = soup.get_text(separator=" ", strip=True)
 
-        # collapse multiple spaces
-        clean_text = " ".join(text.split())
+async def afetch_text_from_url(client, url: str, host_slots=None) -> str:
+    """
+    Async fetch_text_from_url over an httpx.AsyncClient, with the same cache.
+    - host_slots: host -> asyncio.Semaphore, limits the requests in flight per host
+    """
+    entry = get_cached_page(url)
+    if entry is not None and is_fresh(entry):
+        count_cache("hits")
+        return entry["text"]
 
-        # limit to avoid sending huge data to AI
-        return clean_text[:5000]
+    try:
+        async with host_slots[urlsplit(normalize_url(url)).netloc] if host_slots is not None else nullcontext():
+            async with client.stream("GET", url, headers=revalidation_headers(entry)) as resp:
+                if resp.status_code == 304 and entry is not None:
+                    count_cache("revalidated")
+                    store_cached_page(url, entry["text"], entry=entry)
+                    return entry["text"]
+                resp.raise_for_status()
+                count_cache("misses")
+                reader = PageTextReader(resp.headers.get("Content-Type", ""))
+                async for chunk in resp.aiter_bytes(64 * 1024):
+                    if reader.feed(chunk):
+                        break
+                clean_text = reader.close()
+        store_cached_page(url, clean_text, resp)
+        return clean_text
     except Exception as e:
-        return f"Could not extract content from {url}: {e}"
+        if entry is not None:
+            count_cache("stale")
+            return entry["text"]
+        return f"{URL_ERROR_PREFIX} {url}: {e}"
+
+
+SKIPPED_TAGS = frozenset(["script", "style", "noscript", "header", "footer", "nav", "aside"])
+CHARSET_PATTERN = re.compile(r"charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+
+
+class HtmlTextTarget:
+    """
+    lxml parser target collecting the visible text of a page as it is parsed,
+    without building a tree. Text inside SKIPPED_TAGS is dropped; every tag
+    boundary separates words, like BeautifulSoup's get_text(" ").
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+        self.skipping = 0
+
+    def start(self, tag, attrib):
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+        self.parts.append(" ")
+
+    def end(self, tag):
+        if tag in SKIPPED_TAGS and self.skipping:
+            self.skipping -= 1
+        self.parts.append(" ")
+
+    def data(self, text):
+        if not self.skipping:
+            self.parts.append(text)
+            self.size += len(text)
+
+    def close(self):
+        return " ".join("".join(self.parts).split())
+
+
+class HtmlTextExtractor:
+    """
+    Incremental HTML to text: feed() the body as it arrives, close() for the text.
+    feed() returns True once `max_chars` of text are collected, so the caller can
+    stop reading the page.
+    """
+
+    def __init__(self, max_chars=MAX_SOURCE_CHARS, encoding=None):
+        from lxml import etree
+
+        self.max_chars = max_chars
+        self.target = HtmlTextTarget()
+        self.parser = etree.HTMLParser(target=self.target, encoding=encoding, recover=True, no_network=True)
+
+    def feed(self, data) -> bool:
+        self.parser.feed(data)
+        return self.target.size >= self.max_chars
+
+    def close(self) -> str:
+        return self.parser.close()[:self.max_chars]
+
+
+def html_to_text(html, max_chars=MAX_SOURCE_CHARS) -> str:
+    """
+    Visible text of an HTML page (str or bytes), without scripts, styles and page chrome.
+    """
+    extractor = HtmlTextExtractor(max_chars)
+    extractor.feed(html)
+    return extractor.close()
+
+
+class PageTextReader:
+    """
+    Text of a page body fed chunk by chunk: HTML through the streaming extractor,
+    text/plain decoded as is. feed() returns True once `max_bytes` of body or
+    `max_chars` of text are read.
+    """
+
+    def __init__(self, content_type, max_bytes=MAX_PAGE_BYTES, max_chars=MAX_SOURCE_CHARS):
+        charset = CHARSET_PATTERN.search(content_type)
+        self.encoding = charset.group(1) if charset else None
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.size = 0
+        self.plain = content_type.startswith("text/plain")
+        self.received = []
+        self.extractor = None if self.plain else HtmlTextExtractor(max_chars, encoding=self.encoding)
+
+    def feed(self, chunk) -> bool:
+        self.size += len(chunk)
+        if self.plain:
+            self.received.append(chunk)
+            return self.size >= self.max_bytes or self.size >= self.max_chars * 4
+        return self.extractor.feed(chunk) or self.size >= self.max_bytes
+
+    def close(self) -> str:
+        if self.plain:
+            text = b"".join(self.received).decode(self.encoding or "utf-8", errors="replace")
+            return " ".join(text.split())[:self.max_chars]
+        return self.extractor.close()
+
+
+def read_page_text(resp, max_bytes=MAX_PAGE_BYTES, max_chars=MAX_SOURCE_CHARS) -> str:
+    """
+    Extracts the text of a streamed response while it downloads.
+    Reading stops at `max_bytes` of body or once `max_chars` of text are collected.
+    """
+    reader = PageTextReader(resp.headers.get("Content-Type", ""), max_bytes, max_chars)
+    for chunk in resp.iter_content(chunk_size=64 * 1024):
+        if reader.feed(chunk):
+            break
+    return reader.close()
+
+
+PAGE_RANGE_PATTERN = re.compile(r"(\d*)\s*(?:(-)\s*(\d*))?")
+
+
+def parse_page_range(page_range: str, page_count: int) -> list:
+    """
+    0-based page numbers selected by a range like "1-5, 8, 12-" (1-based, inclusive,
+    open ends allowed). An empty range selects every page.
+    Raises ValueError for a malformed range or one outside the document.
+    """
+    if not page_range or not page_range.strip():
+        return list(range(page_count))
+
+    pages = []
+    for part in page_range.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        match = PAGE_RANGE_PATTERN.fullmatch(part)
+        if not match or not (match.group(1) or match.group(3)):
+            raise ValueError(f"Invalid page range: {part!r}")
+        start = int(match.group(1) or 1)
+        end = int(match.group(3) or page_count) if match.group(2) else start
+        if start < 1 or end < start:
+            raise ValueError(f"Invalid page range: {part!r}")
+        pages.extend(number - 1 for number in range(start, min(end, page_count) + 1))
+
+    pages = list(dict.fromkeys(pages))
+    if not pages:
+        raise ValueError(f"The page range selects no pages, the PDF has {page_count}.")
+    return pages
+
+
+def read_pdf_pages(path, page_numbers) -> list:
+    """
+    Text of some pages of a PDF file. Runs in the PDF process pool.
+    """
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(path)
+    return [reader.pages[number].extract_text() or "" for number in page_numbers]
+
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def get_pdf_pool():
+    """
+    Processes for extracting large PDFs, started on first use.
+    """
+    global _pdf_pool
+    if _pdf_pool is None:
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                # spawn: forking a threaded server process can deadlock the children
+                _pdf_pool = ProcessPoolExecutor(
+                    max_workers=PDF_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pdf_pool
+
+
+@contextmanager
+def local_pdf_path(file):
+    """
+    A filesystem path with the PDF's content, so pool processes can open it.
+    Uploads kept in memory are written to a temporary file for the duration.
+    """
+    if hasattr(file, "temporary_file_path"):
+        yield file.temporary_file_path()
+        return
+
+    file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as copy:
+        shutil.copyfileobj(file, copy)
+    try:
+        yield copy.name
+    finally:
+        os.unlink(copy.name)
+
+
+def extract_pages_in_pool(file, pages, max_chars, deadline) -> list:
+    """
+    Extracts pages in batches on the PDF process pool, keeping their order.
+    Only a few batches per process are in flight, so little work is wasted when
+    `max_chars` are collected early. At the deadline the text so far is returned.
+    """
+    batch = PDF_SETTINGS.get("PAGES_PER_TASK", 10)
+    batches = [pages[start:start + batch] for start in range(0, len(pages), batch)]
+    pool = get_pdf_pool()
+    texts = []
+    pending = deque()
+    with local_pdf_path(file) as path:
+        try:
+            size = 0
+            submitted = 0
+            while submitted < len(batches) or pending:
+                while submitted < len(batches) and len(pending) < PDF_PROCESSES * 2:
+                    pending.append(pool.submit(read_pdf_pages, path, batches[submitted]))
+                    submitted += 1
+                page_texts = pending.popleft().result(timeout=max(0.0, deadline - time.monotonic()))
+                texts.extend(page_texts)
+                size += sum(len(text) for text in page_texts)
+                if size >= max_chars:
+                    break
+        except FuturesTimeoutError:
+            print(f"PDF extraction stopped at its {PDF_TIME_LIMIT}s limit after {len(texts)} of {len(pages)} pages")
+        finally:
+            for future in pending:
+                future.cancel()
+    return texts
 
 
-def extract_text_from_pdf(file) -> str:
+def extract_text_from_pdf(file, page_range="", max_chars=None) -> str:
     """
     Extract text from an uploaded PDF file.
     `file` should be Django's InMemoryUploadedFile or TemporaryUploadedFile
+    Pages are read in order until `max_chars` of text (PDF_EXTRACTION["MAX_CHARS"])
+    are collected or TIME_LIMIT seconds have passed. With PARALLEL_MIN_PAGES or more
+    pages selected, pages are extracted in a process pool.
+    - page_range: the pages to read, like "1-5, 8" (1-based); every page when empty
+    Raises ValueError for an invalid page range.
     """
+    import PyPDF2
+
+    max_chars = max_chars or PDF_MAX_CHARS
+    deadline = time.monotonic() + PDF_TIME_LIMIT
     try:
         pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() or ""
-        return " ".join(text.split())[:5000]  # limit to 5000 chars
+        page_count = len(pdf_reader.pages)
+    except Exception as e:
+        return f"{PDF_ERROR_PREFIX}: {e}"
+    pages = parse_page_range(page_range, page_count)
+
+    try:
+        if PDF_PROCESSES > 1 and len(pages) >= PDF_SETTINGS.get("PARALLEL_MIN_PAGES", 40):
+            texts = extract_pages_in_pool(file, pages, max_chars, deadline)
+        else:
+            texts = []
+            size = 0
+            for number in pages:
+                page_text = pdf_reader.pages[number].extract_text() or ""
+                texts.append(page_text)
+                size += len(page_text)
+                if size >= max_chars:
+                    break
+                if time.monotonic() > deadline:
+                    print(f"PDF extraction stopped at its {PDF_TIME_LIMIT}s limit after {len(texts)} of {len(pages)} pages")
+                    break
+        return " ".join(" ".join(texts).split())[:max_chars]
     except Exception as e:
-        return f"Could not extract text from PDF: {e}"
+        return f"{PDF_ERROR_PREFIX}: {e}"
+
+DOCX_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MARKDOWN_SUFFIXES = (".md", ".markdown")
+MARKDOWN_PATTERNS = [
+    (re.compile(r"^\s{0,3}(?:#{1,6}\s+|>\s?|[-*+]\s+|\d+[.)]\s+|```.*|~~~.*|[-*_=]{3,}\s*$)"), ""),
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"\[([^\]]*)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"<[^>\n]+>"), " "),
+    (re.compile(r"\*{2,3}|_{2,3}|`+|~~|(?<!\w)\*(?=\S)|(?<=\S)\*(?!\w)"), ""),
+]
+
+
+class UnsupportedFileType(ValueError):
+    pass
+
+
+def sniff_content_type(file) -> str:
+    """
+    Content type of an upload from its first bytes, not its name or the browser's claim.
+    Files without a signature count as text when they decode as UTF-8; a .md or
+    .markdown name then makes them Markdown.
+    """
+    import filetype
+
+    file.seek(0)
+    head = file.read(8192)
+    file.seek(0)
+    kind = filetype.guess(head)
+    if kind is not None:
+        return kind.mime
+    if not head or b"\x00" in head:
+        return "application/octet-stream"
+    try:
+        # A multi-byte character may be cut at the end of the sample
+        codecs.getincrementaldecoder("utf-8-sig")().decode(head)
+    except UnicodeDecodeError:
+        return "application/octet-stream"
+    if str(getattr(file, "name", "")).lower().endswith(MARKDOWN_SUFFIXES):
+        return "text/markdown"
+    return "text/plain"
+
+
+def iter_text_lines(file):
+    """
+    Lines of a UTF-8 text upload, decoded chunk by chunk.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    rest = ""
+    file.seek(0)
+    for chunk in file.chunks() if hasattr(file, "chunks") else iter(lambda: file.read(64 * 1024), b""):
+        lines = (rest + decoder.decode(chunk)).split("\n")
+        rest = lines.pop()
+        yield from lines
+    yield rest + decoder.decode(b"", final=True)
+
+
+def collect_lines(lines, max_chars) -> str:
+    """
+    Joins lines into whitespace-collapsed text, stopping once `max_chars` are collected.
+    """
+    parts = []
+    size = 0
+    for line in lines:
+        line = " ".join(line.split())
+        if line:
+            parts.append(line)
+            size += len(line) + 1
+            if size >= max_chars:
+                break
+    return " ".join(parts)[:max_chars]
+
+
+def extract_text_from_txt(file, page_range="", max_chars=None) -> str:
+    """
+    Text of a plain text upload, read until `max_chars` are collected.
+    """
+    return collect_lines(iter_text_lines(file), max_chars or PDF_MAX_CHARS)
+
+
+def markdown_to_text(line: str) -> str:
+    for pattern, replacement in MARKDOWN_PATTERNS:
+        line = pattern.sub(replacement, line)
+    return line
+
+
+def extract_text_from_markdown(file, page_range="", max_chars=None) -> str:
+    """
+    Text of a Markdown upload without its markup: headings, list markers, emphasis,
+    code fences and link targets are dropped, link and image texts kept.
+    """
+    return collect_lines(map(markdown_to_text, iter_text_lines(file)), max_chars or PDF_MAX_CHARS)
+
+
+def iter_docx_paragraphs(file):
+    """
+    Paragraph texts of a DOCX file in document order (tables included), parsed from
+    word/document.xml as the zip member is decompressed.
+    """
+    from lxml import etree
+
+    file.seek(0)
+    with zipfile.ZipFile(file) as archive, archive.open("word/document.xml") as document:
+        for _, element in etree.iterparse(document, events=("end",), tag=f"{DOCX_NAMESPACE}p", huge_tree=True):
+            yield "".join(
+                node.text or "" if node.tag == f"{DOCX_NAMESPACE}t" else " "
+                for node in element.iter(f"{DOCX_NAMESPACE}t", f"{DOCX_NAMESPACE}tab", f"{DOCX_NAMESPACE}br")
+            )
+            # Free parsed paragraphs, only the current one is needed
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+def extract_text_from_docx(file, page_range="", max_chars=None) -> str:
+    """
+    Text of a Word (.docx) upload, read paragraph by paragraph until `max_chars` are collected.
+    """
+    try:
+        return collect_lines(iter_docx_paragraphs(file), max_chars or PDF_MAX_CHARS)
+    except Exception as e:
+        return f"{DOCUMENT_ERROR_PREFIX} DOCX: {e}"
+
+
+# Sniffed content type -> extractor(file, page_range, max_chars). Every extractor stops
+# once `max_chars` of text are collected; page_range only applies to PDFs.
+EXTRACTORS = {
+    "application/pdf": extract_text_from_pdf,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": extract_text_from_docx,
+    "text/plain": extract_text_from_txt,
+    "text/markdown": extract_text_from_markdown,
+}
+
+
+def get_extractor(file):
+    """
+    The extractor for an upload, from its sniffed content type.
+    Raises UnsupportedFileType for any other type, before the rest of the file is read.
+    """
+    content_type = sniff_content_type(file)
+    if content_type not in EXTRACTORS:
+        raise UnsupportedFileType(
+            f"Unsupported file type ({content_type}). Upload a PDF, Word (.docx), text or Markdown file."
+        )
+    return EXTRACTORS[content_type]
+
+
+def extract_text_from_upload(file, page_range="", max_chars=None) -> str:
+    """
+    Text of an uploaded document, with the extractor for its content type.
+    Raises UnsupportedFileType for types without an extractor.
+    """
+    return get_extractor(file)(file, page_range, max_chars)
+
 
 def incorrect_answer(quiz, attempt):
     total_questions = quiz.questions.count()
@@ -49,93 +527,344 @@ def incorrect_answer(quiz, attempt):
         return total_questions
     return total_questions - attempt.score
 
+TOPIC_PATTERN = re.compile(r"Topic:[ \t]*(.+?)[ \t]*\(Difficulty[ \t]*(\d+)\)", re.IGNORECASE)
+CATEGORY_PATTERN = re.compile(r"Category:[ \t]*(\S.*)", re.IGNORECASE)
+# section -> (marker of the next section, next section)
+NEXT_SECTION = {
+    "header": ("Questions:", "questions"),
+    "questions": ("Answers:", "answers"),
+    "answers": ("Question Difficulty Levels:", "difficulty"),
+}
+# Characters around a section marker that aren't part of either section ("**Answers:** ")
+MARKER_EMPHASIS = " \t*_"
+QUESTION_START = re.compile(r"^[ \t]*(?:\*\*)?(?:Q[ \t]*)?\d+\.(?!\d)(?:\*\*)?[ \t]*", re.IGNORECASE | re.MULTILINE)
+ANSWER_LINE = re.compile(r"^[ \t]*(?:\*\*)?(?:Q[ \t]*)?\d+[.):](?!\d)(?:\*\*)?[ \t]*(\S.*)$", re.IGNORECASE | re.MULTILINE)
+DIFFICULTY_PATTERNS = [
+    re.compile(r"Q\s*(\d+)\s*[^0-9]*\s*:?(\d+)"),
+    re.compile(r"(\d+)\.\s*Q\d+\s*→\s*Difficulty:\s*(\d+)"),
+    re.compile(r"Question\s*(\d+)\D+(\d+)", re.IGNORECASE),
+    re.compile(r"^\s*(\d+)[.)].*?(\d+)\D*$"),
+]
+# "a) ", "(a) ", "[a] ", "A. " after whitespace, optionally after an empty "[ ]" checkbox.
+# The label's letter is always the second to last character of the match.
+OPTION_LABEL = re.compile(r"[\s\]](?:\[\s?\]\s*)?(?:\([a-hA-H]\)|\[[a-hA-H]\]|[a-hA-H][.)])")
+# Matched against the lowercased question
+OPTION_HINTS = re.compile(r"a[.)\]]")
+TRUE_FALSE_PATTERN = re.compile(r"true\s*(?:or|/)\s*false|verdadero\s*(?:o|/)\s*falso|vrai\s*(?:ou|/)\s*faux|wahr\s*(?:oder|/)\s*falsch")
+BLANK_PATTERN = re.compile(r"\bblanks?\b")
+
+
+def split_options(text):
+    """
+    Splits MCQ options from a question block, whether they are on their own lines or
+    inline ("a) Iron b) Gold c) Salt"). Labels have to run a, b, c... for at least two
+    options; other letters followed by ")" or "." stay part of the text.
+    Returns (question text, options), with no options when there is no such run.
+    """
+    labels = [(m.start() + 1, m.end(), text[m.end() - 2].lower()) for m in OPTION_LABEL.finditer(text)]
+    for index, label in enumerate(labels):
+        if label[2] != "a":
+            continue
+        run = [label]
+        for later in labels[index + 1:]:
+            if ord(later[2]) == ord(run[-1][2]) + 1:
+                run.append(later)
+        if len(run) < 2:
+            continue
+
+        options = [text[current[1]:following[0]] for current, following in zip(run, run[1:])]
+        line_end = text.find("\n", run[-1][1])
+        line_end = len(text) if line_end == -1 else line_end
+        options.append(text[run[-1][1]:line_end])
+        rest = text[:run[0][0]] + "\n" + text[line_end:]
+        question_text = " ".join(line.strip() for line in rest.splitlines() if line.strip())
+        return question_text, [" ".join(option.split()) for option in options]
+    return text, []
+
+
+def classify_question(text):
+    """
+    Detects the type of one question block and splits MCQ options from the question.
+    Returns (question_type, question_text, mcq_options).
+    """
+    # Substring checks first: most blocks have no options and aren't true/false
+    lowered = text.lower()
+    question_text, mcq_options = split_options(text) if OPTION_HINTS.search(lowered) else (text, [])
+    if ("true" in lowered or "verdadero" in lowered or "vrai" in lowered or "wahr" in lowered) and (
+        TRUE_FALSE_PATTERN.search(lowered)
+    ):
+        return "TF", text, mcq_options
+    if mcq_options:
+        return "MCQ", question_text, mcq_options
+    if "___" in text or ("blank" in lowered and BLANK_PATTERN.search(lowered)):
+        return "FILL", text, mcq_options
+    return "SHORT", text, mcq_options
+
+
+def read_difficulty_line(line):
+    """
+    (question number, difficulty) of a "Question Difficulty Levels" line, or None.
+    """
+    for pattern in DIFFICULTY_PATTERNS:
+        m = pattern.search(line)
+        if m:
+            return int(m.group(1)), int(m.group(2))
+    return None
+
+
+def split_sections(text) -> dict:
+    """
+    Splits a quiz reply into its "header", "questions", "answers" and "difficulty" parts,
+    in one forward scan for the section markers. Text on the marker's line belongs to the
+    parts around it ("Questions: 1. What is H2O?"), Markdown emphasis around a marker is
+    dropped. Parts the reply doesn't reach are missing.
+    """
+    sections = {}
+    section = "header"
+    start = 0
+    while section in NEXT_SECTION:
+        marker, following = NEXT_SECTION[section]
+        found = text.find(marker, start)
+        if found == -1:
+            break
+        end = found
+        while end > start and text[end - 1] in MARKER_EMPHASIS:
+            end -= 1
+        sections[section] = text[start:end]
+        start = found + len(marker)
+        while start < len(text) and text[start] in MARKER_EMPHASIS:
+            start += 1
+        section = following
+    sections[section] = text[start:]
+    return sections
+
+
 def parse_quiz_response(response_text):
-    response_text = (response_text or "").strip()
+    """
+    Parses a quiz in the plain-text layout of services.system_message. The reply is
+    scanned once for its sections, then each section once with precompiled patterns.
+    Gives the same result as feeding the reply to QuizStreamParser.
+    Without an "Answers:" section there are no questions.
+    Returns {"topic", "difficulty", "category", "questions": [{"text", "raw_text", "type",
+    "answer", "difficulty", "mcq_options"}]}.
+    """
+    text = (response_text or "").strip()
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+    sections = split_sections(text)
 
-    topic_match = re.search(r"Topic:\s*(.+?)\s*\(Difficulty\s*(\d+)\)", response_text, re.IGNORECASE)
-    topic = topic_match.group(1).strip() if topic_match else "Untitled Quiz"
+    header = sections["header"]
+    topic_match = TOPIC_PATTERN.search(header)
+    category_match = CATEGORY_PATTERN.search(header)
     quiz_difficulty = int(topic_match.group(2)) if topic_match else 1
+    parsed = {
+        "topic": topic_match.group(1).strip(" *_") if topic_match else "Untitled Quiz",
+        "difficulty": quiz_difficulty,
+        "category": category_match.group(1).strip(" *_") if category_match else "General",
+        "questions": [],
+    }
+    if "answers" not in sections:
+        return parsed
 
-    questions_part = ""
-    answers_part = ""
-    difficulty_part = ""
-    if "Questions:" in response_text and "Answers:" in response_text:
-        try:
-            questions_part = response_text.split("Questions:")[1].split("Answers:")[0].strip()
-            answers_part = response_text.split("Answers:")[1]
-            if "Question Difficulty Levels:" in answers_part:
-                answers_part, difficulty_part = answers_part.split("Question Difficulty Levels:")
-                answers_part = answers_part.strip()
-                difficulty_part = difficulty_part.strip()
-            else:
-                answers_part = answers_part.strip()
-        except Exception:
-            questions_part = ""
-            answers_part = ""
-
-    question_blocks = re.split(r"\n\s*\d+\.\s*", questions_part)
-    if question_blocks and question_blocks[0].strip() == "":
-        question_blocks = question_blocks[1:]
-
-    answers = re.findall(r"\d+\.\s*(.+)", answers_part) if answers_part else []
-
-    if not answers and answers_part:
+    answers_part = sections["answers"]
+    answers = [answer.strip() for answer in ANSWER_LINE.findall(answers_part)]
+    if not answers:
         answers = [line.strip() for line in answers_part.splitlines() if line.strip()]
 
-    difficulties = {}
-    if difficulty_part:
-        for line in difficulty_part.splitlines():
-            m = re.search(r"Q\s*(\d+)\s*[^0-9]*\s*:?(\d+)", line) or re.search(r"(\d+)\.\s*Q\d+\s*→\s*Difficulty:\s*(\d+)", line)
-            if not m:
-                m = re.search(r"Q(\d+)\s*→\s*Difficulty:\s*(\d+)", line)
-            if m:
-                try:
-                    q_idx = int(m.group(1))
-                    q_diff = int(m.group(2))
-                    difficulties[q_idx] = q_diff
-                except Exception:
-                    pass
-
-    parsed_questions = []
-    for idx, q_text in enumerate(question_blocks, start=1):
-        text = q_text.strip()
-        if not text:
-            continue
+    difficulties = dict(filter(None, map(read_difficulty_line, sections.get("difficulty", "").splitlines())))
+
+    blocks = [block.strip() for block in QUESTION_START.split(sections["questions"])[1:]]
+    for index, block in enumerate(filter(None, blocks), start=1):
+        q_type, question_text, mcq_options = classify_question(block)
+        parsed["questions"].append({
+            "text": question_text,
+            "raw_text": block,
+            "type": q_type,
+            "answer": answers[index - 1] if index <= len(answers) else "",
+            "difficulty": difficulties.get(index, quiz_difficulty),
+            "mcq_options": mcq_options,
+        })
+    return parsed
 
-        mcq_option_pattern = r"(?:\([a-z]\)|[a-z]\))\s*([^\n\r]+)"
-        mcq_options = re.findall(mcq_option_pattern, text, flags=re.IGNORECASE)
+def extract_json(response_text):
+    """
+    Loads the JSON value in an AI reply, ignoring ```json fences and text around it.
+    Returns None when there is no valid JSON.
+    """
+    text = (response_text or "").strip()
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    for opener, closer in ("{}", "[]"):
+        start, end = text.find(opener), text.rfind(closer)
+        if start != -1 and end > start:
+            try:
+                return json.loads(text[start:end + 1])
+            except ValueError:
+                continue
+    return None
 
-        if re.search(r"True or False|True/False|True or false", text, re.IGNORECASE):
-            q_type = "TF"
-        elif mcq_options:
-            q_type = "MCQ"
-        elif re.search(r"_{3,}|____|blank", text, re.IGNORECASE):
-            q_type = "FILL"
-        else:
-            q_type = "SHORT"
 
-        if q_type == "MCQ":
-            parts = re.split(r"(?:\n|\r\n)", text)
-            non_option_lines = [p for p in parts if not re.match(r"^\s*(?:\([a-z]\)|[a-z]\))", p, re.IGNORECASE)]
-            question_text_clean = " ".join(non_option_lines).strip()
-        else:
-            question_text_clean = text
+def parse_quiz_items(items, default_difficulty=1):
+    """
+    Validates generated questions one by one against quiz_schema.QuizQuestion.
+    - returns: (questions in parse_quiz_response shape, invalid items with their errors)
+    """
+    from pydantic import ValidationError
+    from quiz_schema import QuizQuestion
 
-        answer_text = ""
-        if idx-1 < len(answers):
-            answer_text = answers[idx-1].strip()
-        parsed_questions.append({
-            "text": question_text_clean,
-            "raw_text": text,            
-            "type": q_type,
-            "answer": answer_text,
-            "difficulty": difficulties.get(idx, quiz_difficulty),
-            "mcq_options": mcq_options
-        })
+    questions, invalid = [], []
+    for item in items if isinstance(items, list) else []:
+        if isinstance(item, dict):
+            item = {"difficulty": default_difficulty, **item}
+        try:
+            questions.append(QuizQuestion.model_validate(item).as_parsed())
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'question'}: {err['msg']}" for err in e.errors())
+            invalid.append({"item": item, "errors": errors})
+    return questions, invalid
 
+
+def parse_quiz_json(response_text):
+    """
+    Parses a quiz generated in structured (JSON) mode.
+    - returns: (parsed quiz like parse_quiz_response, invalid items), or (None, [])
+      when the reply isn't a quiz document at all
+    """
+    from pydantic import ValidationError
+    from quiz_schema import QuizDocument
+
+    data = extract_json(response_text)
+    try:
+        document = QuizDocument.model_validate(data)
+    except ValidationError:
+        return None, []
+
+    questions, invalid = parse_quiz_items(document.questions, document.difficulty)
     return {
-        "topic": topic,
-        "difficulty": quiz_difficulty,
-        "category": re.search(r"Category:\s*(.+)", response_text, re.IGNORECASE).group(1).strip() if re.search(r"Category:\s*(.+)", response_text, re.IGNORECASE) else "General",
-        "questions": parsed_questions
-    }
\ No newline at end of file
+        "topic": document.topic,
+        "difficulty": document.difficulty,
+        "category": document.category,
+        "questions": questions,
+    }, invalid
+
+class QuizStreamParser:
+    """
+    Incremental version of parse_quiz_response for streamed AI output.
+    Feed it text chunks as they arrive; it returns events as soon as a part
+    of the quiz is complete:
+    - ("header", {"topic", "difficulty", "category"}) when the questions start
+    - ("question", {"index", "text", "raw_text", "type", "difficulty", "mcq_options"})
+      once the next question (or the answers) begins
+    - ("answer", {"index", "answer"}) for every answer line
+    - ("difficulty", {"index", "difficulty"}) for every difficulty line
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.section = "header"
+        self.topic = "Untitled Quiz"
+        self.difficulty = 1
+        self.category = "General"
+        self.topic_seen = False
+        self.category_seen = False
+        self.block = None
+        self.question_count = 0
+        self.answer_count = 0
+
+    def feed(self, chunk: str) -> list:
+        self.buffer += chunk or ""
+        if "\n" not in self.buffer:
+            return []
+        *lines, self.buffer = self.buffer.split("\n")
+        events = []
+        for line in lines:
+            events.extend(self.read_line(line.rstrip("\r")))
+        return events
+
+    def close(self) -> list:
+        events = []
+        if self.buffer:
+            events.extend(self.read_line(self.buffer))
+            self.buffer = ""
+        if self.section == "questions":
+            events.extend(self.finish_question())
+        return events
+
+    def read_line(self, line: str) -> list:
+        if self.section in NEXT_SECTION:
+            marker, following = NEXT_SECTION[self.section]
+            index = line.find(marker)
+            if index != -1:
+                # The text around the marker belongs to the sections on either side of it
+                before = line[:index].rstrip(MARKER_EMPHASIS)
+                after = line[index + len(marker):].lstrip(MARKER_EMPHASIS)
+                events = self.read_section_line(before) if before else []
+                events.extend(self.finish_section())
+                self.section = following
+                if after:
+                    events.extend(self.read_line(after))
+                return events
+        return self.read_section_line(line)
+
+    def read_section_line(self, line: str) -> list:
+        if self.section == "header":
+            return self.read_header(line)
+        if self.section == "questions":
+            match = QUESTION_START.match(line)
+            if match:
+                events = self.finish_question()
+                self.block = line[match.end():]
+                return events
+            if self.block is not None:
+                self.block += "\n" + line
+            return []
+        if self.section == "answers":
+            match = ANSWER_LINE.match(line)
+            if match:
+                self.answer_count += 1
+                return [("answer", {"index": self.answer_count, "answer": match.group(1).strip()})]
+            return []
+        return self.read_difficulty(line)
+
+    def finish_section(self) -> list:
+        if self.section == "header":
+            return [("header", {"topic": self.topic, "difficulty": self.difficulty, "category": self.category})]
+        if self.section == "questions":
+            return self.finish_question()
+        return []
+
+    def read_header(self, line: str) -> list:
+        topic_match = not self.topic_seen and TOPIC_PATTERN.search(line)
+        if topic_match:
+            self.topic_seen = True
+            self.topic = topic_match.group(1).strip(" *_")
+            self.difficulty = int(topic_match.group(2))
+        category_match = not self.category_seen and CATEGORY_PATTERN.search(line)
+        if category_match:
+            self.category = category_match.group(1).strip(" *_")
+            self.category_seen = True
+        return []
+
+    def read_difficulty(self, line: str) -> list:
+        difficulty = read_difficulty_line(line)
+        if difficulty is None:
+            return []
+        return [("difficulty", {"index": difficulty[0], "difficulty": difficulty[1]})]
+
+    def finish_question(self) -> list:
+        if self.block is None:
+            return []
+        text = self.block.strip()
+        self.block = None
+        if not text:
+            return []
+
+        self.question_count += 1
+        q_type, question_text_clean, mcq_options = classify_question(text)
+        return [("question", {
+            "index": self.question_count,
+            "text": question_text_clean,
+            "raw_text": text,
+            "type": q_type,
+            "difficulty": self.difficulty,
+            "mcq_options": mcq_options,
+        })]
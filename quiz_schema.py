@@ -0,0 +1,118 @@
+import re
+from typing import List, Literal
+from pydantic import BaseModel, Field, field_validator, model_validator
+from constants import TF_SYNONYMS
+
+TYPE_ALIASES = {
+    "MCQ": "MCQ", "MULTIPLE_CHOICE": "MCQ", "CHOICE": "MCQ",
+    "TF": "TF", "TRUE_FALSE": "TF", "TRUE/FALSE": "TF", "BOOLEAN": "TF",
+    "SHORT": "SHORT", "SHORT_ANSWER": "SHORT", "OPEN": "SHORT",
+    "FILL": "FILL", "FILL_IN_THE_BLANK": "FILL", "FILL_IN_THE_BLANKS": "FILL", "BLANK": "FILL",
+}
+OPTION_LABEL = re.compile(r"^\s*(?:\(?([a-fA-F])\)|([a-fA-F])[.:]|([a-fA-F])\s+-)\s*")
+ANSWER_LETTER = re.compile(r"^\s*\(?([a-fA-F])(?:\)|[.:])?\s*(.*)$")
+
+
+def clamp_difficulty(value) -> int:
+    try:
+        return max(1, min(5, int(value)))
+    except (TypeError, ValueError):
+        return 1
+
+
+class QuizQuestion(BaseModel):
+    """
+    One generated question. Small slips (option labels, letter answers, type
+    spellings, difficulty out of range) are repaired here; anything else is invalid.
+    """
+    text: str = Field(min_length=3)
+    type: Literal["MCQ", "TF", "SHORT", "FILL"]
+    options: List[str] = []
+    answer: str = Field(min_length=1)
+    difficulty: int = 1
+
+    @field_validator("text", "answer", mode="before")
+    @classmethod
+    def strip_text(cls, value):
+        return str(value).strip() if isinstance(value, (str, int, float, bool)) else value
+
+    @field_validator("type", mode="before")
+    @classmethod
+    def normalize_type(cls, value):
+        key = str(value or "").strip().upper().replace(" ", "_").replace("-", "_")
+        return TYPE_ALIASES.get(key, key)
+
+    @field_validator("options", mode="before")
+    @classmethod
+    def strip_option_labels(cls, value):
+        if not isinstance(value, list):
+            return value
+        options = [str(option).strip() for option in value]
+        # Only a full a, b, c... run is labels: "F. Scott Fitzgerald" and "C. S. Lewis" keep their initials
+        labels = [OPTION_LABEL.match(option) for option in options]
+        letters = [label and (label.group(1) or label.group(2) or label.group(3)).lower() for label in labels]
+        if letters == list("abcdef"[:len(options)]):
+            options = [option[label.end():].strip() for option, label in zip(options, labels)]
+        return [option for option in options if option]
+
+    @field_validator("difficulty", mode="before")
+    @classmethod
+    def clamp(cls, value):
+        return clamp_difficulty(value)
+
+    @model_validator(mode="after")
+    def check_answer(self):
+        if self.type == "MCQ":
+            folded = [option.casefold() for option in self.options]
+            if len(set(folded)) < 2:
+                raise ValueError("a multiple choice question needs at least 2 distinct options")
+            if self.answer.casefold() in folded:
+                self.answer = self.options[folded.index(self.answer.casefold())]
+                return self
+            letter = ANSWER_LETTER.match(self.answer)
+            if letter and letter.group(2):
+                # "b) Paris": the text decides, a wrong letter next to it is a slip
+                if letter.group(2).casefold() in folded:
+                    self.answer = self.options[folded.index(letter.group(2).casefold())]
+                    return self
+            elif letter:
+                index = "abcdef".index(letter.group(1).lower())
+                if index < len(self.options):
+                    self.answer = self.options[index]
+                    return self
+            raise ValueError(f"the answer {self.answer!r} is not one of the options")
+
+        self.options = []
+        if self.type == "TF":
+            words = re.findall(r"\w+", self.answer.lower())
+            if not words or TF_SYNONYMS.get(words[0]) is None:
+                raise ValueError(f"the answer {self.answer!r} is not True or False")
+        return self
+
+    def as_parsed(self) -> dict:
+        """The question in the shape parse_quiz_response produces."""
+        raw_text = "\n".join([self.text] + [f"{letter}) {option}" for letter, option in zip("abcdef", self.options)])
+        return {
+            "text": self.text,
+            "raw_text": raw_text,
+            "type": self.type,
+            "answer": self.answer,
+            "difficulty": self.difficulty,
+            "mcq_options": list(self.options),
+        }
+
+
+class QuizDocument(BaseModel):
+    """
+    The quiz envelope. Questions stay raw so each one is validated on its own and
+    a single bad item doesn't throw away the whole quiz.
+    """
+    topic: str = "Untitled Quiz"
+    category: str = "General"
+    difficulty: int = 1
+    questions: list = Field(min_length=1)
+
+    @field_validator("difficulty", mode="before")
+    @classmethod
+    def clamp(cls, value):
+        return clamp_difficulty(value)
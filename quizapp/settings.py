@@ -13,9 +13,13 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 from datetime import timedelta
+from dotenv import load_dotenv
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# The settings below read .env (LLM_BACKEND, GRADING_ASYNC, ...), so load it first
+load_dotenv(BASE_DIR / ".env")
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -55,6 +59,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'governor.LLMCallerMiddleware',
+    'resilience.RequestDeadlineMiddleware',
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -160,4 +166,184 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=14),     
     'ROTATE_REFRESH_TOKENS': False,                  
     'BLACKLIST_AFTER_ROTATION': True,
-}
\ No newline at end of file
+}
+# Grading verdict cache (AI verdicts keyed by question + normalized answer)
+GRADING_CACHE = {
+    'MAX_ENTRIES': 10000,        # in-memory LRU size per process
+    'TTL': 60 * 60 * 24,         # seconds a verdict stays valid
+    'PERSIST': True,             # also store verdicts in the GradingVerdict table
+}
+
+# Local fuzzy matching for SHORT and FILL answers, tried before the AI
+FUZZY_GRADING = {
+    'ACCEPT': 0.9,                      # similarity at or above this is correct
+    'REJECT': 0.25,                     # similarity below this is wrong (0 sends every mismatch to the AI)
+    'TOKEN_MATCH': 0.8,                 # two words count as the same word at this similarity
+    'ARTICLES': ['a', 'an', 'the'],     # words ignored when comparing answers
+}
+
+# Async grading: QuizSubmitView answers 202 right away and the
+# `manage.py grade_attempts` worker grades the AI-dependent questions
+GRADING_ASYNC = os.getenv("GRADING_ASYNC", "false").lower() in ["true", "1", "yes"]
+GRADING_WORKER = {
+    'CONCURRENCY': 4,       # attempts graded at the same time
+    'POLL_INTERVAL': 2,     # seconds between queue checks when idle
+    'STALE_AFTER': 600,     # seconds before an attempt claimed by a dead worker is requeued
+    'MAX_ATTEMPTS': 5,      # tries per attempt on transient errors (the AI overloaded or busy)
+    'RETRY_BACKOFF': 5,     # seconds before the first retry, doubled on each retry
+}
+
+# Generation cache: identical quiz requests reuse the stored AI output
+GENERATION_CACHE = {
+    'ENABLED': True,
+    'MAX_ENTRIES': 1000,            # least recently used entries are evicted above this
+    'TTL': 60 * 60 * 24 * 7,        # seconds an entry can be reused
+}
+
+# Background generation jobs: GenerateQuizAPI answers 202 with a job id and the
+# `manage.py generate_quizzes` worker fetches the content and calls the AI
+GENERATION_ASYNC = os.getenv("GENERATION_ASYNC", "false").lower() in ["true", "1", "yes"]
+GENERATION_WORKER = {
+    'CONCURRENCY': 2,       # jobs processed at the same time
+    'POLL_INTERVAL': 2,     # seconds between queue checks when idle
+    'STALE_AFTER': 900,     # seconds before a job claimed by a dead worker is requeued
+    'MAX_ATTEMPTS': 3,      # tries per job on transient errors
+    'RETRY_BACKOFF': 5,     # seconds before the first retry, doubled on each retry
+}
+
+# AI backend used for generation, grading and chat:
+# "gemini", "stub" (offline, deterministic, for load tests) or a dotted path to a BaseLLMBackend subclass
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_STUB = {
+    'LATENCY': float(os.getenv("LLM_STUB_LATENCY", "0")),         # seconds per call
+    'JITTER': float(os.getenv("LLM_STUB_JITTER", "0")),           # up to this fraction of LATENCY is added
+    'ERROR_RATE': float(os.getenv("LLM_STUB_ERROR_RATE", "0")),   # share of calls that fail
+    'CHUNK_SIZE': 40,                                             # characters per streamed chunk
+}
+
+# Professor Hippo chat: each user (or guest session) has its own stored conversation.
+# Only the newest turns that fit TOKEN_BUDGET are sent; older turns are folded into
+# a rolling summary once SUMMARIZE_BATCH tokens of them have piled up
+ASSISTANT_HISTORY = {
+    'TOKEN_BUDGET': 2000,       # estimated tokens of past turns sent with each question
+    'SUMMARIZE': True,          # False drops old turns instead of summarizing them
+    'SUMMARIZE_BATCH': 800,     # estimated tokens of overflow that trigger a summary call
+    'MAX_QUERY_CHARS': 4000,    # longer questions are rejected
+}
+
+# Web pages used as quiz sources are fetched over one pooled session and their
+# extracted text is cached on disk by normalized URL. Within FRESH_FOR seconds the
+# cached text is used as is; after that the page is revalidated with ETag/Last-Modified
+URL_FETCH = {
+    'TIMEOUT': 10,              # seconds per request
+    'MAX_BYTES': 5 * 1024 * 1024,   # page bytes read at most, the rest isn't downloaded
+    'POOL_CONNECTIONS': 10,     # hosts with kept-alive connections
+    'POOL_MAXSIZE': 20,         # kept-alive connections per host
+    'USER_AGENT': 'QuizBee/1.0 (+quiz generation)',
+    'CACHE': True,
+    'CACHE_ALIAS': 'url_text',  # entry of CACHES holding the extracted text
+    'FRESH_FOR': int(os.getenv("URL_CACHE_FRESH_FOR", "3600")),
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'url_text': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv("URL_CACHE_DIR", str(BASE_DIR / ".cache" / "url_text")),
+        'TIMEOUT': 7 * 24 * 3600,   # entries unused for a week are dropped
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+# Uploaded PDFs are read page by page until MAX_CHARS of text are collected or
+# TIME_LIMIT seconds have passed; large documents are extracted in a process pool
+PDF_EXTRACTION = {
+    'MAX_CHARS': 300_000,       # text read at most from any upload, condensation picks what the AI sees
+    'TIME_LIMIT': 20,           # seconds per document, the text read so far is used
+    'PARALLEL_MIN_PAGES': 40,   # selected pages from which the process pool is used
+    'PAGES_PER_TASK': 10,       # pages per pool task
+    'PROCESSES': None,          # pool size, None for min(4, CPU count); 1 disables the pool
+}
+
+# Condensed text of uploaded documents, stored under the SHA-256 of the file so the
+# same file uploaded again isn't parsed again
+DOCUMENT_STORE = {
+    'ENABLED': True,
+    'MAX_ENTRIES': 500,         # least recently used documents are evicted above this
+}
+
+# Several URLs and files for one quiz are read concurrently and merged into one context
+MULTI_SOURCE = {
+    'MAX_SOURCES': 8,           # URLs and files per request
+    'DEADLINE': 20,             # seconds for all sources, the ones not read by then are left out
+    'MAX_CONNECTIONS': 10,      # open connections per request
+    'PER_HOST': 2,              # requests in flight to the same host
+}
+
+# Long URL/PDF/text sources are split into chunks and only the most informative
+# ones (TF-IDF, spread over the whole document) are sent to the AI
+CONTENT_CONDENSATION = {
+    'ENABLED': True,
+    'TOKEN_BUDGET': 3000,           # estimated tokens of source content per prompt
+    'CHUNK_SIZE': 1200,             # characters per chunk
+    'CHUNK_OVERLAP': 100,           # characters shared by neighbouring chunks
+    'REDUNDANCY_PENALTY': 0.5,      # 0-1, how much already covered terms lower a chunk's score
+    'SOURCE_FACTOR': 10,            # page text read at most, as a multiple of the condensed size
+}
+
+# Guards every AI call of a process: at most MAX_CONCURRENCY run at once, the rest wait
+# in a priority queue (lowest rank first) of MAX_QUEUE calls for up to QUEUE_TIMEOUT
+# seconds before being refused with 503. Each user (or guest IP) also has a token bucket
+# of USER_BURST calls refilled at USER_RATE per second; an empty bucket answers 429
+LLM_GOVERNOR = {
+    'ENABLED': True,
+    'MAX_CONCURRENCY': 8,
+    'MAX_QUEUE': 100,
+    'QUEUE_TIMEOUT': 30,
+    'USER_RATE': 0.5,
+    'USER_BURST': 10,
+    'PRIORITIES': {
+        'grading': 0,       # answer checks of a submission the student is waiting on
+        'chat': 1,          # Professor Hippo
+        'generation': 2,    # new quizzes
+        'background': 3,    # anything run by the worker commands
+    },
+}
+
+# Timeouts and retries of every AI call. Inside a request all attempts share
+# REQUEST_BUDGET seconds; each attempt gets at most CALL_TIMEOUT. Retryable errors are
+# retried with jittered exponential backoff. With HEDGE on, an attempt slower than the
+# usual HEDGE_PERCENTILE latency gets a duplicate request and the first answer wins
+LLM_CALL_POLICY = {
+    'CALL_TIMEOUT': 45,         # seconds per attempt
+    'MAX_ATTEMPTS': 3,
+    'BACKOFF': 0.5,             # seconds, doubled on each retry (full jitter)
+    'MAX_BACKOFF': 8,
+    'MIN_ATTEMPT_TIME': 1,      # don't start an attempt with less time than this left
+    'REQUEST_BUDGET': 60,       # seconds of AI time per HTTP request
+    'POOL_SIZE': 32,            # threads running AI calls
+    'HEDGE': os.getenv("LLM_HEDGE", "false").lower() in ["true", "1", "yes"],
+    'HEDGE_PERCENTILE': 95,
+    'HEDGE_MIN_DELAY': 2,       # seconds, never hedge sooner than this
+    'HEDGE_MIN_SAMPLES': 20,    # successful calls needed before hedging starts
+}
+
+# Quiz generation asks the AI for JSON validated with pydantic (quiz_schema.py);
+# invalid questions are sent back once for repair. Replies that aren't JSON fall back
+# to the text format and its regex parser, which streaming generation always uses
+QUIZ_OUTPUT = {
+    'STRUCTURED': os.getenv("QUIZ_STRUCTURED_OUTPUT", "true").lower() in ["true", "1", "yes"],
+    'REPAIR': True,
+}
+
+# Quizzes longer than CHUNK_SIZE questions are generated as concurrent smaller
+# generations, then merged with near-duplicate questions replaced
+QUIZ_FANOUT = {
+    'ENABLED': True,
+    'CHUNK_SIZE': 10,               # questions per sub-generation
+    'MAX_PARALLEL': 5,              # sub-generations running at once per quiz
+    'DUPLICATE_THRESHOLD': 0.8,     # 0-1 text similarity above which questions with the same answer are duplicates
+    'MAX_REFILL_ROUNDS': 2,         # extra generations to replace dropped duplicates
+}
@@ -0,0 +1,314 @@
+# quizhippo/async_views.py
+"""
+Async versions of the AI-bound endpoints (generate, chat, chat stream, submit) for ASGI servers.
+While a request waits for the AI it holds no thread, so one process can keep
+hundreds of them in flight. DRF views are sync only, so these are plain Django
+async views: JWT authentication and the JSON/multipart bodies are handled here.
+"""
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from app.models import Quiz, Question, QuizAttempt
+from generation import (
+    resolve_content_source,
+    split_urls,
+    agenerate_parsed_quiz,
+    save_parsed_quiz,
+    queue_generation_job,
+)
+from chat import aget_api_conversation, aask_assistant, astream_assistant_reply, aprime_stream, achat_events
+from governor import LLMBusyError, LLMTimeoutError, llm_busy_response
+from grading import agrade_submission, queue_attempt_grading
+from .views import GENERATION_META, quiz_payload
+
+TRUE_VALUES = ["true", "1", "yes", "on"]
+
+
+def authenticate_jwt(request):
+    """
+    The user of the request's `Authorization: Bearer` token, AnonymousUser without one.
+    Raises AuthenticationFailed for an invalid or expired token.
+    """
+    result = JWTAuthentication().authenticate(request)
+    return result[0] if result else AnonymousUser()
+
+
+def has_jwt_header(request) -> bool:
+    return JWTAuthentication().get_header(request) is not None
+
+
+async def read_request(request):
+    """
+    Authenticates the request and reads its body (JSON, or form/multipart with files).
+    Returns (data, error response or None).
+    """
+    try:
+        # Guests skip the thread hop: checking a token needs the database
+        request.user = await sync_to_async(authenticate_jwt)(request) if has_jwt_header(request) else AnonymousUser()
+    except AuthenticationFailed as e:
+        detail = e.detail if isinstance(e.detail, dict) else {"detail": str(e.detail)}
+        return {}, JsonResponse(detail, status=401)
+
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return {}, JsonResponse({"detail": "JSON parse error."}, status=400)
+        return (data if isinstance(data, dict) else {}), None
+    return request.POST, None
+
+
+def login_required_response() -> JsonResponse:
+    return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+
+
+@csrf_exempt
+@require_POST
+async def generate_quiz(request):
+    """
+    Async GenerateQuizAPI: same parameters and response.
+    """
+    data, error = await read_request(request)
+    if error:
+        return error
+    if not request.user.is_authenticated:
+        return login_required_response()
+
+    try:
+        topic = data.get('topic', 'General')
+        language = data.get('language', 'English')
+        num_questions = int(data.get('quiz_count', 5))
+        difficulty = int(data.get('difficulty', 1))
+        question_preference = data.get('quiz_type', 'MIX').upper()
+        category = data.get('category', 'General')
+        prompt = data.get('input_prompt', '').strip()
+        url = data.get('input_url', '').strip()
+        text = data.get('input_text', '').strip()
+        urls = split_urls(data.getlist('input_urls') if hasattr(data, 'getlist') else data.get('input_urls'))
+        upload_files = request.FILES.getlist('input_pdf')
+        page_range = str(data.get('page_range', '')).strip()
+        use_cache = str(data.get('use_cache', 'true')).lower() not in ["false", "0", "no", "off"]
+
+        if str(data.get("async", settings.GENERATION_ASYNC)).lower() in TRUE_VALUES:
+            job = await sync_to_async(queue_generation_job)(
+                request.user,
+                {
+                    "topic": topic,
+                    "language": language,
+                    "num_questions": num_questions,
+                    "difficulty": difficulty,
+                    "question_preference": question_preference,
+                    "category": category,
+                    "prompt": prompt,
+                    "url": url,
+                    "urls": urls,
+                    "text": text,
+                    "page_range": page_range,
+                    "use_cache": use_cache,
+                },
+                upload_files=upload_files,
+            )
+            return JsonResponse(
+                {
+                    "status": "queued",
+                    "message": "Quiz generation started.",
+                    "job_id": job.id,
+                    "status_url": request.build_absolute_uri(f"/api/generate-quiz/jobs/{job.id}/"),
+                },
+                status=202,
+            )
+
+        # Fetching a URL or reading a PDF blocks: it runs on this request's sync thread
+        content_source = await sync_to_async(resolve_content_source)(
+            topic, prompt, url, text, page_range=page_range, urls=urls, upload_files=upload_files
+        )
+        parsed_quiz = await agenerate_parsed_quiz(
+            topic=topic,
+            language=language,
+            num_questions=num_questions,
+            difficulty=difficulty,
+            question_type=question_preference,
+            content=content_source,
+            use_cache=use_cache,
+        )
+        quiz = await sync_to_async(save_parsed_quiz)(
+            parsed_quiz,
+            user=request.user,
+            question_preference=question_preference,
+            topic=topic,
+            category=category,
+            difficulty=difficulty,
+        )
+        return JsonResponse(
+            {
+                "status": "success",
+                "message": "Quiz generated successfully.",
+                "quiz": await sync_to_async(quiz_payload)(quiz),
+                "missing_questions": parsed_quiz.get("missing_questions", 0),
+                "meta": GENERATION_META,
+            },
+            status=201,
+        )
+
+    except LLMBusyError as e:
+        return llm_busy_response(e)
+    except LLMTimeoutError:
+        raise  # RequestDeadlineMiddleware answers with 504
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
+
+
+@csrf_exempt
+@require_POST
+async def chat_assistant(request):
+    """
+    Async chat_assistant: same parameters and response.
+    """
+    data, error = await read_request(request)
+    if error:
+        return error
+
+    query = str(data.get('query', '')).strip()
+    if not query:
+        return JsonResponse({"error": "Query is required."}, status=400)
+
+    conversation, session_id = await aget_api_conversation(request.user, str(data.get('session_id', '')))
+    try:
+        response = await aask_assistant(conversation, query)
+        return JsonResponse({"response": response, "session_id": session_id} if session_id else {"response": response})
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except LLMBusyError as e:
+        return llm_busy_response(e)
+    except LLMTimeoutError:
+        raise  # RequestDeadlineMiddleware answers with 504
+    except Exception as e:
+        print(f"Error in async chat_assistant: {e}")
+        return JsonResponse({"error": "Something went wrong while processing your request."}, status=500)
+
+
+@csrf_exempt
+@require_POST
+async def chat_assistant_stream(request):
+    """
+    Async chat_assistant_stream: same parameters and events.
+    """
+    data, error = await read_request(request)
+    if error:
+        return error
+
+    query = str(data.get('query', '')).strip()
+    if not query:
+        return JsonResponse({"error": "Query is required."}, status=400)
+
+    conversation, session_id = await aget_api_conversation(request.user, str(data.get('session_id', '')))
+    try:
+        chunks = await aprime_stream(await astream_assistant_reply(conversation, query))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except LLMBusyError as e:
+        return llm_busy_response(e)
+    except LLMTimeoutError:
+        raise  # RequestDeadlineMiddleware answers with 504
+    except Exception as e:
+        print(f"Error in async chat_assistant_stream: {e}")
+        return JsonResponse({"error": "Something went wrong while processing your request."}, status=500)
+
+    async def event_stream():
+        try:
+            async for event, payload in achat_events(chunks):
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            print(f"Error in async chat_assistant_stream: {e}")
+            yield f"event: error\ndata: {json.dumps({'message': 'The reply was interrupted.'})}\n\n"
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    if session_id:
+        response["X-Session-Id"] = session_id
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def submit_quiz(request, quiz_id):
+    """
+    Async QuizSubmitView.post: same parameters and response.
+    """
+    data, error = await read_request(request)
+    if error:
+        return error
+    if not request.user.is_authenticated:
+        return login_required_response()
+
+    try:
+        quiz = await Quiz.objects.aget(id=quiz_id)
+    except Quiz.DoesNotExist:
+        return JsonResponse({"detail": "No Quiz matches the given query."}, status=404)
+
+    questions = [
+        question async for question in Question.objects.filter(quiz=quiz).prefetch_related("options")
+    ]
+    user_answers = data.get("answers", {})
+    if not isinstance(user_answers, dict):
+        user_answers = {}
+
+    is_retake = 'retake-quiz' in request.path
+    if is_retake:
+        attempt, created = await QuizAttempt.objects.aget_or_create(
+            user=request.user,
+            quiz=quiz,
+            defaults={'score': 0, 'answers': {}}
+        )
+    else:
+        attempt = await QuizAttempt.objects.acreate(user=request.user, quiz=quiz, score=0, answers={})
+        created = True
+
+    total_questions = len(questions)
+    async_mode = str(data.get("async", settings.GRADING_ASYNC)).lower() in TRUE_VALUES
+    queued = async_mode and await sync_to_async(queue_attempt_grading)(attempt, questions, user_answers)
+
+    if async_mode and not queued:
+        # Every answer was graded locally, queue_attempt_grading saved the attempt
+        marks = attempt.score
+    elif not queued:
+        try:
+            marks, results = await agrade_submission(questions, user_answers)
+        except LLMBusyError as e:
+            if not await sync_to_async(queue_attempt_grading)(attempt, questions, user_answers):
+                return llm_busy_response(e)
+            queued = True
+
+    if queued:
+        return JsonResponse({
+            "attempt_id": attempt.id,
+            "quiz_id": quiz.id,
+            "status": attempt.status,
+            "graded_questions": len(attempt.results),
+            "total_questions": total_questions,
+            "is_retake": is_retake,
+        }, status=202)
+
+    if not async_mode:
+        attempt.score = marks
+        attempt.answers = user_answers
+        attempt.results = {str(question_id): correct for question_id, correct in results.items()}
+        attempt.status = "graded"
+        await attempt.asave()
+
+    return JsonResponse({
+        "attempt_id": attempt.id,
+        "quiz_id": quiz.id,
+        "score": marks,
+        "total_questions": total_questions,
+        "correct_answers": marks,
+        "incorrect_answers": total_questions - marks,
+        "is_retake": is_retake,
+    }, status=201 if created else 200)
@@ -1,3 +1,442 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+import governor
+import resilience
+from app.models import Conversation, Option, Question, Quiz, QuizAttempt
+from llm import StubBackend
 
-# Create your tests here.
+MESSAGES = [{"role": "user", "content": "What is photosynthesis?"}]
+
+
+class ConcurrencyProbe:
+    """
+    Wraps a stub backend and records the most upstream calls running at once.
+    """
+
+    def __init__(self, latency):
+        self.backend = StubBackend(latency=latency)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def enter(self):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+    def leave(self):
+        with self.lock:
+            self.running -= 1
+
+    def invoke(self, messages):
+        self.enter()
+        try:
+            return self.backend.invoke(messages)
+        finally:
+            self.leave()
+
+    async def ainvoke(self, messages):
+        self.enter()
+        try:
+            return await self.backend.ainvoke(messages)
+        finally:
+            self.leave()
+
+
+class GovernorCapTests(SimpleTestCase):
+    """
+    Upstream calls that time out or are hedged must still count against MAX_CONCURRENCY.
+    """
+    CAP = 2
+    CALLERS = 4
+
+    def setUp(self):
+        self.governor = governor.Governor(max_concurrency=self.CAP, max_queue=50, queue_timeout=10)
+        for patcher in [
+            mock.patch("governor.governor", self.governor),
+            mock.patch("resilience.CALL_TIMEOUT", 0.05),
+            mock.patch("resilience.MAX_ATTEMPTS", 2),
+            mock.patch("resilience.backoff_delay", return_value=0),
+            # Hedge every attempt right away
+            mock.patch("resilience.hedge_delay", return_value=0.01),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def wait_for_slots(self):
+        for _ in range(100):
+            if not self.governor.stats()["active"]:
+                return
+            time.sleep(0.02)
+        self.fail("governor slots were not released")
+
+    def test_timed_out_and_hedged_calls_stay_under_the_cap(self):
+        probe = ConcurrencyProbe(latency=0.2)
+        errors = []
+
+        def call():
+            try:
+                resilience.invoke_with_policy(probe.invoke, MESSAGES, "chat")
+            except resilience.LLMTimeoutError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(self.CALLERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), self.CALLERS)
+        self.wait_for_slots()
+        self.assertLessEqual(probe.peak, self.CAP)
+
+    def test_async_timed_out_and_hedged_calls_stay_under_the_cap(self):
+        probe = ConcurrencyProbe(latency=0.2)
+
+        async def main():
+            return await asyncio.gather(
+                *(resilience.ainvoke_with_policy(probe.ainvoke, MESSAGES, "chat") for _ in range(self.CALLERS)),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(main())
+        self.assertTrue(all(isinstance(result, resilience.LLMTimeoutError) for result in results))
+        self.wait_for_slots()
+        self.assertLessEqual(probe.peak, self.CAP)
+
+    def test_hedge_runs_when_a_slot_is_free(self):
+        probe = ConcurrencyProbe(latency=0.1)
+        with mock.patch("resilience.CALL_TIMEOUT", 1):
+            resilience.invoke_with_policy(probe.invoke, MESSAGES, "chat")
+        self.wait_for_slots()
+        self.assertEqual(probe.peak, 2)
+
+
+class GovernorDeadlineTests(SimpleTestCase):
+    """
+    Waiting for a slot must not outlast the request's deadline.
+    """
+
+    def setUp(self):
+        self.governor = governor.Governor(max_concurrency=1, max_queue=10, queue_timeout=30)
+        self.governor.acquire(0)
+        self.addCleanup(self.governor.release)
+
+    def test_wait_is_capped_by_the_deadline(self):
+        started = time.monotonic()
+        with resilience.deadline(0.1):
+            with self.assertRaises(governor.LLMTimeoutError):
+                self.governor.acquire(0)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.governor.stats()["queue_depth"], 0)
+
+    def test_async_wait_is_capped_by_the_deadline(self):
+        async def wait():
+            with resilience.deadline(0.1):
+                await self.governor.aacquire(0)
+
+        started = time.monotonic()
+        with self.assertRaises(governor.LLMTimeoutError):
+            asyncio.run(wait())
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_without_a_deadline_the_queue_timeout_applies(self):
+        self.governor.queue_timeout = 0.05
+        with self.assertRaises(governor.LLMQueueFullError):
+            self.governor.acquire(0)
+
+
+class GuestChatSessionTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("llm._backend", StubBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ask(self, path="/api/chat/", **data):
+        response = self.client.post(path, {"query": "What is a cell?", **data}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_guest_continues_with_the_issued_session_id(self):
+        session_id = self.ask()["session_id"]
+        self.assertEqual(self.ask(session_id=session_id)["session_id"], session_id)
+        conversation = Conversation.objects.get(session_key=session_id)
+        self.assertEqual(conversation.messages.count(), 4)
+
+    def test_ids_the_server_did_not_issue_start_a_new_conversation(self):
+        victim = Conversation.objects.create(session_key="guest-42")
+        session_id = self.ask(session_id="guest-42")["session_id"]
+        self.assertNotEqual(session_id, "guest-42")
+        self.assertFalse(victim.messages.exists())
+
+    def test_async_endpoint_issues_session_ids_too(self):
+        first = self.ask("/api/async/chat/")["session_id"]
+        self.assertEqual(self.ask("/api/async/chat/", session_id=first)["session_id"], first)
+        self.assertNotEqual(self.ask("/api/async/chat/")["session_id"], first)
+
+
+class GenerateQuizStreamTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("llm._backend", StubBackend(chunk_size=20))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(User.objects.create_user("streamer", password="pw"))
+
+    def stream(self):
+        response = self.client.post(
+            "/api/generate-quiz/stream/",
+            {"topic": "Photosynthesis", "quiz_count": 3, "use_cache": "false"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_full_stream_saves_every_answer(self):
+        response = self.stream()
+        body = b"".join(response.streaming_content).decode()
+        self.assertIn("event: done", body)
+        quiz = Quiz.objects.get()
+        self.assertEqual(quiz.questions.count(), 3)
+        self.assertFalse(quiz.questions.filter(answer="").exists())
+
+    def test_disconnect_before_done_deletes_the_partial_quiz(self):
+        response = self.stream()
+        events = iter(response.streaming_content)
+        for _ in range(3):
+            next(events)
+        self.assertTrue(Question.objects.filter(answer="").exists())
+        response.close()
+        self.assertFalse(Quiz.objects.exists())
+        self.assertFalse(Question.objects.exists())
+
+
+class DeadlineResponseTests(TestCase):
+    """
+    A request that runs out of time gets RequestDeadlineMiddleware's 504, not a 400 or 500.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user("late", password="pw")
+        self.timeout = resilience.LLMTimeoutError("The request ran out of time for the AI call.")
+
+    def post(self, path, data, **extra):
+        return self.client.post(path, data, content_type="application/json", **extra)
+
+    def test_generate_quiz(self):
+        self.client.force_login(self.user)
+        with mock.patch("quizhippo.views.generate_parsed_quiz", side_effect=self.timeout):
+            response = self.post("/api/generate-quiz/", {"topic": "Cells"})
+        self.assertEqual(response.status_code, 504)
+
+    def test_async_generate_quiz(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        with mock.patch("quizhippo.async_views.agenerate_parsed_quiz", side_effect=self.timeout):
+            response = self.post("/api/async/generate-quiz/", {"topic": "Cells"}, HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(response.status_code, 504)
+
+    def test_chat(self):
+        with mock.patch("quizhippo.views.ask_assistant", side_effect=self.timeout):
+            self.assertEqual(self.post("/api/chat/", {"query": "Hi"}).status_code, 504)
+        with mock.patch("quizhippo.async_views.aask_assistant", side_effect=self.timeout):
+            self.assertEqual(self.post("/api/async/chat/", {"query": "Hi"}).status_code, 504)
+
+
+class ChatStreamTests(TestCase):
+    """
+    A streamed turn is stored once the reply is complete, and not at all when it is cut short.
+    """
+
+    def setUp(self):
+        self.backend = StubBackend(chunk_size=10)
+        patcher = mock.patch("llm._backend", self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, query="What is a cell?"):
+        response = self.client.post("/api/chat/stream/", {"query": query}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def events(self, body):
+        return [
+            (block.split("\n")[0].removeprefix("event: "), json.loads(block.split("\n")[1].removeprefix("data: ")))
+            for block in body.strip().split("\n\n")
+        ]
+
+    def test_complete_reply_is_stored(self):
+        response = self.stream()
+        events = self.events(b"".join(response.streaming_content).decode())
+        self.assertGreater(len(events), 2)
+        self.assertEqual(events[-1][0], "done")
+        reply = events[-1][1]["response"]
+        self.assertEqual("".join(data["text"] for event, data in events if event == "token"), reply)
+        conversation = Conversation.objects.get(session_key=response["X-Session-Id"])
+        self.assertEqual(
+            [(message.role, message.content) for message in conversation.messages.order_by("id")],
+            [("user", "What is a cell?"), ("assistant", reply)],
+        )
+
+    def test_client_gone_mid_reply_stores_nothing(self):
+        response = self.stream()
+        next(iter(response.streaming_content))
+        response.close()
+        conversation = Conversation.objects.get(session_key=response["X-Session-Id"])
+        self.assertFalse(conversation.messages.exists())
+
+    def test_failed_reply_stores_nothing(self):
+        real_stream = self.backend.stream
+
+        def broken_stream(messages):
+            chunks = real_stream(messages)
+            yield next(chunks)
+            raise ConnectionError("upstream closed the connection")
+
+        with mock.patch.object(self.backend, "stream", broken_stream):
+            response = self.stream()
+            events = self.events(b"".join(response.streaming_content).decode())
+        self.assertEqual(events[-1][0], "error")
+        self.assertFalse(Conversation.objects.get(session_key=response["X-Session-Id"]).messages.exists())
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("llm._backend", StubBackend(chunk_size=10))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user("async", password="pw")
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+
+    def quiz(self):
+        quiz = Quiz.objects.create(topic="Plants", user=self.user)
+        mcq = Question.objects.create(
+            quiz=quiz, text="Where does photosynthesis happen?", question_type="MCQ", answer="Chloroplast"
+        )
+        for text in ["Nucleus", "Chloroplast", "Ribosome"]:
+            Option.objects.create(question=mcq, text=text)
+        short = Question.objects.create(
+            quiz=quiz, text="What sugar do plants make?", question_type="SHORT", answer="glucose"
+        )
+        return quiz, {str(mcq.id): "b", str(short.id): "glucose sugar"}
+
+    def submit(self, quiz, answers, async_mode):
+        return self.client.post(
+            f"/api/async/quiz/{quiz.id}/submit/",
+            {"answers": answers, "async": async_mode},
+            content_type="application/json",
+            **self.auth,
+        )
+
+    def test_bad_token_is_rejected(self):
+        for path in ["/api/async/generate-quiz/", "/api/async/chat/"]:
+            with self.subTest(path=path):
+                response = self.client.post(
+                    path, {"topic": "Cells", "query": "Hi"}, content_type="application/json",
+                    HTTP_AUTHORIZATION="Bearer not-a-token",
+                )
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response.json()["code"], "token_not_valid")
+
+    def test_generate_quiz(self):
+        response = self.client.post(
+            "/api/async/generate-quiz/",
+            {"topic": "Plants", "quiz_count": 3, "input_text": "Plants use chlorophyll to capture sunlight and make glucose."},
+            content_type="application/json",
+            **self.auth,
+        )
+        self.assertEqual(response.status_code, 201)
+        quiz = Quiz.objects.get(id=response.json()["quiz"]["id"])
+        self.assertEqual(quiz.user, self.user)
+        self.assertEqual(quiz.questions.count(), 3)
+        self.assertEqual(len(response.json()["quiz"]["questions"]), 3)
+
+    def test_generate_quiz_needs_a_login(self):
+        response = self.client.post("/api/async/generate-quiz/", {"topic": "Cells"}, content_type="application/json")
+        self.assertEqual(response.status_code, 401)
+
+    async def test_chat_stream_stores_the_complete_turn(self):
+        response = await self.async_client.post(
+            "/api/async/chat/stream/", {"query": "What is a cell?"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        body = "".join([chunk.decode() async for chunk in response.streaming_content])
+        self.assertIn("event: token", body)
+        done = json.loads(body.strip().split("\n\n")[-1].split("data: ", 1)[1])
+        conversation = await Conversation.objects.aget(session_key=response["X-Session-Id"])
+        stored = [message.content async for message in conversation.messages.order_by("id")]
+        self.assertEqual(stored, ["What is a cell?", done["response"]])
+
+    def test_submit_in_sync_grading_mode(self):
+        quiz, answers = self.quiz()
+        grade_all = lambda pending: {item["id"]: True for item in pending}
+        with mock.patch("grading.agrade_with_ai", side_effect=grade_all) as ai:
+            response = self.submit(quiz, answers, async_mode=False)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()["score"], response.json()["total_questions"]), (2, 2))
+        self.assertEqual(ai.call_count, 1)
+        self.assertEqual(QuizAttempt.objects.get().status, "graded")
+
+    def test_submit_in_async_grading_mode(self):
+        quiz, answers = self.quiz()
+        response = self.submit(quiz, answers, async_mode=True)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.json()["status"], response.json()["graded_questions"]), ("pending", 1))
+        attempt = QuizAttempt.objects.get()
+        self.assertEqual((attempt.status, attempt.score), ("pending", 1))
+
+
+class AttemptResultTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("student", password="pw")
+        self.client.force_login(self.user)
+        self.quiz = Quiz.objects.create(topic="Plants", user=self.user)
+        self.tf = Question.objects.create(quiz=self.quiz, text="Plants need light.", question_type="TF", answer="True")
+        self.short = Question.objects.create(
+            quiz=self.quiz, text="What sugar do plants make?", question_type="SHORT", answer="glucose"
+        )
+
+    def failed_attempt(self):
+        return QuizAttempt.objects.create(
+            user=self.user, quiz=self.quiz, status="failed", score=0, grading_attempts=5,
+            answers={str(self.tf.id): "False", str(self.short.id): "glucose sugar"},
+            results={str(self.tf.id): False},
+        )
+
+    def test_failed_attempt_shows_partial_results_and_an_error(self):
+        self.failed_attempt()
+        data = self.client.get(f"/api/quiz/{self.quiz.id}/result/").json()
+        self.assertEqual(data["attempt"]["status"], "failed")
+        self.assertEqual((data["attempt"]["graded_questions"], data["attempt"]["incorrect_count"]), (1, 1))
+        self.assertEqual([q["id"] for q in data["incorrect_questions"]], [self.tf.id])
+        self.assertIn("could not be graded", data["error"])
+
+    def test_failed_attempt_can_be_graded_again(self):
+        attempt = self.failed_attempt()
+        response = self.client.post(f"/api/quiz/{self.quiz.id}/result/")
+        self.assertEqual(response.status_code, 202)
+        attempt.refresh_from_db()
+        self.assertEqual((attempt.status, attempt.grading_attempts), ("pending", 0))
+        self.assertEqual(self.client.post(f"/api/quiz/{self.quiz.id}/result/").status_code, 409)
+
+    def test_locally_graded_submission_is_not_graded_twice(self):
+        answers = {str(self.tf.id): "True", str(self.short.id): "glucose"}
+        token = RefreshToken.for_user(self.user).access_token
+        for path, grader, extra in [
+            (f"/api/quiz/{self.quiz.id}/submit/", "quizhippo.views.grade_submission", {}),
+            (f"/api/async/quiz/{self.quiz.id}/submit/", "quizhippo.async_views.agrade_submission",
+             {"HTTP_AUTHORIZATION": f"Bearer {token}"}),
+        ]:
+            with self.subTest(path=path), mock.patch(grader) as grade:
+                response = self.client.post(
+                    path, {"answers": answers, "async": True}, content_type="application/json", **extra
+                )
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual((response.json()["score"], response.json()["incorrect_answers"]), (2, 0))
+                grade.assert_not_called()
+                attempt = QuizAttempt.objects.get(id=response.json()["attempt_id"])
+                self.assertEqual((attempt.status, attempt.score), ("graded", 2))
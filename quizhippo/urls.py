@@ -1,8 +1,9 @@
 from django.urls import path
 from .views import (
     LoginView, RegisterView, 
-    LogoutView, GenerateQuizAPI, 
-    chat_assistant, UpdatePreferencesAPIView, 
+    LogoutView, GenerateQuizAPI, GenerateQuizStreamAPI,
+    GenerationJobAPIView,
+    chat_assistant, chat_assistant_stream, UpdatePreferencesAPIView, 
     AllQuizzesAPIView, CheckQuizAttempt,
     DeleteAccount, QuizVisibilityAPI,
     ChangePassword, DeleteQuiz,
@@ -13,15 +14,19 @@ from .views import (
     ServerDetailAPIView, AddQuizToServerAPIView,
     ServerListAPIView, DeleteServerAPIView,
     QuizDetailAPIView, ResultView,
-    QuizSubmitView
+    QuizSubmitView, MetricsAPIView
     )
+from . import async_views
 
 urlpatterns = [
     path("login-view/", LoginView.as_view(), name="login-view"),
     path("register/", RegisterView.as_view(), name="register"),
     path("logout-view/", LogoutView.as_view(), name="logout-view"),
     path('generate-quiz/', GenerateQuizAPI.as_view(), name='generate-quiz'),
+    path('generate-quiz/stream/', GenerateQuizStreamAPI.as_view(), name='generate-quiz-stream'),
+    path('generate-quiz/jobs/<int:job_id>/', GenerationJobAPIView.as_view(), name='generation-job'),
     path('chat/', chat_assistant, name='chat-assistant'),
+    path('chat/stream/', chat_assistant_stream, name='chat-assistant-stream'),
     path("preferences/update/", UpdatePreferencesAPIView.as_view(), name="update-preferences"),
     path('all-quizzes/', AllQuizzesAPIView.as_view(), name='all-quizzes'),
     path("delete-account/", DeleteAccount.as_view(), name="delete-account"),
@@ -46,4 +51,11 @@ urlpatterns = [
     path("quiz/<int:quiz_id>/result/", ResultView.as_view(), name="quiz_result"),
     path('quiz/<int:quiz_id>/submit/', QuizSubmitView.as_view(), name='quiz_submit'),
     path('retake-quiz/<int:quiz_id>/submit/', QuizSubmitView.as_view(), name='retake_quiz_submit'),
+    path('metrics/', MetricsAPIView.as_view(), name='metrics'),
+    # Async versions of the AI-bound endpoints, for ASGI deployments
+    path('async/generate-quiz/', async_views.generate_quiz, name='async-generate-quiz'),
+    path('async/chat/', async_views.chat_assistant, name='async-chat-assistant'),
+    path('async/chat/stream/', async_views.chat_assistant_stream, name='async-chat-assistant-stream'),
+    path('async/quiz/<int:quiz_id>/submit/', async_views.submit_quiz, name='async-quiz-submit'),
+    path('async/retake-quiz/<int:quiz_id>/submit/', async_views.submit_quiz, name='async-retake-quiz-submit'),
 ]
@@ -14,21 +14,28 @@ from app.models import (
     Quiz, Question, 
     Option, UserProfile, 
     QuizAttempt, ServerQuiz, 
-    Server, QuizRating
+    Server, QuizRating, GenerationJob
 )
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.decorators import api_view
-from processing import (
-    fetch_text_from_url,
-    extract_text_from_pdf,
-    parse_quiz_response,
-)
-from services import (
-    generate__quiz, 
-    assistant,
-    check_multiple_choice,
-    check_short_answer,
+from django.conf import settings
+import json
+from django.http import StreamingHttpResponse
+from generation import (
+    resolve_content_source,
+    split_urls,
+    generate_parsed_quiz,
+    save_parsed_quiz,
+    stream_quiz_generation,
+    generation_cache_stats,
+    document_store_stats,
+    queue_generation_job,
 )
+from chat import get_api_conversation, ask_assistant, stream_assistant_reply, prime_stream, chat_events
+from governor import LLMBusyError, LLMTimeoutError, llm_busy_response, llm_context, caller_key, governor_stats
+from resilience import attempts as llm_attempts
+from fetching import url_cache_stats
+from grading import grade_submission, queue_attempt_grading, retry_failed_attempt, verdict_cache
 from constants import (
     LANGUAGES,
     DEFAULT_LANGUAGE,
@@ -128,6 +135,42 @@ class LogoutView(APIView):
         except Exception:
             return Response({"error": "Invalid token"}, status=status.HTTP_400_BAD_REQUEST)
 
+GENERATION_META = {
+    "languages": LANGUAGES,
+    "default_language": DEFAULT_LANGUAGE,
+    "levels": DIFFICULTY_LEVELS,
+    "default_level": DEFAULT_DIFFICULTY,
+    "question_types": QUESTION_TYPES,
+    "default_type": DEFAULT_QUESTION_TYPE,
+    "choose_options": CHOOSE_OPTIONS,
+    "default_choose": DEFAULT_CHOOSE,
+}
+
+
+def quiz_payload(quiz) -> dict:
+    """
+    A generated quiz with its questions and options, as the generate endpoints return it.
+    """
+    return {
+        "id": quiz.id,
+        "topic": quiz.topic,
+        "difficulty": quiz.difficulty,
+        "category": quiz.category,
+        "question_preference": quiz.question_preference,
+        "questions": [
+            {
+                "id": q.id,
+                "text": q.text,
+                "type": q.question_type,
+                "difficulty": q.difficulty,
+                "answer": q.answer,
+                "options": [o.text for o in q.options.all()],
+            }
+            for q in quiz.questions.prefetch_related("options")
+        ],
+    }
+
+
 class GenerateQuizAPI(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     parser_classes = [parsers.MultiPartParser, parsers.FormParser, parsers.JSONParser]
@@ -144,104 +187,186 @@ class GenerateQuizAPI(APIView):
             prompt = request.data.get('input_prompt', '').strip()
             url = request.data.get('input_url', '').strip()
             text = request.data.get('input_text', '').strip()
-            upload_file = request.FILES.get('input_pdf')
+            urls = split_urls(request.data.getlist('input_urls') if hasattr(request.data, 'getlist') else request.data.get('input_urls'))
+            upload_files = request.FILES.getlist('input_pdf')
+            page_range = str(request.data.get('page_range', '')).strip()
+            use_cache = str(request.data.get('use_cache', 'true')).lower() not in ["false", "0", "no", "off"]
+
+            # Async mode: queue a job for the generate_quizzes worker and answer right away
+            async_mode = str(request.data.get("async", settings.GENERATION_ASYNC)).lower() in ["true", "1", "yes", "on"]
+            if async_mode:
+                job = queue_generation_job(
+                    request.user if request.user.is_authenticated else None,
+                    {
+                        "topic": topic,
+                        "language": language,
+                        "num_questions": num_questions,
+                        "difficulty": difficulty,
+                        "question_preference": question_preference,
+                        "category": category,
+                        "prompt": prompt,
+                        "url": url,
+                        "urls": urls,
+                        "text": text,
+                        "page_range": page_range,
+                        "use_cache": use_cache,
+                    },
+                    upload_files=upload_files,
+                )
+                return Response(
+                    {
+                        "status": "queued",
+                        "message": "Quiz generation started.",
+                        "job_id": job.id,
+                        "status_url": request.build_absolute_uri(f"/api/generate-quiz/jobs/{job.id}/"),
+                    },
+                    status=status.HTTP_202_ACCEPTED,
+                )
 
             # Determine content source
-            if prompt:
-                content_source = prompt
-            elif url:
-                content_source = fetch_text_from_url(url)
-            elif text:
-                content_source = text
-            elif upload_file and upload_file.name.endswith(".pdf"):
-                content_source = extract_text_from_pdf(upload_file)
-            else:
-                content_source = topic
+            content_source = resolve_content_source(
+                topic, prompt, url, text, page_range=page_range, urls=urls, upload_files=upload_files
+            )
 
-            # Generate quiz content (AI or custom logic)
-            raw_quiz = generate__quiz(
+            # Generate quiz content (AI, or the cached output of an identical request)
+            parsed_quiz = generate_parsed_quiz(
                 topic=topic,
                 language=language,
                 num_questions=num_questions,
                 difficulty=difficulty,
                 question_type=question_preference,
                 content=content_source,
+                use_cache=use_cache,
             )
 
-            parsed_quiz = parse_quiz_response(raw_quiz)
-
-            # Create Quiz instance
-            quiz = Quiz.objects.create(
-                topic=parsed_quiz.get("topic", topic),
-                difficulty=int(parsed_quiz.get("difficulty", difficulty)),
-                category=parsed_quiz.get("category", category),
-                question_preference=question_preference,
+            # Create Quiz + Questions + Options
+            quiz = save_parsed_quiz(
+                parsed_quiz,
                 user=request.user if request.user.is_authenticated else None,
+                question_preference=question_preference,
+                topic=topic,
+                category=category,
+                difficulty=difficulty,
             )
 
-            # Create Questions + Options
-            for q in parsed_quiz.get("questions", []):
-                question = Question.objects.create(
-                    quiz=quiz,
-                    text=q["text"],
-                    question_type=q["type"].upper(),
-                    difficulty=int(q.get("difficulty", difficulty)),
-                    answer=q["answer"]
-                )
-
-                if q["type"].upper() == "MCQ" and q.get("mcq_options"):
-                    for opt in q["mcq_options"]:
-                        Option.objects.create(question=question, text=opt.strip())
-
-            # ✅ Use correct related_name ("questions" and "options")
-            quiz_data = {
-                "id": quiz.id,
-                "topic": quiz.topic,
-                "difficulty": quiz.difficulty,
-                "category": quiz.category,
-                "question_preference": quiz.question_preference,
-                "questions": [
-                    {
-                        "id": q.id,
-                        "text": q.text,
-                        "type": q.question_type,
-                        "difficulty": q.difficulty,
-                        "answer": q.answer,
-                        "options": [o.text for o in q.options.all()],
-                    }
-                    for q in quiz.questions.all()
-                ],
-            }
-
             # Build response
             response_data = {
                 "status": "success",
                 "message": "Quiz generated successfully.",
-                "quiz": quiz_data,
-                "meta": {
-                    "languages": LANGUAGES,
-                    "default_language": DEFAULT_LANGUAGE,
-                    "levels": DIFFICULTY_LEVELS,
-                    "default_level": DEFAULT_DIFFICULTY,
-                    "question_types": QUESTION_TYPES,
-                    "default_type": DEFAULT_QUESTION_TYPE,
-                    "choose_options": CHOOSE_OPTIONS,
-                    "default_choose": DEFAULT_CHOOSE,
-                },
+                "quiz": quiz_payload(quiz),
+                # Questions a large quiz still lacks after replacing duplicates
+                "missing_questions": parsed_quiz.get("missing_questions", 0),
+                "meta": GENERATION_META,
             }
 
             return Response(response_data, status=status.HTTP_201_CREATED)
 
+        except LLMBusyError as e:
+            return llm_busy_response(e)
+        except LLMTimeoutError:
+            raise  # RequestDeadlineMiddleware answers with 504
+        except Exception as e:
+            return Response(
+                {"status": "error", "message": str(e)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+class GenerationJobAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id):
+        """
+        Status, stage and progress of a background generation job.
+        """
+        job = get_object_or_404(GenerationJob, id=job_id, user=request.user)
+        return Response(
+            {
+                "id": job.id,
+                "status": job.status,
+                "stage": job.stage,
+                "progress": job.progress,
+                "attempts": job.attempts,
+                "error": job.error,
+                "quiz_id": job.quiz_id,
+                "requested_questions": job.params.get("num_questions", 5),
+                "question_count": job.quiz.questions.count() if job.quiz else 0,
+                "created_at": job.created_at,
+                "updated_at": job.updated_at,
+            },
+            status=status.HTTP_200_OK
+        )
+
+class GenerateQuizStreamAPI(APIView):
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    parser_classes = [parsers.MultiPartParser, parsers.FormParser, parsers.JSONParser]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Generates a quiz as Server-Sent Events: a "quiz" event, then one "question"
+        event per question as soon as the AI has written it, "answer" events and a
+        final "done" event with the quiz id.
+        """
+        try:
+            topic = request.data.get('topic', 'General')
+            language = request.data.get('language', 'English')
+            num_questions = int(request.data.get('quiz_count', 5))
+            difficulty = int(request.data.get('difficulty', 1))
+            question_preference = request.data.get('quiz_type', 'MIX').upper()
+            category = request.data.get('category', 'General')
+            prompt = request.data.get('input_prompt', '').strip()
+            url = request.data.get('input_url', '').strip()
+            text = request.data.get('input_text', '').strip()
+            urls = split_urls(request.data.getlist('input_urls') if hasattr(request.data, 'getlist') else request.data.get('input_urls'))
+            upload_files = request.FILES.getlist('input_pdf')
+            page_range = str(request.data.get('page_range', '')).strip()
+            use_cache = str(request.data.get('use_cache', 'true')).lower() not in ["false", "0", "no", "off"]
+
+            content_source = resolve_content_source(
+                topic, prompt, url, text, page_range=page_range, urls=urls, upload_files=upload_files
+            )
         except Exception as e:
             return Response(
                 {"status": "error", "message": str(e)},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        events = stream_quiz_generation(
+            user=request.user if request.user.is_authenticated else None,
+            topic=topic,
+            language=language,
+            category=category,
+            num_questions=num_questions,
+            difficulty=difficulty,
+            question_preference=question_preference,
+            content=content_source,
+            use_cache=use_cache,
+        )
+
+        caller = caller_key(request)
+
+        def event_stream():
+            try:
+                # The stream runs after the request middleware, so name the caller here
+                with llm_context(caller=caller):
+                    for event, data in events:
+                        yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'message': str(e)})}\n\n"
+            finally:
+                # Runs the generator's cleanup now when the client disconnects
+                events.close()
+
+        response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # don't let nginx buffer the stream
+        return response
+
 @api_view(['POST'])
 def chat_assistant(request):
     """
     Simple API endpoint to handle chat queries using your assistant function.
+    Logged-in users keep one conversation. Guests get a `session_id` in the reply and
+    send it back to keep theirs; only ids issued by the server are accepted.
     """
     query = request.data.get('query', '').strip()
 
@@ -251,9 +376,17 @@ def chat_assistant(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    conversation, session_id = get_api_conversation(request.user, str(request.data.get('session_id', '')))
     try:
-        response = assistant(query)
-        return Response({"response": response}, status=status.HTTP_200_OK)
+        response = ask_assistant(conversation, query)
+        data = {"response": response, "session_id": session_id} if session_id else {"response": response}
+        return Response(data, status=status.HTTP_200_OK)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except LLMBusyError as e:
+        return llm_busy_response(e)
+    except LLMTimeoutError:
+        raise  # RequestDeadlineMiddleware answers with 504
     except Exception as e:
         # Optional: log the error before returning response
         print(f"Error in chat_assistant: {e}")
@@ -262,6 +395,52 @@ def chat_assistant(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+def chat_assistant_stream(request):
+    """
+    chat_assistant as Server-Sent Events: "token" events while the assistant writes
+    its reply, then "done" with the whole reply. The turn is saved once it is complete.
+    A guest's session id is sent in the X-Session-Id header.
+    """
+    query = request.data.get('query', '').strip()
+
+    if not query:
+        return Response(
+            {"error": "Query is required."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    conversation, session_id = get_api_conversation(request.user, str(request.data.get('session_id', '')))
+    try:
+        chunks = prime_stream(stream_assistant_reply(conversation, query))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except LLMBusyError as e:
+        return llm_busy_response(e)
+    except LLMTimeoutError:
+        raise  # RequestDeadlineMiddleware answers with 504
+    except Exception as e:
+        print(f"Error in chat_assistant_stream: {e}")
+        return Response(
+            {"error": "Something went wrong while processing your request."},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    def event_stream():
+        try:
+            for event, data in chat_events(chunks):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            print(f"Error in chat_assistant_stream: {e}")
+            yield f"event: error\ndata: {json.dumps({'message': 'The reply was interrupted.'})}\n\n"
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    if session_id:
+        response["X-Session-Id"] = session_id
+    return response
+
 class UpdatePreferencesAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -309,6 +488,25 @@ class UpdatePreferencesAPIView(APIView):
                 status=status.HTTP_200_OK
             )
 
+class MetricsAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        """
+        Performance counters of this worker process.
+        """
+        return Response(
+            {
+                "grading_cache": verdict_cache.stats(),
+                "generation_cache": generation_cache_stats(),
+                "url_cache": url_cache_stats(),
+                "document_store": document_store_stats(),
+                "llm_governor": governor_stats(),
+                "llm_calls": llm_attempts.stats(),
+            },
+            status=status.HTTP_200_OK
+        )
+
 class QuizPagination(PageNumberPagination):
     page_size = 5
     page_size_query_param = 'page_size'
@@ -967,14 +1165,40 @@ class ResultView(APIView):
             return Response({"error": "No attempt found for this quiz."}, status=status.HTTP_404_NOT_FOUND)
         
         total_questions = quiz.questions.count()
+
+        # Async grading still running: report progress only
+        if attempt.status in ["pending", "grading"]:
+            return Response({
+                "quiz": {
+                    "id": quiz.id,
+                    "topic": quiz.topic,
+                },
+                "attempt": {
+                    "id": attempt.id,
+                    "status": attempt.status,
+                    "graded_questions": len(attempt.results),
+                    "total_questions": total_questions,
+                    "date_attempted": attempt.created_at,
+                },
+            }, status=status.HTTP_200_OK)
+
+        # A failed attempt only has the answers graded before the AI gave up
+        failed = attempt.status == "failed"
         correct_answers = attempt.score
-        incorrect_answers = total_questions - correct_answers
+        incorrect_answers = (len(attempt.results) if failed else total_questions) - correct_answers
 
         # Prepare incorrect question details
         incorrect_questions = []
         for question in quiz.questions.all():
             user_answer = attempt.answers.get(str(question.id)) if attempt.answers else None
-            if user_answer != question.answer:
+            if failed and str(question.id) not in attempt.results:
+                continue
+            if attempt.results:
+                is_correct = attempt.results.get(str(question.id), False)
+            else:
+                # Attempts graded before verdicts were stored
+                is_correct = user_answer == question.answer
+            if not is_correct:
                 incorrect_questions.append({
                     "id": question.id,
                     "text": question.text,
@@ -995,12 +1219,34 @@ class ResultView(APIView):
                 "total_questions": total_questions,
                 "correct_answers": correct_answers,
                 "incorrect_count": incorrect_answers,
+                "status": attempt.status,
                 "date_attempted": attempt.created_at,
             },
             "incorrect_questions": incorrect_questions,
         }
+        if failed:
+            data["attempt"]["graded_questions"] = len(attempt.results)
+            data["error"] = "Some answers could not be graded. POST to this URL to grade them again."
         return Response(data, status=status.HTTP_200_OK)
 
+    def post(self, request, quiz_id):
+        """
+        Grades the remaining answers of a failed attempt again.
+        """
+        quiz = get_object_or_404(Quiz, id=quiz_id)
+        attempt = QuizAttempt.objects.filter(user=request.user, quiz=quiz).order_by('-created_at').first()
+        if not attempt:
+            return Response({"error": "No attempt found for this quiz."}, status=status.HTTP_404_NOT_FOUND)
+        if not retry_failed_attempt(attempt):
+            return Response({"error": "Only a failed attempt can be graded again."}, status=status.HTTP_409_CONFLICT)
+        return Response({
+            "attempt_id": attempt.id,
+            "quiz_id": quiz.id,
+            "status": attempt.status,
+            "graded_questions": len(attempt.results),
+            "total_questions": quiz.questions.count(),
+        }, status=status.HTTP_202_ACCEPTED)
+
 # class QuizSubmitView(APIView):
 #     permission_classes = [IsAuthenticated]  # Auth for both GET and POST
 
@@ -1097,28 +1343,43 @@ class QuizSubmitView(APIView):
             )
             created = True  # Newly created in this branch
 
-        # Calculate marks (same logic for both)
-        marks = 0
-        for question in questions:
-            user_answer = user_answers.get(str(question.id))
-            if not user_answer:
-                continue
+        total_questions = questions.count()
 
-            if question.question_type == "SHORT":
-                if check_short_answer(user_answer, question.answer):
-                    marks += 1
-            elif question.question_type == "MCQ":
-                if check_multiple_choice(user_answer, question.answer):
-                    marks += 1
-            elif user_answer.strip().lower() == question.answer.strip().lower():
-                marks += 1
+        # Async mode: grade locally now, leave the AI-graded questions to the worker
+        async_mode = str(request.data.get("async", settings.GRADING_ASYNC)).lower() in ["true", "1", "yes", "on"]
+        queued = async_mode and queue_attempt_grading(attempt, questions, user_answers)
+
+        if async_mode and not queued:
+            # Every answer was graded locally, queue_attempt_grading saved the attempt
+            marks = attempt.score
+        elif not queued:
+            # Calculate marks (same logic for both, one batched AI call)
+            try:
+                marks, results = grade_submission(questions, user_answers)
+            except LLMBusyError:
+                # The AI is saturated: hand the AI-graded questions to the worker instead
+                if not queue_attempt_grading(attempt, questions, user_answers):
+                    raise
+                queued = True
+
+        if queued:
+            return Response({
+                "attempt_id": attempt.id,
+                "quiz_id": quiz.id,
+                "status": attempt.status,
+                "graded_questions": len(attempt.results),
+                "total_questions": total_questions,
+                "is_retake": is_retake,
+            }, status=status.HTTP_202_ACCEPTED)
 
-        # Update attempt
-        attempt.score = marks
-        attempt.answers = user_answers
-        attempt.save()
+        if not async_mode:
+            # Update attempt
+            attempt.score = marks
+            attempt.answers = user_answers
+            attempt.results = {str(question_id): correct for question_id, correct in results.items()}
+            attempt.status = "graded"
+            attempt.save()
 
-        total_questions = questions.count()
         result_summary = {
             "attempt_id": attempt.id,
             "quiz_id": quiz.id,
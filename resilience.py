@@ -0,0 +1,420 @@
+import time
+import asyncio
+import random
+import threading
+import contextvars
+from collections import deque, Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from governor import (
+    governed_call, agoverned_call, acquire_slot, aacquire_slot, try_acquire_slot,
+    current_deadline, remaining_budget, LLMBusyError, LLMTimeoutError,
+)
+
+POLICY_SETTINGS = getattr(settings, "LLM_CALL_POLICY", {})
+CALL_TIMEOUT = POLICY_SETTINGS.get("CALL_TIMEOUT", 45)
+MAX_ATTEMPTS = POLICY_SETTINGS.get("MAX_ATTEMPTS", 3)
+BACKOFF = POLICY_SETTINGS.get("BACKOFF", 0.5)
+MAX_BACKOFF = POLICY_SETTINGS.get("MAX_BACKOFF", 8)
+MIN_ATTEMPT_TIME = POLICY_SETTINGS.get("MIN_ATTEMPT_TIME", 1)
+REQUEST_BUDGET = POLICY_SETTINGS.get("REQUEST_BUDGET", 60)
+HEDGE = POLICY_SETTINGS.get("HEDGE", False)
+HEDGE_PERCENTILE = POLICY_SETTINGS.get("HEDGE_PERCENTILE", 95)
+HEDGE_MIN_DELAY = POLICY_SETTINGS.get("HEDGE_MIN_DELAY", 2)
+HEDGE_MIN_SAMPLES = POLICY_SETTINGS.get("HEDGE_MIN_SAMPLES", 20)
+
+# Upstream errors worth retrying (rate limits, overload, timeouts, dropped connections)
+TRANSIENT_ERROR_NAMES = {
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "InternalServerError",
+    "TooManyRequests",
+    "LLMBusyError",
+    "Aborted",
+    "ConnectionError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "Timeout",
+}
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    True for errors that may succeed when the same call is retried later.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def is_retryable(error: Exception) -> bool:
+    # Refusals of the governor are retried by the worker queues, not in the request
+    return is_transient_error(error) and not isinstance(error, LLMBusyError)
+
+
+class AttemptRecorder:
+    """
+    Outcome and latency of every AI call attempt, per priority class, for tuning
+    timeouts and the hedge delay. Keeps counters plus a window of recent attempts.
+    """
+
+    def __init__(self, window=500):
+        self.lock = threading.Lock()
+        self.outcomes = {}
+        self.latencies = {}
+        self.recent = deque(maxlen=window)
+        self.window = window
+
+    def record(self, kind, attempt, outcome, latency, hedged=False, error=None) -> None:
+        with self.lock:
+            self.outcomes.setdefault(kind, Counter())[outcome] += 1
+            if hedged:
+                self.outcomes[kind]["hedged"] += 1
+            if outcome == "ok":
+                self.latencies.setdefault(kind, deque(maxlen=self.window)).append(latency)
+            self.recent.append({
+                "kind": kind,
+                "attempt": attempt,
+                "outcome": outcome,
+                "latency_ms": round(1000 * latency, 1),
+                "hedged": hedged,
+                "error": type(error).__name__ if error else None,
+                "at": time.time(),
+            })
+
+    def count(self, kind, outcome) -> None:
+        with self.lock:
+            self.outcomes.setdefault(kind, Counter())[outcome] += 1
+
+    def percentile(self, kind, percentile):
+        with self.lock:
+            samples = sorted(self.latencies.get(kind, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def stats(self) -> dict:
+        with self.lock:
+            kinds = {}
+            for kind, counts in self.outcomes.items():
+                samples = sorted(self.latencies.get(kind, ()))
+                kinds[kind] = {
+                    **counts,
+                    "p50_ms": round(1000 * samples[len(samples) // 2], 1) if samples else None,
+                    "p95_ms": round(1000 * samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1) if samples else None,
+                }
+            return {"by_priority": kinds, "recent": list(self.recent)[-20:]}
+
+
+attempts = AttemptRecorder()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ThreadPoolExecutor:
+    """
+    Threads the attempts run on, so a caller can stop waiting at its timeout.
+    A timed out attempt keeps its thread, and its governor slot, until the upstream call returns.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=POLICY_SETTINGS.get("POOL_SIZE", 32), thread_name_prefix="llm-call"
+                )
+    return _pool
+
+
+def submit_call(fn, messages, release):
+    """
+    Starts fn(messages) on the pool; `release` gives its governor slot back when the call ends.
+    """
+    try:
+        future = get_pool().submit(contextvars.copy_context().run, fn, messages)
+    except BaseException:
+        release()
+        raise
+    future.add_done_callback(lambda _: release())
+    return future
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Gives the AI calls in this block at most `seconds` in total, retries included.
+    A tighter outer deadline wins.
+    """
+    until = time.monotonic() + seconds
+    outer = current_deadline.get()
+    token = current_deadline.set(min(until, outer) if outer else until)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def backoff_delay(attempt) -> float:
+    """
+    Exponential backoff with full jitter before retry number `attempt`.
+    """
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2 ** (attempt - 1)))
+
+
+def hedge_delay(kind):
+    if not HEDGE:
+        return None
+    p = attempts.percentile(kind, HEDGE_PERCENTILE)
+    return None if p is None else max(HEDGE_MIN_DELAY, p)
+
+
+def run_attempt(fn, messages, timeout, kind, release):
+    """
+    Runs one attempt with a timeout. With hedging on, a second identical request is
+    fired once the attempt is slower than the usual p95 and the first answer wins.
+    Every request holds its own governor slot until it really ends: `release` is the
+    slot of the first one, a hedge is only sent if another slot is free right away.
+    - returns: (response, hedged)
+    """
+    started = time.monotonic()
+    primary = submit_call(fn, messages, release)
+    pending = {primary}
+
+    delay = hedge_delay(kind)
+    hedged = False
+    if delay is not None and delay < timeout:
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            hedge_release = try_acquire_slot()
+            if hedge_release is None:
+                attempts.count(kind, "hedge_skipped")
+            else:
+                pending.add(submit_call(fn, messages, hedge_release))
+                hedged = True
+
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0, started + timeout - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            # The requests keep running, and keep their slots, until the upstream answers
+            attempts.count(kind, "abandoned")
+            raise LLMTimeoutError(f"The AI did not answer within {timeout:.1f}s.")
+        for future in done:
+            if future.exception() is None:
+                return future.result(), hedged
+            error = future.exception()
+    raise error
+
+
+def attempt_timeout():
+    """
+    Timeout of the next attempt: CALL_TIMEOUT capped by the remaining deadline.
+    Raises LLMTimeoutError when the budget can't fit a useful attempt.
+    """
+    remaining = remaining_budget()
+    if remaining is None:
+        return CALL_TIMEOUT
+    if remaining < MIN_ATTEMPT_TIME:
+        raise LLMTimeoutError("The request ran out of time for the AI call.")
+    return min(CALL_TIMEOUT, remaining)
+
+
+def retry_delay(attempt, error) -> float:
+    """
+    Seconds to wait before retry `attempt` + 1, or re-raises `error` when retrying is pointless.
+    """
+    if attempt >= MAX_ATTEMPTS or not is_retryable(error):
+        raise error
+    delay = backoff_delay(attempt)
+    remaining = remaining_budget()
+    if remaining is not None and remaining - delay < MIN_ATTEMPT_TIME:
+        raise error
+    return delay
+
+
+def invoke_with_policy(fn, messages, kind):
+    """
+    Calls fn(messages) through the governor with a per-attempt timeout derived from
+    the request's remaining budget, jittered exponential backoff on retryable errors
+    and optional hedging. Every attempt is recorded.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        timeout = attempt_timeout()
+        started = time.monotonic()
+        hedged = False
+        try:
+            # Only the first attempt is charged to the caller's rate limit
+            release = acquire_slot(kind, charge=attempt == 1)
+            response, hedged = run_attempt(fn, messages, timeout, kind, release)
+        except LLMBusyError:
+            raise
+        except Exception as e:
+            outcome = "timeout" if isinstance(e, LLMTimeoutError) else "error"
+            attempts.record(kind, attempt, outcome, time.monotonic() - started, hedged, e)
+            time.sleep(retry_delay(attempt, e))
+            continue
+        attempts.record(kind, attempt, "ok", time.monotonic() - started, hedged)
+        return response
+
+
+def stream_with_policy(fn, messages, kind):
+    """
+    Streaming counterpart of invoke_with_policy. Failures before the first chunk are
+    retried; once text has been sent to the client the error is raised as is.
+    Chunks are not timed out individually, the backend's own timeout applies.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        attempt_timeout()
+        started = time.monotonic()
+        sent = False
+        try:
+            with governed_call(kind, charge=attempt == 1):
+                for chunk in fn(messages):
+                    sent = True
+                    yield chunk
+        except LLMBusyError:
+            raise
+        except Exception as e:
+            attempts.record(kind, attempt, "error", time.monotonic() - started, error=e)
+            if sent:
+                raise
+            time.sleep(retry_delay(attempt, e))
+            continue
+        attempts.record(kind, attempt, "ok", time.monotonic() - started)
+        return
+
+
+def start_task(afn, messages, release):
+    """
+    Starts afn(messages) as a task; `release` gives its governor slot back when the task ends.
+    """
+    task = asyncio.ensure_future(afn(messages))
+    task.add_done_callback(lambda _: release())
+    return task
+
+
+async def arun_attempt(afn, messages, timeout, kind, release):
+    """
+    run_attempt for coroutines. Requests still running at the end, the losing request
+    of a hedge or all of them on a timeout, are cancelled and give their slot back then.
+    - returns: (response, hedged)
+    """
+    started = time.monotonic()
+    pending = {start_task(afn, messages, release)}
+
+    delay = hedge_delay(kind)
+    hedged = False
+    if delay is not None and delay < timeout:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            hedge_release = try_acquire_slot()
+            if hedge_release is None:
+                attempts.count(kind, "hedge_skipped")
+            else:
+                pending.add(start_task(afn, messages, hedge_release))
+                hedged = True
+
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0, started + timeout - time.monotonic()), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                raise LLMTimeoutError(f"The AI did not answer within {timeout:.1f}s.")
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), hedged
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def ainvoke_with_policy(afn, messages, kind):
+    """
+    invoke_with_policy for coroutines: awaits afn(messages) without holding a thread.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        timeout = attempt_timeout()
+        started = time.monotonic()
+        hedged = False
+        try:
+            release = await aacquire_slot(kind, charge=attempt == 1)
+            response, hedged = await arun_attempt(afn, messages, timeout, kind, release)
+        except LLMBusyError:
+            raise
+        except Exception as e:
+            outcome = "timeout" if isinstance(e, LLMTimeoutError) else "error"
+            attempts.record(kind, attempt, outcome, time.monotonic() - started, hedged, e)
+            await asyncio.sleep(retry_delay(attempt, e))
+            continue
+        attempts.record(kind, attempt, "ok", time.monotonic() - started, hedged)
+        return response
+
+
+async def astream_with_policy(afn, messages, kind):
+    """
+    stream_with_policy for coroutines; afn(messages) is an async iterator of chunks.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        attempt_timeout()
+        started = time.monotonic()
+        sent = False
+        try:
+            async with agoverned_call(kind, charge=attempt == 1):
+                async for chunk in afn(messages):
+                    sent = True
+                    yield chunk
+        except LLMBusyError:
+            raise
+        except Exception as e:
+            attempts.record(kind, attempt, "error", time.monotonic() - started, error=e)
+            if sent:
+                raise
+            await asyncio.sleep(retry_delay(attempt, e))
+            continue
+        attempts.record(kind, attempt, "ok", time.monotonic() - started)
+        return
+
+
+class RequestDeadlineMiddleware:
+    """
+    Gives the AI calls of each request REQUEST_BUDGET seconds in total and
+    answers an exhausted budget with 504. Works in sync and async stacks.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with deadline(REQUEST_BUDGET):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with deadline(REQUEST_BUDGET):
+            return await self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, LLMTimeoutError):
+            return JsonResponse({"status": "error", "message": str(exception)}, status=exception.status_code)
+        return None
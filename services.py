@@ -1,20 +1,11 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.schema import SystemMessage, HumanMessage
-from langchain.memory import ConversationBufferMemory
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-api_key = os.getenv("AI_API_KEY")
-
-# Initialize model
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    verbose=True,
-    temperature=0.7,
-    google_api_key=api_key,
-    streaming=True,
-)
+import re
+import json
+import asyncio
+from llm import get_llm
+
+# The model is picked in settings.LLM_BACKEND (Gemini, or the offline stub for load tests).
+# Messages are plain {"role", "content"} dicts so importing this module doesn't load LangChain;
+# the backend and its client are only built on the first AI call.
 
 # System instructions
 system_message = """
@@ -61,23 +52,48 @@ Question Difficulty Levels:
 ...
 """
 
-def generate__quiz(
+# System instructions for structured (JSON) output, parsed by processing.parse_quiz_json
+json_system_message = """
+You are a helpful agent that creates quizzes. Reply with JSON only, no Markdown and no text around it.
+
+Rules:
+- Pick a category that best describes the topic (e.g., Science, History, Geography, Sports, Literature, etc.).
+- Write the questions and answers in the language the user specifies.
+- Write exactly the number of questions the user asks for.
+- Question types: "MCQ" (multiple choice), "TF" (true/false), "SHORT" (short answer), "FILL" (fill in the blank, mark the blank with ______).
+- If the user requests a mix, include different types.
+- Difficulty goes from 1 (very easy) to 5 (very hard); adjust the questions to the requested level and rate each one.
+- MCQ: 4 options without "a)" labels; the answer is the exact text of the correct option.
+- TF: the answer is "True" or "False". Other types have no options.
+
+Schema:
+{
+  "topic": "<topic>",
+  "category": "<category>",
+  "difficulty": <1-5>,
+  "questions": [
+    {"text": "<question>", "type": "MCQ|TF|SHORT|FILL", "options": ["<option>", ...], "answer": "<answer>", "difficulty": <1-5>}
+  ]
+}
+"""
+
+def build_quiz_messages(
     topic: str = "General",
     language: str = "English",
     category: str = "General",
     num_questions: int = 5,
     difficulty: int = 1,
     question_type: str = "mix",
-    content: str = None
-) -> str:
+    content: str = None,
+    structured: bool = False,
+    avoid: list = None,
+    part: tuple = None,
+) -> list:
     """
-    Generates a quiz using Gemini AI with flexible input.
-    - topic: default topic if nothing else is given
-    - content: can be user prompt, text, URL content, or file content
-    - language: language of quiz
-    - num_questions: how many questions
-    - difficulty: 1–5 scale
-    - question_type: mcq, true_false, short_answer, fill_blank, or mix
+    Builds the chat messages used to generate a quiz.
+    - structured: ask for JSON (see json_system_message) instead of the text format
+    - avoid: question texts the new questions must not repeat
+    - part: (number, count) of a fan-out chunk, so the chunks of one quiz ask different questions
     """
     # Build the base prompt
     if content:
@@ -94,74 +110,336 @@ def generate__quiz(
         f"Difficulty level: {difficulty}\n"
         f"Question type: {question_type}\n"
     )
+    if part:
+        prompt += (
+            f"\nThis is part {part[0]} of {part[1]} of a longer quiz. "
+            "Cover different aspects of the content than the other parts would.\n"
+        )
+    if avoid:
+        prompt += "\nDo not repeat or rephrase these existing questions:\n" + "\n".join(f"- {text}" for text in avoid)
 
-    # LangChain messages
-    messages = [
-        SystemMessage(content=system_message),
-        HumanMessage(content=prompt),
+    return [
+        {"role": "system", "content": json_system_message if structured else system_message},
+        {"role": "user", "content": prompt},
     ]
 
+def generate__quiz(
+    topic: str = "General",
+    language: str = "English",
+    category: str = "General",
+    num_questions: int = 5,
+    difficulty: int = 1,
+    question_type: str = "mix",
+    content: str = None,
+    structured: bool = False,
+    avoid: list = None,
+    part: tuple = None,
+) -> str:
+    """
+    Generates a quiz using Gemini AI with flexible input.
+    - topic: default topic if nothing else is given
+    - content: can be user prompt, text, URL content, or file content
+    - language: language of quiz
+    - num_questions: how many questions
+    - difficulty: 1–5 scale
+    - question_type: mcq, true_false, short_answer, fill_blank, or mix
+    - structured: return JSON for processing.parse_quiz_json instead of text
+    - avoid: question texts the new questions must not repeat
+    - part: (number, count) of a fan-out chunk
+    """
+    messages = build_quiz_messages(
+        topic, language, category, num_questions, difficulty, question_type, content, structured, avoid, part
+    )
+
     # Call Gemini
-    response = llm.invoke(messages)
+    response = get_llm("generation").invoke(messages)
     return response.content
 
-def check_short_answer(user_answer: str, correct_answer: str) -> bool:
-    system_message = """
-    You are a helpful assistant that checks short answers.
+async def agenerate__quiz(
+    topic: str = "General",
+    language: str = "English",
+    category: str = "General",
+    num_questions: int = 5,
+    difficulty: int = 1,
+    question_type: str = "mix",
+    content: str = None,
+    structured: bool = False,
+    avoid: list = None,
+    part: tuple = None,
+) -> str:
+    """
+    Async generate__quiz, for the ASGI views.
+    """
+    messages = build_quiz_messages(
+        topic, language, category, num_questions, difficulty, question_type, content, structured, avoid, part
+    )
+    response = await get_llm("generation").ainvoke(messages)
+    return response.content
+
+def build_repair_messages(invalid: list, language: str = "English") -> list:
+    return [
+        {"role": "system", "content": json_system_message},
+        {
+            "role": "user",
+            "content": (
+                "These quiz questions failed validation. Reply with a JSON array holding one corrected "
+                f"question per item, in {language}, following the question schema. "
+                "If a question can't be fixed, write a new one on the same subject.\n\n"
+                + json.dumps(invalid, ensure_ascii=False, default=str)
+            ),
+        },
+    ]
+
+def repair_quiz_questions(invalid: list, language: str = "English") -> str:
+    """
+    Asks the AI to fix only the questions that failed validation.
+    - invalid: list of {"item", "errors"} from processing.parse_quiz_items
+    Returns a JSON array with one corrected question per item.
+    """
+    response = get_llm("generation").invoke(build_repair_messages(invalid, language))
+    return response.content
+
+async def arepair_quiz_questions(invalid: list, language: str = "English") -> str:
+    response = await get_llm("generation").ainvoke(build_repair_messages(invalid, language))
+    return response.content
+
+def stream_quiz(
+    topic: str = "General",
+    language: str = "English",
+    category: str = "General",
+    num_questions: int = 5,
+    difficulty: int = 1,
+    question_type: str = "mix",
+    content: str = None
+):
+    """
+    Same as generate__quiz, but yields the quiz text in chunks while Gemini writes it.
+    """
+    messages = build_quiz_messages(topic, language, category, num_questions, difficulty, question_type, content)
+    for chunk in get_llm("generation").stream(messages):
+        if chunk.content:
+            yield chunk.content
+
+def answer_check_messages(user_answer: str, correct_answer: str, kind: str = "short answers") -> list:
+    system_message = f"""
+    You are a helpful assistant that checks {kind}.
     - Compare the user's answer with the correct answer.
     - Be lenient with minor spelling mistakes or synonyms.
     - Return True if the answer is correct, otherwise return False.
     """
-    messages = [
-        SystemMessage(content=system_message),
-        HumanMessage(content=f"User's answer: {user_answer}\nCorrect answer: {correct_answer}\nIs the user's answer correct?"),
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": f"User's answer: {user_answer}\nCorrect answer: {correct_answer}\nIs the user's answer correct?"},
     ]
-    response = llm.invoke(messages)
+
+def check_short_answer(user_answer: str, correct_answer: str) -> bool:
+    response = get_llm("grading").invoke(answer_check_messages(user_answer, correct_answer))
     return response.content.strip().lower() == "true"
 
 def check_multiple_choice(user_answer: str, correct_answer: str) -> bool:
+    response = get_llm("grading").invoke(answer_check_messages(user_answer, correct_answer, "MCQS answers"))
+    return response.content.strip().lower() == "true"
+
+async def acheck_answer(item: dict) -> bool:
+    """
+    Async single-answer check of a check_answers_batch item.
+    """
+    kind = "MCQS answers" if item.get("type") in ("MCQ", "TF") else "short answers"
+    response = await get_llm("grading").ainvoke(answer_check_messages(item["given"], item["expected"], kind))
+    return response.content.strip().lower() == "true"
+
+def build_batch_messages(items: list) -> list:
     system_message = """
-    You are a helpful assistant that checks MCQS answers.
-    - Compare the user's answer with the correct answer.
+    You are a helpful assistant that grades quiz answers.
+    - You receive a JSON list of items with an id, question type, question, correct answer and user's answer.
+    - Compare each user's answer with its correct answer.
     - Be lenient with minor spelling mistakes or synonyms.
-    - Return True if the answer is correct, otherwise return False.
+    - For multiple choice questions the user may answer with the option letter or the option text.
+    - Reply only with a JSON object mapping every id to true or false, e.g. {"12": true, "13": false}.
     """
-    messages = [
-        SystemMessage(content=system_message),
-        HumanMessage(content=f"User's answer: {user_answer}\nCorrect answer: {correct_answer}\nIs the user's answer correct?"),
+    payload = [
+        {
+            "id": str(item["id"]),
+            "type": item.get("type", "SHORT"),
+            "question": item.get("question", ""),
+            "correct_answer": item["expected"],
+            "user_answer": item["given"],
+        }
+        for item in items
+    ]
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
     ]
-    response = llm.invoke(messages)
-    return response.content.strip().lower() == "true"
 
-message_history = [
-    {
-        "role": "system",
-        "content": (
-            "You are a helpful assistant that guides about the app and answers general questions "
-            "about studies. The app name is Quiz Hippo. It is an educational app where students "
-            "can enroll, create quizzes on any topic via AI (using prompt, PDF, URL, or text). "
-            "Students can set difficulty, question types (T/F, short answer, multiple choice, fill in the blanks, or mixed), language, and number of questions. "
-            "Click 'generate quiz' and the quiz is ready. Quizzes can be shared with other students or teachers. "
-            "Students can attempt quizzes, view results, performance, and correct answers. "
-            "The AI name is Professor Hippo, who guides the user about the app. This app is for educational purposes only."
-        )
-    }
-]
+def check_answers_batch(items: list) -> dict:
+    """
+    Checks several answers of one submission with a single Gemini call.
+    - items: list of dicts with "id", "type", "question", "expected" and "given"
+    Returns a dict mapping every item id to True/False.
+    """
+    if not items:
+        return {}
+
+    response = get_llm("grading").invoke(build_batch_messages(items))
+    verdicts = parse_batch_verdicts(response.content)
+
+    results = {}
+    for item in items:
+        verdict = verdicts.get(str(item["id"]))
+        if verdict is None:
+            # The model skipped this item, check it on its own
+            if item.get("type") in ("MCQ", "TF"):
+                verdict = check_multiple_choice(item["given"], item["expected"])
+            else:
+                verdict = check_short_answer(item["given"], item["expected"])
+        results[item["id"]] = verdict
+    return results
+
+async def acheck_answers_batch(items: list) -> dict:
+    """
+    Async check_answers_batch; skipped items are checked concurrently.
+    """
+    if not items:
+        return {}
+
+    response = await get_llm("grading").ainvoke(build_batch_messages(items))
+    verdicts = parse_batch_verdicts(response.content)
 
-def assistant(query: str) -> str:
+    skipped = [item for item in items if verdicts.get(str(item["id"])) is None]
+    checked = await asyncio.gather(*(acheck_answer(item) for item in skipped))
+    results = {item["id"]: verdicts.get(str(item["id"])) for item in items}
+    results.update({item["id"]: verdict for item, verdict in zip(skipped, checked)})
+    return results
+
+def parse_batch_verdicts(response_text: str) -> dict:
     """
-    General-purpose AI model function with memory buffer for Gemini 2.0 Flash.
+    Reads the {id: true/false} object returned by check_answers_batch.
+    Tolerates markdown code fences and a list of {"id", "correct"} objects.
     """
-    global message_history
+    text = (response_text or "").strip()
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text, flags=re.IGNORECASE).strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        match = re.search(r"[\[{].*[\]}]", text, re.DOTALL)
+        if not match:
+            return {}
+        try:
+            data = json.loads(match.group(0))
+        except ValueError:
+            return {}
+
+    if isinstance(data, list):
+        data = {
+            entry.get("id"): entry.get("correct")
+            for entry in data
+            if isinstance(entry, dict)
+        }
+    if not isinstance(data, dict):
+        return {}
+
+    verdicts = {}
+    for key, value in data.items():
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip().lower() == "true"
+        verdicts[str(key)] = bool(value)
+    return verdicts
+
+ASSISTANT_SYSTEM_PROMPT = (
+    "You are a helpful assistant that guides about the app and answers general questions "
+    "about studies. The app name is Quiz Hippo. It is an educational app where students "
+    "can enroll, create quizzes on any topic via AI (using prompt, PDF, URL, or text). "
+    "Students can set difficulty, question types (T/F, short answer, multiple choice, fill in the blanks, or mixed), language, and number of questions. "
+    "Click 'generate quiz' and the quiz is ready. Quizzes can be shared with other students or teachers. "
+    "Students can attempt quizzes, view results, performance, and correct answers. "
+    "The AI name is Professor Hippo, who guides the user about the app. This app is for educational purposes only."
+)
+
 
-    # Add the user's message to history
-    message_history.append({"role": "user", "content": query})
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token) used for prompt budgeting.
+    """
+    return len(text or "") // 4 + 1
 
-    # Call Gemini LLM with the full history
-    response = llm.invoke(message_history)  # assuming llm.invoke works with a list of messages
 
-    # Add AI's response to history
-    message_history.append({"role": "assistant", "content": response.content})
+def build_assistant_messages(query: str, history=None, summary: str = "") -> list:
+    """
+    Build the assistant prompt: system prompt, rolling summary, recent turns, new query.
+    - history: list of {"role", "content"} dicts, oldest first
+    - summary: summary of older turns that no longer fit the window
+    """
+    messages = [{"role": "system", "content": ASSISTANT_SYSTEM_PROMPT}]
+    if summary:
+        messages.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation with this user:\n{summary}",
+        })
+    messages.extend(history or [])
+    messages.append({"role": "user", "content": query})
+    return messages
+
+
+def assistant(query: str, history=None, summary: str = "") -> str:
+    """
+    Ask Professor Hippo a question. The caller owns the conversation state and
+    passes in the recent turns (and the summary of older ones), so nothing is
+    shared between users.
+    """
+    response = get_llm().invoke(build_assistant_messages(query, history, summary))
+    return response.content
+
 
+async def aassistant(query: str, history=None, summary: str = "") -> str:
+    response = await get_llm().ainvoke(build_assistant_messages(query, history, summary))
     return response.content
 
+
+def stream_assistant(query: str, history=None, summary: str = ""):
+    """
+    Same as assistant, but yields the reply in chunks while the AI writes it.
+    """
+    for chunk in get_llm().stream(build_assistant_messages(query, history, summary)):
+        if chunk.content:
+            yield chunk.content
+
+
+async def astream_assistant(query: str, history=None, summary: str = ""):
+    async for chunk in get_llm().astream(build_assistant_messages(query, history, summary)):
+        if chunk.content:
+            yield chunk.content
+
+
+def build_summary_messages(summary: str, turns: list) -> list:
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You maintain a short running summary of a chat between a student and "
+                "Professor Hippo. Keep facts about the student, their goals and open questions. "
+                "Reply with the updated summary only, in at most 150 words."
+            ),
+        },
+        {
+            "role": "user",
+            "content": f"Current summary:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}",
+        },
+    ]
+
+
+def summarize_conversation(summary: str, turns: list) -> str:
+    """
+    Fold turns that fell out of the prompt window into the rolling summary.
+    - summary: the current summary (may be empty)
+    - turns: list of {"role", "content"} dicts, oldest first
+    """
+    return get_llm().invoke(build_summary_messages(summary, turns)).content.strip()
+
+
+async def asummarize_conversation(summary: str, turns: list) -> str:
+    response = await get_llm().ainvoke(build_summary_messages(summary, turns))
+    return response.content.strip()
@@ -14,7 +14,7 @@ document.addEventListener("DOMContentLoaded", () => {
     chatModal.classList.add("translate-x-full");
   });
 
-  chatForm.addEventListener("submit", (e) => {
+  chatForm.addEventListener("submit", async (e) => {
     e.preventDefault();
     const msg = chatInput.value.trim();
     if (!msg) return;
@@ -26,44 +26,47 @@ document.addEventListener("DOMContentLoaded", () => {
 
     chatMessages.scrollTop = chatMessages.scrollHeight;
     chatInput.value = "";
-  });
-});
-
-document.getElementById("chatForm").addEventListener("submit", async function(e) {
-    e.preventDefault();
-
-    let input = document.getElementById("chatInput");
-    let message = input.value.trim();
-    if (!message) return;
-
-    let chatBox = document.getElementById("chatMessages");
-
-    // Append user message
-    let userMsg = document.createElement("div");
-    userMsg.className = "bg-blue-500 text-white p-2 rounded-lg self-end max-w-[70%]";
-    userMsg.innerText = message;
-    chatBox.appendChild(userMsg);
-
-    input.value = "";
-    chatBox.scrollTop = chatBox.scrollHeight;
 
     // Send to Django backend
-    let formData = new FormData();
-    formData.append("query", message);
+    const formData = new FormData();
+    formData.append("query", msg);
 
     try {
-        let response = await fetch("/chat-assistant/", {
-            method: "POST",
-            body: formData
-        });
-        let data = await response.json();
+      const response = await fetch("/chat-assistant/stream/", {
+        method: "POST",
+        body: formData
+      });
+
+      const botMsg = document.createElement("div");
+      botMsg.className = "bg-gray-200 dark:bg-gray-700 p-2 rounded-lg self-start max-w-[70%]";
+      chatMessages.appendChild(botMsg);
 
-        let botMsg = document.createElement("div");
-        botMsg.className = "bg-gray-200 dark:bg-gray-700 p-2 rounded-lg self-start max-w-[70%]";
-        botMsg.innerText = data.response || "Error: No response";
-        chatBox.appendChild(botMsg);
-        chatBox.scrollTop = chatBox.scrollHeight;
+      if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        botMsg.innerText = data.error || data.message || "Error: No response";
+        return;
+      }
+
+      // Server-Sent Events: show the reply while the assistant writes it
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop();
+        for (const block of events) {
+          const event = (block.match(/^event: (.*)$/m) || [])[1];
+          const data = JSON.parse((block.match(/^data: (.*)$/m) || [])[1] || "{}");
+          if (event === "token") botMsg.innerText += data.text;
+          else if (event === "error") botMsg.innerText += "\n" + (data.message || "Error: No response");
+        }
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+      }
     } catch (err) {
-        console.error(err);
+      console.error(err);
     }
-});
\ No newline at end of file
+  });
+});